@@ -0,0 +1,84 @@
+"""Синтетический корпус вакансий для бенчмарков: детерминированный, в формате telegram_vacancies.json."""
+import random
+from datetime import datetime, timedelta
+
+TITLES = [
+    'Python разработчик', 'Senior Python Developer', 'Frontend разработчик (React)', 'Backend Developer (Go)',
+    'Менеджер проекта', 'Project Manager', 'Product Manager', 'Продакт менеджер', 'QA инженер',
+    'DevOps инженер', 'Data Analyst', 'Системный аналитик', 'UI/UX дизайнер', 'Графический дизайнер',
+    'SMM менеджер', 'Интернет-маркетолог', 'HR менеджер', 'Рекрутер', 'Java Developer', 'iOS разработчик',
+    'Менеджер по продажам', 'Копирайтер', 'Технический писатель', 'Team Lead', 'Junior Frontend Developer',
+]
+COMPANIES = ['Яндекс', 'Ozon', 'Tinkoff', 'Avito', 'SberTech', 'Kaspersky', 'VK', 'Skyeng', 'JetBrains',
+             'Wildberries', 'Lamoda', 'Selectel', 'Miro', 'Dodo', 'Точка', 'Контур', 'Альфа-Банк', 'МТС']
+STACK = ['Python', 'Django', 'FastAPI', 'PostgreSQL', 'Redis', 'Kafka', 'Docker', 'Kubernetes', 'React',
+         'TypeScript', 'Vue', 'Go', 'Java', 'Spring', 'Figma', 'SQL', 'Airflow', 'ClickHouse', 'Jira']
+PERKS = ['Удалённая работа', 'Гибкий график', 'ДМС', 'Офис в Москве', 'Релокация', 'Обучение за счёт компании',
+         'remote', 'Белая зарплата', 'Опцион', 'Компенсация спорта']
+LEVELS = ['Junior', 'Middle', 'Senior', 'Lead']
+CHANNELS = ['python_jobs', 'remote_it_jobs', 'devjobs', 'design_work', 'product_jobs', 'hr_job', 'qa_jobs']
+
+
+def make_post_text(rng: random.Random) -> str:
+    title = rng.choice(TITLES)
+    company = rng.choice(COMPANIES)
+    level = rng.choice(LEVELS)
+    stack = ', '.join(rng.sample(STACK, 4))
+    perks = '\n'.join(f"• {perk}" for perk in rng.sample(PERKS, 3))
+    salary_from = rng.randrange(60, 400, 10)
+    salary_line = rng.choice([
+        f"Зарплата: от {salary_from} 000 ₽",
+        f"Вилка: {salary_from}к – {salary_from + 80}к",
+        f"Salary: {salary_from * 12 // 100}k $",
+        "Зарплата по итогам собеседования",
+    ])
+    return (
+        f"#вакансия #{rng.choice(['remote', 'office', 'hybrid'])}\n"
+        f"{title} ({level})\n"
+        f"Компания: {company}\n"
+        f"{salary_line}\n\n"
+        f"Ищем {level.lower()} специалиста в команду. Стек: {stack}.\n"
+        f"Требования:\n• опыт от {rng.randint(1, 6)} лет\n• {rng.choice(STACK)} на уровне уверенного пользователя\n"
+        f"Условия:\n{perks}\n\n"
+        f"Откликаться: @{company.lower().replace(' ', '_')}_hr"
+    )
+
+
+def make_vacancy(i: int, rng: random.Random, now: datetime) -> dict:
+    text = make_post_text(rng)
+    lines = text.split('\n')
+    channel = rng.choice(CHANNELS)
+    salary_from = rng.randrange(60000, 400000, 10000)
+    return {
+        'id': f"tg_{channel}_{i}",
+        'name': lines[1][:80],
+        'employer': {'name': lines[2].replace('Компания: ', '')},
+        'salary': rng.choice([None, {'from': salary_from, 'to': salary_from + 80000, 'currency': 'RUR'},
+                              {'from': salary_from, 'to': None, 'currency': 'RUR'}]),
+        'alternate_url': f"https://t.me/{channel}/{i}",
+        'area': {'name': 'Remote' if 'remote' in text.lower() else 'Россия'},
+        'source': 'telegram',
+        'channel': f"@{channel}",
+        'text_hash': text[:100],
+        'full_text': text[:1000],
+        'parsed_at': (now - timedelta(minutes=i)).isoformat()
+    }
+
+
+def make_corpus(n: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    now = datetime(2026, 2, 1, 12, 0)
+    return [make_vacancy(i, rng, now) for i in range(n)]
+
+
+def make_texts(n: int, seed: int = 7) -> list:
+    """Смесь вакансий и обычных постов каналов — для is_job_posting и экстракторов."""
+    rng = random.Random(seed)
+    noise = [
+        'Друзья, завтра вебинар про карьеру в IT. Регистрация по ссылке в профиле канала.',
+        'Подборка полезных статей недели: как пройти собеседование и не выгореть.',
+        'Реклама. Курсы английского со скидкой 50% только до пятницы!',
+        'https://t.me/joinchat/abc',
+        'С праздником!',
+    ]
+    return [make_post_text(rng) if rng.random() < 0.7 else rng.choice(noise) for _ in range(n)]
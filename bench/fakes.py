@@ -0,0 +1,361 @@
+"""Локальные заглушки внешних сервисов: api.hh.ru, Trudvsem, OpenRouter, t.me/s и Telegram Bot API.
+
+    python bench/fakes.py --latency-ms 150 --error-rate 0.05
+
+Печатает переменные окружения, с которыми бот и парсер ходят в заглушки вместо настоящих сервисов.
+Задержка и доля ошибок задаются глобально и переопределяются по сервису: --service hh=300:0.1
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import collections
+from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SERVICES = ('hh', 'trudvsem', 'openrouter', 'tme', 'botapi')
+
+
+def _load(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return f.read() if name.endswith('.html') else json.load(f)
+
+
+@dataclass
+class ServiceConfig:
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    error_rate: float = 0.0
+
+
+@dataclass
+class FakeConfig:
+    default: ServiceConfig = field(default_factory=ServiceConfig)
+    services: dict = field(default_factory=dict)
+    llm_chunk_ms: float = 20  # пауза между SSE-чанками OpenRouter
+    llm_chunks: int = 40
+    # Bot API отвечает 429, как настоящий Telegram: больше 30 сообщений в секунду на бота
+    # или в среднем чаще 1 в секунду в чат (пачкой — до 20)
+    flood_limits: bool = False
+
+    def for_service(self, name):
+        return self.services.get(name, self.default)
+
+
+class FakeUpstreams:
+    """Все заглушки на одном порту, каждая под своим префиксом пути."""
+
+    def __init__(self, config: FakeConfig = None, seed: int = 0):
+        self.config = config or FakeConfig()
+        self.rng = random.Random(seed)
+        self.hh_search = _load('hh_vacancies.json')
+        self.hh_detail = _load('hh_vacancy.json')
+        self.trudvsem = _load('trudvsem_vacancies.json')
+        self.tme_pages = {
+            name[len('tme_s_'):-len('.html')]: _load(name)
+            for name in sorted(os.listdir(FIXTURES)) if name.startswith('tme_s_')
+        }
+        self.requests = {service: 0 for service in SERVICES}
+        # Bot API: что бот отправил в каждый чат
+        self.sent = {}
+        self._sent_changed = asyncio.Condition()
+        self._message_ids = itertools.count(1000)
+        self.flood_rejected = 0
+        self.webhook_url = ''
+        self.webhook_sets = 0
+        self._flood_global = collections.deque()
+        self._flood_chats = {}  # chat_id -> [токены, время]
+        self._runner = None
+        self.base_url = None
+
+    # --- общая обвязка: задержка и инъекция ошибок ---
+
+    async def _delay_or_fail(self, service):
+        self.requests[service] += 1
+        cfg = self.config.for_service(service)
+        delay = cfg.latency_ms + (self.rng.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        return cfg.error_rate and self.rng.random() < cfg.error_rate
+
+    # --- api.hh.ru ---
+
+    async def hh_vacancies(self, request):
+        if await self._delay_or_fail('hh'):
+            return web.json_response({'errors': [{'type': 'service_unavailable'}]}, status=503)
+        page = int(request.query.get('page', 0))
+        items = []
+        for item in self.hh_search['items']:
+            item = dict(item)
+            item['id'] = str(int(item['id']) + page * 1000)
+            items.append(item)
+        return web.json_response(dict(self.hh_search, items=items, page=page))
+
+    async def hh_vacancy(self, request):
+        if await self._delay_or_fail('hh'):
+            return web.json_response({'errors': [{'type': 'service_unavailable'}]}, status=503)
+        vacancy_id = request.match_info['vacancy_id']
+        return web.json_response(dict(self.hh_detail, id=vacancy_id, alternate_url=f"https://hh.ru/vacancy/{vacancy_id}"))
+
+    async def hh_areas(self, request):
+        """Небольшое дерево /areas: страна -> область -> город, как у hh.ru."""
+        def area(area_id, name, *children):
+            return {'id': area_id, 'name': name, 'areas': list(children)}
+        return web.json_response([
+            area('113', 'Россия',
+                 area('1', 'Москва'),
+                 area('2', 'Санкт-Петербург'),
+                 area('1261', 'Свердловская область', area('3', 'Екатеринбург'), area('1272', 'Нижний Тагил')),
+                 area('1620', 'Республика Татарстан', area('88', 'Казань')),
+                 area('1679', 'Нижегородская область', area('66', 'Нижний Новгород')),
+                 area('1202', 'Новосибирская область', area('4', 'Новосибирск'))),
+            area('40', 'Казахстан', area('160', 'Алматы')),
+        ])
+
+    # --- Trudvsem ---
+
+    async def trudvsem_vacancies(self, request):
+        """Страница offset по limit вакансий из фикстуры (повторяется с новыми id до meta.total)."""
+        if await self._delay_or_fail('trudvsem'):
+            return web.Response(status=502, text='Bad Gateway')
+        page = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', 100))
+        total = self.trudvsem['meta']['total']
+        source = self.trudvsem['results']['vacancies']
+        items = []
+        for n in range(page * limit, min(total, (page + 1) * limit)):
+            vacancy = dict(source[n % len(source)]['vacancy'])
+            vacancy['id'] = f"{vacancy['id']}-{n}"
+            items.append({'vacancy': vacancy})
+        meta = dict(self.trudvsem['meta'], limit=limit)
+        return web.json_response(dict(self.trudvsem, meta=meta, results={'vacancies': items} if items else {}))
+
+    # --- OpenRouter ---
+
+    async def openrouter(self, request):
+        body = await request.json()
+        if await self._delay_or_fail('openrouter'):
+            return web.json_response({'error': {'message': 'Provider returned error', 'code': 502}}, status=502)
+        words = ['Здравствуйте!', 'Увидел', 'вашу', 'вакансию', 'и', 'откликаюсь,', 'потому', 'что', 'у', 'меня',
+                 'есть', 'релевантный', 'опыт.']
+        chunks = [words[i % len(words)] + ' ' for i in range(self.config.llm_chunks)]
+        if not body.get('stream'):
+            await asyncio.sleep(self.config.llm_chunk_ms * len(chunks) / 1000)
+            return web.json_response({
+                'id': 'gen-fake', 'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(chunks)}, 'finish_reason': 'stop'}]
+            })
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        await response.write(b': OPENROUTER PROCESSING\n\n')
+        for chunk in chunks:
+            await asyncio.sleep(self.config.llm_chunk_ms / 1000)
+            event = {'id': 'gen-fake', 'choices': [{'index': 0, 'delta': {'content': chunk}, 'finish_reason': None}]}
+            await response.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    # --- t.me/s ---
+
+    async def tme_channel(self, request):
+        if await self._delay_or_fail('tme'):
+            return web.Response(status=429, text='Too Many Requests')
+        channel = request.match_info['channel']
+        pages = list(self.tme_pages.values())
+        html = self.tme_pages.get(channel) or pages[hash(channel) % len(pages)]
+        if 'before' in request.query:
+            html = self._older_page(html, int(request.query['before']))
+        return web.Response(text=html, content_type='text/html')
+
+    def _older_page(self, html, before):
+        """Та же страница, сдвинутая в прошлое: последнее сообщение — before-1, на час раньше за каждый номер."""
+        ids = [int(found) for found in re.findall(r'data-post="[^/"]+/(\d+)"', html)]
+        shift = max(ids) + 1 - before
+        if min(ids) - shift < 1:
+            # Дошли до начала канала
+            return re.sub(r'<div class="tgme_widget_message_wrap.*</div>', '', html, flags=re.S)
+
+        def older_time(match):
+            moment = datetime.fromisoformat(match.group(1)) - timedelta(hours=shift)
+            return f'datetime="{moment.isoformat()}"'
+        html = re.sub(r'(data-post="[^/"]+/|t\.me/[^/"]+/|before=|data-before="|data-post-id=")(\d+)',
+                      lambda match: f"{match.group(1)}{int(match.group(2)) - shift}", html)
+        return re.sub(r'datetime="([^"]+)"', older_time, html)
+
+    # --- Telegram Bot API ---
+
+    def _message(self, chat_id, text=None, message_id=None):
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'},
+            'text': text or '',
+        }
+
+    async def _record(self, chat_id, method, params):
+        async with self._sent_changed:
+            self.sent.setdefault(chat_id, []).append((time.perf_counter(), method, params))
+            self._sent_changed.notify_all()
+
+    def _flooded(self, chat_id):
+        now = time.monotonic()
+        window = self._flood_global
+        while window and window[0] < now - 1:
+            window.popleft()
+        if len(window) >= 30:
+            return True
+        tokens, updated = self._flood_chats.get(chat_id, (20.0, now))
+        tokens = min(20.0, tokens + (now - updated))
+        if tokens < 1:
+            self._flood_chats[chat_id] = [tokens, now]
+            return True
+        self._flood_chats[chat_id] = [tokens - 1, now]
+        window.append(now)
+        return False
+
+    async def bot_api(self, request):
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if method != 'getUpdates' and await self._delay_or_fail('botapi'):
+            return web.json_response({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                                      'parameters': {'retry_after': 1}}, status=429)
+        chat_id = params.get('chat_id')
+        chat_id = int(chat_id) if chat_id not in (None, '') else None
+        if self.config.flood_limits and chat_id is not None and self._flooded(chat_id):
+            self.flood_rejected += 1
+            return web.json_response({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                                      'parameters': {'retry_after': 1}}, status=429)
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot',
+                      'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+        elif method == 'getUpdates':
+            await asyncio.sleep(min(float(params.get('timeout') or 0), 1))
+            result = []
+        elif method in ('sendMessage', 'sendInvoice'):
+            result = self._message(chat_id, params.get('text') or params.get('title'))
+        elif method == 'setWebhook':
+            self.webhook_sets += 1
+            self.webhook_url = params.get('url') or ''
+            result = True
+        elif method == 'getWebhookInfo':
+            result = {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': 0}
+        elif method == 'editMessageText':
+            result = self._message(chat_id, params.get('text'), int(params.get('message_id') or 0)) if chat_id else True
+        else:
+            result = True
+        if chat_id is not None:
+            await self._record(chat_id, method, params)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def wait_for_message(self, chat_id, predicate, start_index=0, timeout=60):
+        """Ждёт, пока бот отправит в чат сообщение, удовлетворяющее predicate(method, params)."""
+        async with self._sent_changed:
+            def found():
+                for ts, method, params in self.sent.get(chat_id, [])[start_index:]:
+                    if predicate(method, params):
+                        return ts
+                return None
+            await asyncio.wait_for(self._sent_changed.wait_for(lambda: found() is not None), timeout)
+            return found()
+
+    def sent_count(self, chat_id):
+        return len(self.sent.get(chat_id, []))
+
+    # --- запуск ---
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/hh/vacancies', self.hh_vacancies)
+        app.router.add_get('/hh/areas', self.hh_areas)
+        app.router.add_get('/hh/vacancies/{vacancy_id}', self.hh_vacancy)
+        app.router.add_get('/trudvsem/api/v1/vacancies', self.trudvsem_vacancies)
+        app.router.add_get('/trudvsem/api/v1/vacancies/region/{region}', self.trudvsem_vacancies)
+        app.router.add_post('/openrouter/api/v1/chat/completions', self.openrouter)
+        app.router.add_get('/tme/s/{channel}', self.tme_channel)
+        app.router.add_post('/botapi/bot{token}/{method}', self.bot_api)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.env()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def env(self):
+        """Переменные окружения, перенаправляющие бот и парсер на заглушки."""
+        return {
+            'HH_API_URL': f"{self.base_url}/hh",
+            'TRUDVSEM_API_URL': f"{self.base_url}/trudvsem/api/v1",
+            'OPENROUTER_URL': f"{self.base_url}/openrouter/api/v1/chat/completions",
+            'TELEGRAM_WEB_URL': f"{self.base_url}/tme",
+            'TELEGRAM_API_URL': f"{self.base_url}/botapi",
+        }
+
+
+def config_from_args(args) -> FakeConfig:
+    config = FakeConfig(
+        default=ServiceConfig(args.latency_ms, args.jitter_ms, args.error_rate),
+        llm_chunk_ms=args.llm_chunk_ms,
+        llm_chunks=args.llm_chunks,
+    )
+    for spec in args.service or []:
+        name, _, values = spec.partition('=')
+        latency, _, error_rate = values.partition(':')
+        if name not in SERVICES:
+            raise SystemExit(f"Unknown service {name}, expected one of {', '.join(SERVICES)}")
+        config.services[name] = ServiceConfig(float(latency or 0), args.jitter_ms, float(error_rate or 0))
+    return config
+
+
+def add_fake_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=50, help='задержка ответа заглушек')
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов с ошибкой (0..1)')
+    parser.add_argument('--service', action='append', metavar='NAME=LATENCY_MS[:ERROR_RATE]',
+                        help=f"переопределение для сервиса: {', '.join(SERVICES)}")
+    parser.add_argument('--llm-chunk-ms', type=float, default=20)
+    parser.add_argument('--llm-chunks', type=int, default=40)
+
+
+async def _serve(args):
+    fakes = FakeUpstreams(config_from_args(args))
+    env = await fakes.start(args.host, args.port)
+    for key, value in env.items():
+        print(f"export {key}={value}")
+    sys.stdout.flush()
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    add_fake_arguments(parser)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
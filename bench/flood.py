@@ -0,0 +1,141 @@
+"""Очередь исходящих (bot/outbox.py) против прямых вызовов Bot API на заглушке с лимитами Telegram.
+
+    python bench/flood.py --chats 300 --interactive 30 --streams 10
+    python bench/flood.py --output bench/results/flood.json
+
+Одновременно: рассылка по --chats чатам (как уведомления по подпискам), --interactive ответов
+пользователям посреди рассылки и --streams «стримингов» — частых правок одного сообщения, как при
+генерации письма. Заглушка отвечает 429 сверх 30 сообщений в секунду и ~1 в секунду на чат.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import logging
+
+from telegram.error import TelegramError
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from fakes import FakeUpstreams, FakeConfig, ServiceConfig
+from outbox import OutboundScheduler, PRIORITY_BULK
+
+FAKE_TOKEN = '123456:FAKE-TOKEN'
+CHAT_BASE = 20_000_000
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(scheduled: bool, args) -> dict:
+    fakes = FakeUpstreams(FakeConfig(default=ServiceConfig(args.latency_ms, 0, 0), flood_limits=True))
+    env = await fakes.start()
+    # Пул соединений как у Application.builder(), иначе запросы упираются в одно соединение
+    bot = ExtBot(FAKE_TOKEN, base_url=f"{env['TELEGRAM_API_URL']}/bot",
+                 request=HTTPXRequest(connection_pool_size=256),
+                 rate_limiter=OutboundScheduler() if scheduled else None)
+    rng = random.Random(0)
+    errors = {}
+    latencies = []
+    bulk_args = {'rate_limit_args': {'priority': PRIORITY_BULK}} if scheduled else {}
+
+    async def call(coro):
+        try:
+            return await coro
+        except TelegramError as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return None
+
+    async def bulk(n):
+        await call(bot.send_message(CHAT_BASE + n, f"🔔 Новые вакансии #{n}", **bulk_args))
+
+    async def interactive(n):
+        await asyncio.sleep(rng.uniform(0, args.spread_s))
+        started = time.perf_counter()
+        if await call(bot.send_message(CHAT_BASE + args.chats + n, "Найдено 20 вакансий")) is not None:
+            latencies.append(time.perf_counter() - started)
+
+    async def stream(n):
+        chat_id = CHAT_BASE + args.chats + args.interactive + n
+        message = await call(bot.send_message(chat_id, "⏳ Пишу письмо..."))
+        if message is None:
+            return
+        text = ""
+        edits = []
+        for chunk in range(args.stream_edits):
+            text += f"слово{chunk} "
+            edits.append(asyncio.create_task(call(bot.edit_message_text(text, chat_id, message.message_id))))
+            await asyncio.sleep(0.1)
+        await asyncio.gather(*edits)
+
+    async with bot:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(bulk(n) for n in range(args.chats)),
+            *(interactive(n) for n in range(args.interactive)),
+            *(stream(n) for n in range(args.streams)),
+        )
+        wall = time.perf_counter() - started
+        coalesced = bot.rate_limiter.coalesced if scheduled else 0
+    delivered = sum(len(sent) for sent in fakes.sent.values())
+    await fakes.stop()
+    return {
+        'mode': 'outbox' if scheduled else 'direct',
+        'wall_s': round(wall, 2),
+        'delivered': delivered,
+        'delivered_per_s': round(delivered / wall, 1),
+        'telegram_429': fakes.flood_rejected,
+        'errors': errors,
+        'coalesced_edits': coalesced,
+        'interactive_p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        'interactive_p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        'interactive_ok': len(latencies),
+    }
+
+
+async def main_async(args):
+    return [await run(False, args), await run(True, args)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=300, help='чатов в рассылке')
+    parser.add_argument('--interactive', type=int, default=30, help='ответов пользователям во время рассылки')
+    parser.add_argument('--spread-s', type=float, default=5, help='за сколько секунд приходят ответы пользователям')
+    parser.add_argument('--streams', type=int, default=10, help='сообщений, правящихся как при стриминге')
+    parser.add_argument('--stream-edits', type=int, default=40, help='правок на сообщение (раз в 100 мс)')
+    parser.add_argument('--latency-ms', type=float, default=30, help='задержка ответа Bot API')
+    parser.add_argument('--output', help='куда записать JSON с результатами (по умолчанию stdout)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    report = asyncio.run(main_async(args))
+    for result in report:
+        print(f"{result['mode']:7} {result['wall_s']:6.1f}s  {result['delivered_per_s']:5.1f} req/s  "
+              f"429: {result['telegram_429']:4}  errors: {sum(result['errors'].values()):4}  "
+              f"interactive p95: {result['interactive_p95_ms']} ms  coalesced: {result['coalesced_edits']}",
+              file=sys.stderr)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
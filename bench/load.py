@@ -0,0 +1,290 @@
+"""Нагрузочный стенд: N симулированных пользователей проходят весь диалог бота на локальных заглушках.
+
+    python bench/load.py --users 50 --ramp-s 5
+    python bench/load.py --users 200 --service openrouter=100:0.05 --output bench/results/load.json
+    python bench/load.py --users 50 --webhook   # апдейты идут POST-запросами через вебхук-сервер бота
+
+Шаги: /start → резюме → пожелания → поиск → вакансия → письмо. Задержка шага — от попадания
+апдейта в очередь Application до ответа бота в Bot API (для письма — до сообщения со ссылкой после генерации).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import logging
+
+from fakes import FakeUpstreams, add_fake_arguments, config_from_args
+from corpus import make_corpus
+
+FAKE_TOKEN = '123456:FAKE-TOKEN'
+WEBHOOK_SECRET = 'load-test-secret'
+USER_ID_BASE = 10_000_000
+RESUME_TEXT = (
+    "Иван Петров\nPython разработчик\nОпыт работы\n"
+    "2021–2026 ACME — backend на Python, FastAPI, PostgreSQL, Kafka. Вёл миграцию монолита на сервисы.\n"
+    "Навыки\nPython, SQL, Docker, Kubernetes, asyncio\nОбразование\nМГТУ им. Баумана"
+)
+
+
+def _contains(*needles):
+    return lambda method, params: method in ('sendMessage', 'editMessageText') and any(
+        needle in (params.get('text') or '') for needle in needles)
+
+
+# (имя шага, тип апдейта, данные, признак ответа, признак успешного ответа)
+STEPS = [
+    ('start', 'message', '/start', _contains('Шаг 1'), _contains('Шаг 1')),
+    ('resume', 'message', RESUME_TEXT, _contains('Шаг 2', 'слишком короткое'), _contains('Шаг 2')),
+    ('prefs', 'message', 'удалёнка, от 150к, Москва', _contains('Шаг 3'), _contains('Шаг 3')),
+    ('search', 'message', 'python разработчик', _contains('Найдено', 'не найдены', 'Ошибка'), _contains('Найдено')),
+    ('vacancy', 'callback', 'vac_0', _contains('Что сделать?', 'Ошибка'), _contains('Что сделать?')),
+    ('cover', 'callback', 'gen_cover', _contains('Ссылка:', 'Ошибка', 'счёт'), _contains('Ссылка:')),
+]
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'Load{user_id}', 'language_code': 'ru'}
+
+    def message(self, user_id, text):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def callback(self, user_id, data):
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self._message_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'},
+                    'text': '...',
+                },
+            },
+        }
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class QueueDelivery:
+    """Апдейты кладутся прямо в очередь Application, как это делает run_polling."""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def deliver(self, raw):
+        from telegram import Update
+        await self.application.update_queue.put(Update.de_json(raw, self.application.bot))
+
+
+class WebhookDelivery:
+    """Апдейты отправляются POST-запросом во встроенный вебхук-сервер бота, как это делает Telegram."""
+
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+
+    async def deliver(self, raw):
+        from webhook import SECRET_HEADER
+        async with self.session.post(self.url, json=raw, headers={SECRET_HEADER: WEBHOOK_SECRET}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"Webhook returned HTTP {response.status}")
+
+
+async def simulate_user(index, delivery, fakes, factory, args, stats):
+    user_id = USER_ID_BASE + index
+    await asyncio.sleep(args.ramp_s * index / max(args.users, 1))
+    for name, kind, data, is_reply, is_success in STEPS:
+        if name == 'resume':
+            # Разные резюме — иначе после первого пользователя письма отдаются из кэша
+            data = f"{data}\nКонтакты: load{user_id}@example.com"
+        raw = factory.message(user_id, data) if kind == 'message' else factory.callback(user_id, data)
+        start_index = fakes.sent_count(user_id)
+        started = time.perf_counter()
+        await delivery.deliver(raw)
+        step = stats[name]
+        try:
+            replied_at = await fakes.wait_for_message(user_id, is_reply, start_index, timeout=args.timeout)
+        except asyncio.TimeoutError:
+            step['timeouts'] += 1
+            return False
+        if not _last_matches(fakes, user_id, start_index, is_success):
+            step['errors'] += 1
+            return False
+        step['latencies'].append(replied_at - started)
+        if args.think_ms:
+            await asyncio.sleep(args.think_ms / 1000)
+    return True
+
+
+def _last_matches(fakes, user_id, start_index, predicate):
+    return any(predicate(method, params) for _, method, params in fakes.sent.get(user_id, [])[start_index:])
+
+
+def build_report(stats, completed, wall, args, fakes):
+    steps = {}
+    for name, *_ in STEPS:
+        step = stats[name]
+        latencies = step['latencies']
+        steps[name] = {
+            'ok': len(latencies),
+            'errors': step['errors'],
+            'timeouts': step['timeouts'],
+            'p50_ms': _ms(percentile(latencies, 50)),
+            'p95_ms': _ms(percentile(latencies, 95)),
+            'p99_ms': _ms(percentile(latencies, 99)),
+            'max_ms': _ms(max(latencies) if latencies else None),
+            'throughput_per_s': len(latencies) / wall if wall else None,
+        }
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'users': args.users,
+            'ramp_s': args.ramp_s,
+            'think_ms': args.think_ms,
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'service_overrides': args.service or [],
+            'delivery': 'webhook' if args.webhook else 'queue',
+        },
+        'wall_s': wall,
+        'flows_completed': completed,
+        'flows_per_s': completed / wall if wall else None,
+        'upstream_requests': dict(fakes.requests),
+        'steps': steps,
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def print_report(report):
+    print(f"\n{report['flows_completed']}/{report['meta']['users']} flows in {report['wall_s']:.1f}s "
+          f"({report['flows_per_s']:.2f} flows/s)", file=sys.stderr)
+    print(f"{'step':10} {'ok':>6} {'err':>5} {'t/o':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>8}",
+          file=sys.stderr)
+    for name, step in report['steps'].items():
+        fmt = lambda v: f"{v:>9.1f}" if v is not None else f"{'—':>9}"
+        print(f"{name:10} {step['ok']:>6} {step['errors']:>5} {step['timeouts']:>5} "
+              f"{fmt(step['p50_ms'])} {fmt(step['p95_ms'])} {fmt(step['p99_ms'])} {step['throughput_per_s']:>8.2f}",
+              file=sys.stderr)
+    print(f"upstream requests: {report['upstream_requests']}", file=sys.stderr)
+
+
+async def run(args):
+    fakes = FakeUpstreams(config_from_args(args))
+    env = await fakes.start()
+    workdir = tempfile.mkdtemp(prefix='bot-load-')
+    os.environ.update(env)
+    os.environ.update({
+        'OPENROUTER_API_KEY': 'fake',
+        'JOBS_DB': os.path.join(workdir, 'jobs.db'),
+        'LLM_CACHE_DB': os.path.join(workdir, 'llm_cache.db'),
+        'STATE_DB': os.path.join(workdir, 'state.db'),
+        'VACANCY_DB': os.path.join(workdir, 'vacancies.db'),
+        'SNAPSHOT_FILE': os.path.join(workdir, 'warm_snapshot.pickle'),
+        'OUTBOX_GLOBAL_RATE': str(args.outbox_rate),
+    })
+    # Модули бота читают адреса из окружения при импорте — импортируем после подмены
+    import main as bot
+    bot.STATS_FILE = os.path.join(workdir, 'stats.json')
+    bot.TELEGRAM_VACANCIES_FILE = os.path.join(workdir, 'telegram_vacancies.json')
+    with open(bot.TELEGRAM_VACANCIES_FILE, 'w', encoding='utf-8') as f:
+        json.dump(make_corpus(args.corpus), f, ensure_ascii=False)
+
+    application = bot.build_application(FAKE_TOKEN)
+    stats = {name: {'latencies': [], 'errors': 0, 'timeouts': 0} for name, *_ in STEPS}
+    factory = UpdateFactory()
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        server = session = None
+        if args.webhook:
+            import aiohttp
+            from webhook import WebhookServer
+            server = WebhookServer(application, listen='127.0.0.1', port=0, secret=WEBHOOK_SECRET)
+            await server.start()
+            session = aiohttp.ClientSession()
+            delivery = WebhookDelivery(session, f"http://127.0.0.1:{server.port}{server.path}")
+        else:
+            delivery = QueueDelivery(application)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            simulate_user(i, delivery, fakes, factory, args, stats) for i in range(args.users)
+        ))
+        wall = time.perf_counter() - started
+        if server:
+            await session.close()
+            await server.stop()
+        await application.stop()
+        await bot.post_stop(application)
+    await bot.post_shutdown(application)
+    await fakes.stop()
+    return build_report(stats, sum(results), wall, args, fakes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--ramp-s', type=float, default=2.0, help='за сколько секунд подключаются все пользователи')
+    parser.add_argument('--think-ms', type=float, default=0, help='пауза пользователя между шагами')
+    parser.add_argument('--timeout', type=float, default=60, help='сколько ждать ответа на шаг')
+    parser.add_argument('--corpus', type=int, default=500, help='размер локального корпуса Telegram-вакансий')
+    parser.add_argument('--output', help='куда записать JSON-отчёт')
+    parser.add_argument('--webhook', action='store_true', help='доставлять апдейты через вебхук-сервер, а не в очередь напрямую')
+    parser.add_argument('--outbox-rate', type=float, default=25,
+                        help='лимит исходящих сообщений бота в секунду (как у Telegram); 1000 — замер без лимита')
+    parser.add_argument('--verbose', action='store_true')
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
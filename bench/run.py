@@ -0,0 +1,218 @@
+"""Офлайн-бенчмарки горячих путей парсера и поиска.
+
+    python bench/run.py                          # все бенчмарки, JSON в stdout
+    python bench/run.py --sizes 500,10000 --output bench/results/before.json
+    python bench/run.py --output after.json --compare before.json --threshold 0.2
+
+С --compare печатается таблица изменений, код выхода 1 — если что-то замедлилось сильнее порога.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'bench', 'fixtures')
+sys.path.insert(0, os.path.join(ROOT, 'bot'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import logging
+logging.disable(logging.CRITICAL)
+
+import telegram_parser
+import main as bot
+from corpus import make_corpus, make_texts
+
+DEFAULT_SIZES = [500, 10000, 100000]
+TME_CHANNELS = ['python_jobs', 'remote_it_jobs', 'design_work']
+QUERIES = ['python разработчик', 'менеджер проекта', 'дизайнер', 'devops']
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return f.read() if name.endswith('.html') else json.load(f)
+
+
+class Results(dict):
+    """Результаты прогона; бенчмарки, не прошедшие --filter, не запускаются."""
+
+    def __init__(self, name_filter=''):
+        super().__init__()
+        self.name_filter = name_filter
+
+    def run(self, name, fn, **kwargs):
+        if self.name_filter in name:
+            self[name] = measure(fn, **kwargs)
+
+
+def measure(fn, items=1, repeat=5, min_time=0.2):
+    """Подбирает число вызовов так, чтобы один замер длился ~min_time, и возвращает статистику на вызов."""
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    median = statistics.median(timings)
+    return {
+        'items': items,
+        'calls': number * repeat,
+        'min_s': min(timings),
+        'median_s': median,
+        'mean_s': statistics.fmean(timings),
+        'stdev_s': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'items_per_s': items / median if median else None,
+    }
+
+
+def bench_parser(results, args):
+    for channel in TME_CHANNELS:
+        html = load_fixture(f'tme_s_{channel}.html')
+        results.run(f'parse_channel_web.extract[{channel}]',
+            lambda: telegram_parser.extract_vacancies(html, channel), items=20, repeat=args.repeat)
+
+    for size in args.sizes:
+        texts = make_texts(size)
+        results.run(f'is_job_posting[{size}]',
+            lambda: [telegram_parser.is_job_posting(t) for t in texts], items=size, repeat=args.repeat)
+        results.run(f'extract_salary[{size}]',
+            lambda: [telegram_parser.extract_salary(t) for t in texts], items=size, repeat=args.repeat)
+        results.run(f'extract_job_title[{size}]',
+            lambda: [telegram_parser.extract_job_title(t) for t in texts], items=size, repeat=args.repeat)
+
+
+def bench_search(results, args, workdir):
+    hh_items = load_fixture('hh_vacancies.json')['items']
+    for vac in hh_items:
+        vac['source'] = 'hh'
+    trudvsem_data = load_fixture('trudvsem_vacancies.json')
+    results.run('parse_trudvsem_response',
+        lambda: bot.parse_trudvsem_response(trudvsem_data, {'salary': 100000}), items=30, repeat=args.repeat)
+    tv_items = bot.parse_trudvsem_response(trudvsem_data, {})
+
+    for size in args.sizes:
+        corpus = make_corpus(size)
+        path = os.path.join(workdir, f'telegram_vacancies_{size}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(corpus, f, ensure_ascii=False)
+        bot.TELEGRAM_VACANCIES_FILE = path
+        prefs = {'salary': 150000}
+        results.run(f'search_telegram_vacancies[{size}]',
+            lambda: [bot.search_telegram_vacancies(q, prefs) for q in QUERIES],
+            items=size * len(QUERIES), repeat=args.repeat, min_time=0)
+
+        merged_input = hh_items + tv_items + corpus
+        results.run(f'search_vacancies.merge[{size}]',
+            lambda: bot.merge_vacancies(merged_input), items=len(merged_input), repeat=args.repeat)
+
+        unique = bot.merge_vacancies(merged_input)
+        last_page = max(0, (len(unique) - 1) // 10)
+        results.run(f'build_vacancy_keyboard[{size}]',
+            lambda: (bot.build_vacancy_keyboard(unique, 0), bot.build_vacancy_keyboard(unique, last_page)),
+            items=2, repeat=args.repeat)
+
+
+def bench_prompts(results, args):
+    import prompts
+    detail = load_fixture('hh_vacancy.json')
+    resume = '\n'.join(make_texts(40, seed=3))
+
+    def cold():
+        prompts._vacancy_digests.clear()
+        prompts._resume_digests.clear()
+        prompts.build_prompt('cover', resume, detail)
+
+    results.run('build_prompt.cold', cold, repeat=args.repeat)
+    results.run('build_prompt.warm', lambda: prompts.build_prompt('cover', resume, detail), repeat=args.repeat)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Печатает сравнение медиан; возвращает список замедлившихся бенчмарков."""
+    regressions = []
+    print(f"{'benchmark':48} {'baseline':>12} {'current':>12} {'change':>8}", file=sys.stderr)
+    for name, result in sorted(current['results'].items()):
+        base = baseline['results'].get(name)
+        if not base:
+            print(f"{name:48} {'—':>12} {result['median_s']:>12.6f} {'new':>8}", file=sys.stderr)
+            continue
+        change = result['median_s'] / base['median_s'] - 1 if base['median_s'] else 0.0
+        mark = ' !' if change > threshold else ''
+        print(f"{name:48} {base['median_s']:>12.6f} {result['median_s']:>12.6f} {change:>+7.1%}{mark}", file=sys.stderr)
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='размеры синтетического корпуса через запятую')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default='', help='запускать только бенчмарки, содержащие подстроку')
+    parser.add_argument('--output', help='куда записать JSON с результатами (по умолчанию stdout)')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление медианы (0.2 = 20%%)')
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    random.seed(0)
+    results = Results(args.filter)
+    with tempfile.TemporaryDirectory() as workdir:
+        bench_parser(results, args)
+        bench_search(results, args, workdir)
+        bench_prompts(results, args)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Время холодного старта бота: импорт и готовность поиска с перестройкой индекса и из снимка.
+
+    python bench/startup.py --sizes 10000,100000 --repeat 5
+    python bench/startup.py --output bench/results/startup.json
+
+Каждый замер — отдельный процесс Python (холодный импорт). Фазы:
+  import       — python + import main (зависимости, обработчики, хранилища)
+  cold_ready   — import + построение индекса из telegram_vacancies.json + первый поиск
+  warm_ready   — import + восстановление индекса и кэшей из снимка + первый поиск
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+from corpus import make_corpus
+
+DEFAULT_SIZES = [10000, 100000]
+QUERY = 'python разработчик'
+
+# Выполняется в дочернем процессе; печатает JSON с длительностями фаз от старта интерпретатора
+CHILD = r"""
+import os, sys, json, time
+started = time.perf_counter()
+sys.path.insert(0, os.path.join(sys.argv[1], 'bot'))
+import logging
+logging.disable(logging.CRITICAL)
+import main as bot
+imported = time.perf_counter()
+bot.TELEGRAM_VACANCIES_FILE = sys.argv[3]
+mode = sys.argv[2]
+if mode == 'warm':
+    bot.restore_snapshot()
+results = bot.search_telegram_vacancies(sys.argv[4], {}) if mode != 'import' else []
+ready = time.perf_counter()
+if mode == 'save':
+    bot.save_snapshot()
+print(json.dumps({'import_s': imported - started, 'ready_s': ready - started, 'results': len(results)}))
+"""
+
+
+def run_child(workdir, mode, corpus_path):
+    env = dict(os.environ)
+    env.update({
+        'STATE_DB': os.path.join(workdir, 'state.db'),
+        'VACANCY_DB': os.path.join(workdir, 'vacancies.db'),
+        'JOBS_DB': os.path.join(workdir, 'jobs.db'),
+        'LLM_CACHE_DB': os.path.join(workdir, 'llm_cache.db'),
+        'SNAPSHOT_FILE': os.path.join(workdir, 'warm_snapshot.pickle'),
+    })
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', CHILD, ROOT, mode, corpus_path, QUERY],
+                          env=env, capture_output=True, text=True, timeout=600)
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(f"{mode} child failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    # Время до запуска кода дочернего процесса (старт интерпретатора, site) тоже видно пользователю
+    result['wall_s'] = wall
+    return result
+
+
+def summarize(samples, field):
+    values = [s[field] for s in samples]
+    return {'median_s': statistics.median(values), 'min_s': min(values), 'max_s': max(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='размеры корпуса Telegram-вакансий через запятую')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='куда записать JSON с результатами (по умолчанию stdout)')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='bot-startup-') as workdir:
+        empty = os.path.join(workdir, 'missing.json')
+        samples = [run_child(workdir, 'import', empty) for _ in range(args.repeat)]
+        report['import'] = {'wall': summarize(samples, 'wall_s'), 'in_process': summarize(samples, 'import_s')}
+
+        for size in sizes:
+            path = os.path.join(workdir, f'telegram_vacancies_{size}.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(make_corpus(size), f, ensure_ascii=False)
+            cold = [run_child(workdir, 'cold', path) for _ in range(args.repeat)]
+            run_child(workdir, 'save', path)
+            warm = [run_child(workdir, 'warm', path) for _ in range(args.repeat)]
+            if warm[0]['results'] != cold[0]['results']:
+                raise RuntimeError(f"snapshot search returned {warm[0]['results']} results, rebuild {cold[0]['results']}")
+            report[f'cold_ready[{size}]'] = summarize(cold, 'wall_s')
+            report[f'warm_ready[{size}]'] = summarize(warm, 'wall_s')
+
+    for name, result in report.items():
+        result = result.get('wall', result)
+        print(f"{name:28} median {result['median_s'] * 1000:8.1f} ms   "
+              f"min {result['min_s'] * 1000:8.1f}   max {result['max_s'] * 1000:8.1f}", file=sys.stderr)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
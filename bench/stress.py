@@ -0,0 +1,205 @@
+"""Стресс-тест порядка апдейтов: пользователи шлют весь диалог пачкой, не дожидаясь ответов.
+
+    python bench/stress.py --users 200 --rounds 3
+    python bench/stress.py --processor simple     # контроль: без упорядочивания по чату состояние ломается
+
+Проверяется, что для каждого пользователя ответы пришли в порядке шагов, в сессии лежат его
+собственные резюме и фильтры, ConversationHandler стоит на шаге выбора вакансии, а два апдейта
+одного чата ни разу не обрабатывались одновременно. Код выхода 1 — если нашлось нарушение.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(ROOT), 'bot'))
+sys.path.insert(0, ROOT)
+
+import logging
+
+from fakes import FakeUpstreams, add_fake_arguments, config_from_args
+from corpus import make_corpus
+from load import UpdateFactory, RESUME_TEXT, FAKE_TOKEN, USER_ID_BASE
+
+# Маркеры ответов на каждый шаг пачки — в этом порядке они должны прийти в чат
+EXPECTED_REPLIES = ['Шаг 1', 'Шаг 2', 'Шаг 3', 'Найдено', 'Что сделать?']
+FAILURE_MARKERS = ['Начни сначала', 'Сессия истекла', 'Ошибка', 'слишком короткое']
+
+
+def user_burst(factory, user_id, round_no):
+    """Апдейты одного прохода диалога; резюме и зарплата уникальны для пользователя и прохода."""
+    salary_k = 100 + (user_id - USER_ID_BASE) % 300
+    return [
+        factory.message(user_id, '/start'),
+        factory.message(user_id, f"{RESUME_TEXT}\nМаркер: user{user_id}-round{round_no}"),
+        factory.message(user_id, f"удалёнка, от {salary_k}к"),
+        factory.message(user_id, 'python разработчик'),
+        factory.callback(user_id, 'vac_0'),
+    ], salary_k * 1000
+
+
+class OverlapWatcher:
+    """Считает, сколько апдейтов одного чата обрабатывалось одновременно."""
+
+    def __init__(self):
+        self.active = {}
+        self.max_per_chat = 0
+        self.total = 0
+        self.max_total = 0
+
+    def watch(self, key, coroutine):
+        async def watched():
+            self.active[key] = self.active.get(key, 0) + 1
+            self.total += 1
+            self.max_per_chat = max(self.max_per_chat, self.active[key])
+            self.max_total = max(self.max_total, self.total)
+            try:
+                await coroutine
+            finally:
+                self.active[key] -= 1
+                self.total -= 1
+        return watched()
+
+
+def make_processor(kind, limit, watcher):
+    from telegram.ext import SimpleUpdateProcessor
+    from update_processor import ChatOrderedUpdateProcessor
+
+    base = ChatOrderedUpdateProcessor if kind == 'ordered' else SimpleUpdateProcessor
+
+    class WatchedProcessor(base):
+        async def do_process_update(self, update, coroutine):
+            key = ChatOrderedUpdateProcessor.chat_key(update)
+            await super().do_process_update(update, watcher.watch(key, coroutine))
+
+    return WatchedProcessor(limit)
+
+
+def check_user(bot, conv, fakes, user_id, start_index, round_no, salary):
+    problems = []
+    texts = [params.get('text') or '' for _, method, params in fakes.sent.get(user_id, [])[start_index:]
+             if method in ('sendMessage', 'editMessageText')]
+    position = 0
+    for text in texts:
+        if any(marker in text for marker in FAILURE_MARKERS):
+            problems.append(f"unexpected reply: {text[:60]!r}")
+        if position < len(EXPECTED_REPLIES) and EXPECTED_REPLIES[position] in text:
+            position += 1
+    if position < len(EXPECTED_REPLIES):
+        problems.append(f"replies out of order, stopped at {EXPECTED_REPLIES[position]!r}")
+
+    session = bot.user_data_store.get(user_id, {})
+    if f"user{user_id}-round{round_no}" not in (session.get('resume') or ''):
+        problems.append("session holds a different resume")
+    if (session.get('preferences') or {}).get('salary') != salary:
+        problems.append(f"preferences salary {(session.get('preferences') or {}).get('salary')} != {salary}")
+    if not session.get('current_vacancy'):
+        problems.append("no current vacancy")
+    state = conv._conversations.get((user_id, user_id))
+    if state != bot.STEP_VACANCY:
+        problems.append(f"conversation state {state} != STEP_VACANCY")
+    return problems
+
+
+async def run(args):
+    from telegram import Update
+    from telegram.ext import ConversationHandler
+
+    fakes = FakeUpstreams(config_from_args(args))
+    env = await fakes.start()
+    workdir = tempfile.mkdtemp(prefix='bot-stress-')
+    os.environ.update(env)
+    os.environ.update({
+        'OPENROUTER_API_KEY': 'fake',
+        'JOBS_DB': os.path.join(workdir, 'jobs.db'),
+        'LLM_CACHE_DB': os.path.join(workdir, 'llm_cache.db'),
+        'STATE_DB': os.path.join(workdir, 'state.db'),
+        'VACANCY_DB': os.path.join(workdir, 'vacancies.db'),
+        'SNAPSHOT_FILE': os.path.join(workdir, 'warm_snapshot.pickle'),
+    })
+    import main as bot
+    bot.STATS_FILE = os.path.join(workdir, 'stats.json')
+    bot.TELEGRAM_VACANCIES_FILE = os.path.join(workdir, 'telegram_vacancies.json')
+    with open(bot.TELEGRAM_VACANCIES_FILE, 'w', encoding='utf-8') as f:
+        json.dump(make_corpus(200), f, ensure_ascii=False)
+
+    watcher = OverlapWatcher()
+    application = bot.build_application(FAKE_TOKEN, make_processor(args.processor, args.concurrency, watcher))
+    conv = next(h for handlers in application.handlers.values() for h in handlers if isinstance(h, ConversationHandler))
+    factory = UpdateFactory()
+    problems = {}
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        for round_no in range(args.rounds):
+            start_indexes = {}
+            salaries = {}
+            bursts = []
+            for i in range(args.users):
+                user_id = USER_ID_BASE + i
+                start_indexes[user_id] = fakes.sent_count(user_id)
+                updates, salaries[user_id] = user_burst(factory, user_id, round_no)
+                bursts.append(updates)
+            # Перемешиваем пачки пользователей: шаг 1 всех, шаг 2 всех… — как при реальной нагрузке
+            for step_updates in zip(*bursts):
+                for raw in step_updates:
+                    await application.update_queue.put(Update.de_json(raw, application.bot))
+
+            done = lambda method, params: 'Что сделать?' in (params.get('text') or '') or any(
+                marker in (params.get('text') or '') for marker in FAILURE_MARKERS)
+            await asyncio.gather(*(
+                fakes.wait_for_message(user_id, done, start_indexes[user_id], timeout=args.timeout)
+                for user_id in start_indexes
+            ), return_exceptions=True)
+            # Даём дообработаться хвостам (например, лишним апдейтам после ошибки)
+            while application.update_queue.qsize() or application.update_processor.current_concurrent_updates:
+                await asyncio.sleep(0.05)
+            for user_id in start_indexes:
+                found = check_user(bot, conv, fakes, user_id, start_indexes[user_id], round_no, salaries[user_id])
+                if found:
+                    problems.setdefault(user_id, []).extend(f"round {round_no}: {p}" for p in found)
+        wall = time.perf_counter() - started
+        await application.stop()
+    # post_init/post_shutdown стенд не вызывает — закрываем общие HTTP-сессии сами
+    await bot.upstream.close_all()
+    await bot.close_llm_session()
+    await fakes.stop()
+
+    return {
+        'processor': args.processor,
+        'users': args.users,
+        'rounds': args.rounds,
+        'updates': args.users * args.rounds * len(EXPECTED_REPLIES),
+        'wall_s': round(wall, 2),
+        'max_concurrent_updates': watcher.max_total,
+        'max_concurrent_per_chat': watcher.max_per_chat,
+        'users_with_problems': len(problems),
+        'problems': {str(uid): found[:5] for uid, found in list(problems.items())[:10]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=32, help='глобальный лимит одновременных апдейтов')
+    parser.add_argument('--processor', choices=['ordered', 'simple'], default='ordered')
+    parser.add_argument('--timeout', type=float, default=120)
+    add_fake_arguments(parser)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    ok = not report['users_with_problems'] and report['max_concurrent_per_chat'] <= 1
+    print('OK' if ok else 'FAILED', file=sys.stderr)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
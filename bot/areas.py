@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import time
+import bisect
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Справочник регионов hh.ru (GET /areas) на диске; обновляется раз в AREAS_TTL
+AREAS_FILE = os.getenv("AREAS_FILE", "bot/hh_areas.json")
+AREAS_TTL = 7 * 24 * 60 * 60
+RUSSIA = 113
+
+# Названия, которые не выводятся из справочника транслитерацией
+ALIASES = {
+    'мск': '1', 'moscow': '1', 'moskva': '1',
+    'спб': '2', 'питер': '2', 'петербург': '2', 'saint petersburg': '2', 'st petersburg': '2', 'spb': '2',
+    'екб': '3', 'yekaterinburg': '3',
+    'нск': '4',
+    'нижний': '66', 'nizhny novgorod': '66',
+    'kiev': '115', 'kyiv': '115',
+    'almaty': '160', 'алма-ата': '160',
+}
+# Слова пожеланий, которые не могут быть городом (и не должны находить «Опытный» или «Офисный»)
+STOP_WORDS = {'удаленка', 'удаленно', 'удаленная', 'удаленный', 'remote', 'офис', 'офисе', 'гибрид', 'опыт',
+              'опыта', 'опытом', 'без', 'нет', 'год', 'года', 'лет', 'тыс', 'зарплата', 'пропустить', 'полный',
+              'день', 'график', 'работа', 'работы', 'город', 'любой', 'россия', 'рф'}
+# Предлоги и пометки перед названием города: «в Мирном», «г. Свободный», «из Казани»
+LOCATION_MARKERS = {'в', 'во', 'г', 'город', 'из'}
+# Города, которые находятся и без пометки: одно слово пожеланий, совпавшее с мелким городом
+# («свободный график», «мирный коллектив»), не должно сужать поиск до другого конца страны.
+# Без пометки находятся только страны, субъекты РФ (Москва и Петербург — тоже) и эти города-миллионники.
+MAJOR_CITIES = {'3', '4', '24', '26', '53', '54', '66', '68', '72', '76', '78', '88', '99', '104'}
+# Окончания падежей: «в Казани», «по Москве» — слово без 1–2 последних букв ищется как начало названия
+MAX_ENDING = 2
+MIN_STEM = 4
+
+_TRANSLIT = dict(zip(
+    'абвгдеёжзийклмнопрстуфхцчшщъыьэюя',
+    ['a', 'b', 'v', 'g', 'd', 'e', 'e', 'zh', 'z', 'i', 'y', 'k', 'l', 'm', 'n', 'o', 'p', 'r', 's', 't', 'u',
+     'f', 'kh', 'ts', 'ch', 'sh', 'shch', '', 'y', '', 'e', 'yu', 'ya']
+))
+_WORD = re.compile(r"[a-zа-я]+")
+# Части пожеланий: «удалёнка, от 150к, Тюмень»
+_SEGMENTS = re.compile(r"[,;\n]")
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, дефисы и прочие разделители -> один пробел."""
+    return ' '.join(_WORD.findall(text.lower().replace('ё', 'е')))
+
+
+def transliterate(text: str) -> str:
+    return ''.join(_TRANSLIT.get(char, char) for char in text)
+
+
+class AreaDirectory:
+    """Регионы и города hh.ru: поиск по названию (рус./англ., с падежными окончаниями) для prefs['area'].
+
+    Дерево /areas загружается с hh.ru один раз и лежит в AREAS_FILE; в памяти — отсортированный
+    список нормализованных названий (и их транслитераций) для поиска точного совпадения и начала
+    слова бинарным поиском. Пока справочник не загружен, find() ничего не находит (поиск по всей России).
+    """
+
+    def __init__(self, path: str = AREAS_FILE):
+        self.path = path
+        self._areas = {}  # id -> (название, id родителя)
+        self._keys = []  # отсортированные нормализованные названия
+        self._ids = []  # id для _keys по тем же позициям
+        self.updated_at = 0.0
+
+    def __len__(self):
+        return len(self._areas)
+
+    def name(self, area_id) -> str:
+        area = self._areas.get(str(area_id))
+        return area[0] if area else ''
+
+    def within(self, area_id, ancestor_id) -> bool:
+        """area_id — это ancestor_id или входит в него (город в области, область в стране)."""
+        area_id, ancestor_id = str(area_id), str(ancestor_id)
+        while area_id:
+            if area_id == ancestor_id:
+                return True
+            area = self._areas.get(area_id)
+            area_id = area[1] if area else None
+        return False
+
+    def region(self, area_id):
+        """id региона первого уровня (субъекта РФ), в который входит area_id; None — это страна или неизвестный id."""
+        area_id = str(area_id)
+        area = self._areas.get(area_id)
+        while area and area[1] and self._areas[area[1]][1]:
+            area_id = area[1]
+            area = self._areas.get(area_id)
+        return area_id if area and area[1] else None
+
+    def load(self, tree: list):
+        areas = {}
+        stack = [(area, None) for area in tree]
+        while stack:
+            area, parent_id = stack.pop()
+            areas[area['id']] = (area['name'], parent_id)
+            stack.extend((child, area['id']) for child in area.get('areas') or [])
+        entries = set()
+        for area_id, (name, _) in areas.items():
+            key = normalize(name)
+            entries.add((key, area_id))
+            entries.add((transliterate(key), area_id))
+        entries.update((normalize(alias), area_id) for alias, area_id in ALIASES.items() if area_id in areas)
+        # При одинаковых названиях (город и район) первым идёт регион повыше
+        ordered = sorted(entries, key=lambda entry: (entry[0], self._depth(areas, entry[1]), int(entry[1])))
+        self._areas = areas
+        self._keys = [key for key, _ in ordered]
+        self._ids = [area_id for _, area_id in ordered]
+
+    @staticmethod
+    def _depth(areas, area_id) -> int:
+        depth = 0
+        while areas[area_id][1]:
+            area_id = areas[area_id][1]
+            depth += 1
+        return depth
+
+    def _notable(self, area_id: str) -> bool:
+        """Страна, регион первого уровня, крупный город или город из ALIASES."""
+        if area_id in MAJOR_CITIES or area_id in ALIASES.values():
+            return True
+        return self._depth(self._areas, area_id) <= 1
+
+    def _exact(self, key: str):
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            return self._ids[position]
+        return None
+
+    def _by_stem(self, word: str):
+        """Название из одного слова, которое начинается с word без падежного окончания."""
+        for cut in range(1, MAX_ENDING + 1):
+            stem = word[:-cut]
+            if len(stem) < MIN_STEM:
+                break
+            position = bisect.bisect_left(self._keys, stem)
+            while position < len(self._keys) and self._keys[position].startswith(stem):
+                key = self._keys[position]
+                if ' ' not in key and len(key) - len(stem) <= MAX_ENDING:
+                    return self._ids[position]
+                position += 1
+        return None
+
+    def find(self, text: str):
+        """id региона hh.ru для города, упомянутого в тексте пожеланий, или None.
+
+        Словосочетание находится всегда. Отдельное слово — если оно одно в своей части пожеланий
+        через запятую («удалёнка, от 150к, Тюмень»), если перед ним стоит «в»/«г.»/«из» или это регион
+        либо крупный город (_notable); слово внутри фразы («свободный график») и совпадение по началу
+        слова без этого не считаются городом.
+        """
+        if not self._keys:
+            return None
+        words = []
+        alone = set()  # позиции слов, которые одни в своей части пожеланий
+        for segment in _SEGMENTS.split(text):
+            segment_words = normalize(segment).split()
+            if len(segment_words) == 1:
+                alone.add(len(words))
+            words.extend(segment_words)
+        located = {position for position, word in enumerate(words[1:], 1) if words[position - 1] in LOCATION_MARKERS}
+        # Сначала словосочетания («нижний новгород», «санкт петербург»), потом отдельные слова
+        for size in (3, 2, 1):
+            for start in range(len(words) - size + 1):
+                phrase = words[start:start + size]
+                if size == 1 and (phrase[0] in STOP_WORDS or len(phrase[0]) < 3):
+                    continue
+                area_id = self._exact(' '.join(phrase))
+                if area_id and (size > 1 or start in alone or start in located or self._notable(area_id)):
+                    return int(area_id)
+        for position, word in enumerate(words):
+            if word not in STOP_WORDS:
+                area_id = self._by_stem(word)
+                if area_id and (position in located or self._notable(area_id)):
+                    return int(area_id)
+        return None
+
+    def load_file(self) -> bool:
+        """Справочник с диска; False — файла нет или он старше AREAS_TTL (нужно обновить)."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.load(json.load(f))
+            self.updated_at = os.path.getmtime(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.error(f"Can't load {self.path}: {e}")
+            return False
+        return time.time() - self.updated_at < AREAS_TTL
+
+    async def refresh(self, fetch) -> bool:
+        """fetch() -> дерево /areas; сохраняет его на диск и перестраивает индекс."""
+        try:
+            tree = await fetch()
+            self.load(tree)
+            self.updated_at = time.time()
+        except Exception as e:
+            logger.error(f"hh.ru areas refresh failed: {e}")
+            return False
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(tree, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Can't save {self.path}: {e}")
+        logger.info(f"Loaded {len(self._areas)} hh.ru areas")
+        return True
+
+    async def keep_fresh(self, fetch):
+        """Берёт справочник с диска и обновляет его с hh.ru, когда он устарел (и раз в AREAS_TTL)."""
+        fresh = await asyncio.to_thread(self.load_file)
+        while True:
+            if not fresh:
+                fresh = await self.refresh(fetch)
+            # Не удалось — пробуем снова через час, пока работаем со старым справочником (или без него)
+            await asyncio.sleep(max(60.0, self.updated_at + AREAS_TTL - time.time()) if fresh else 60 * 60)
+            fresh = False
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import random
+import socket
+import secrets
+import sqlite3
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB = os.getenv("JOBS_DB", "bot/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # одновременных запросов к OpenRouter
+
+PRIORITY_PAID = 10
+PRIORITY_FREE = 0
+
+# Backpressure: бесплатные задачи сверх лимита не принимаем, оплаченные — всегда
+MAX_PENDING_JOBS = 200
+MAX_PENDING_PER_USER = 3
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 5  # сек, растёт как 5, 10, 20...
+DONE_JOBS_TTL = 24 * 60 * 60
+# Процессы отмечаются в job_workers; задачи процесса без отметки дольше WORKER_TIMEOUT возвращаются в очередь
+HEARTBEAT_INTERVAL = 5
+WORKER_TIMEOUT = 30
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Очередь AI-задач в SQLite: переживает перезапуск, оплаченные задачи идут первыми,
+    у одного пользователя выполняется не больше одной задачи одновременно."""
+
+    def __init__(self, db_path: str = JOBS_DB, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self.handlers = {}
+        self.on_failure = None
+        self.bot = None
+        self._conn = None
+        # Запросы к SQLite идут в потоках (BEGIN IMMEDIATE может ждать блокировку другого процесса
+        # до timeout=5 — цикл событий в это время обрабатывает апдейты); соединение одно — по очереди
+        self._lock = threading.Lock()
+        self._read_conn = None
+        self._tasks = []
+        self._running = set()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._maintenance_task = None
+        # Уникален для каждого запуска процесса — по нему отличаем свои задачи от задач соседей
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+    def register(self, kind: str, handler):
+        """handler(bot, job) — корутина; исключение означает неудачную попытку."""
+        self.handlers[kind] = handler
+
+    async def _call(self, method, *args):
+        def locked():
+            with self._lock:
+                return method(*args)
+        return await asyncio.to_thread(locked)
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " kind TEXT NOT NULL,"
+                " user_id INTEGER NOT NULL,"
+                " priority INTEGER NOT NULL DEFAULT 0,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " last_error TEXT,"
+                " created_at REAL NOT NULL,"
+                " run_after REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL)"
+            )
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            if 'owner' not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, priority, run_after)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, started_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_workers (owner TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    async def enqueue(self, kind: str, user_id: int, payload: dict, priority: int = PRIORITY_FREE) -> int:
+        """Ставит задачу в очередь. Возвращает число задач, которые выполнятся раньше неё."""
+        ahead = await self._call(self._insert, kind, user_id, payload, priority)
+        self._wakeup.set()
+        logger.info(f"Job queued: kind={kind} user_id={user_id} priority={priority} ahead={ahead}")
+        return ahead
+
+    def _insert(self, kind: str, user_id: int, payload: dict, priority: int) -> int:
+        conn = self._db()
+        if priority < PRIORITY_PAID:
+            pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            user_pending = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running') AND user_id = ?",
+                (user_id,)
+            ).fetchone()[0]
+            if pending >= MAX_PENDING_JOBS or user_pending >= MAX_PENDING_PER_USER:
+                raise QueueFull()
+        now = time.time()
+        conn.execute(
+            "INSERT INTO jobs (kind, user_id, priority, payload, created_at, run_after) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, user_id, priority, json.dumps(payload, ensure_ascii=False), now, now)
+        )
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND priority >= ?",
+            (priority,)
+        ).fetchone()[0] - 1
+        return ahead
+
+    async def update_payload(self, job_id: int, payload: dict):
+        """Сохраняет прогресс задачи в payload: повтор (в том числе после перезапуска) продолжит с него."""
+        await self._call(
+            self._execute, "UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(payload, ensure_ascii=False), job_id)
+        )
+
+    def _execute(self, sql: str, params=()):
+        self._db().execute(sql, params)
+
+    def depth(self) -> int:
+        """Для метрик (синхронно). Отдельное соединение: общее может быть занято потоком, который ждёт
+        блокировку записи, а чтение в WAL пишущих не ждёт."""
+        if self._read_conn is None:
+            self._read_conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        try:
+            return self._read_conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        except sqlite3.OperationalError:
+            # Таблиц ещё нет: очередь не запускалась
+            return 0
+
+    def _claim(self):
+        """Атомарно забирает следующую задачу: выше приоритет, затем тот, кого дольше не обслуживали."""
+        conn = self._db()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT j.* FROM jobs j"
+                " WHERE j.status = 'pending' AND j.run_after <= ?"
+                " AND j.user_id NOT IN (SELECT user_id FROM jobs WHERE status = 'running')"
+                " ORDER BY j.priority DESC,"
+                " COALESCE((SELECT MAX(started_at) FROM jobs s WHERE s.user_id = j.user_id), 0),"
+                " j.id"
+                " LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner = ? WHERE id = ?",
+                (now, self.owner, row['id'])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def _finish(self, job, error=None):
+        conn = self._db()
+        now = time.time()
+        if error is None:
+            conn.execute("UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ?", (now, job['id']))
+            return 'done'
+        attempts = job['attempts'] + 1
+        if attempts >= MAX_ATTEMPTS:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', attempts = ?, last_error = ?, finished_at = ? WHERE id = ?",
+                (attempts, str(error)[:500], now, job['id'])
+            )
+            return 'failed'
+        delay = RETRY_BASE_DELAY * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+        conn.execute(
+            "UPDATE jobs SET status = 'pending', attempts = ?, last_error = ?, run_after = ? WHERE id = ?",
+            (attempts, str(error)[:500], now + delay, job['id'])
+        )
+        return 'retry'
+
+    async def _run_job(self, job):
+        handler = self.handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for job kind {job['kind']}")
+            await handler(self.bot, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed, attempt {job['attempts'] + 1}: {e}")
+            if await self._record(job, e) == 'failed' and self.on_failure:
+                try:
+                    await self.on_failure(self.bot, job, e)
+                except Exception as notify_error:
+                    logger.error(f"Job failure notification error: {notify_error}")
+            return
+        await self._record(job)
+
+    async def _record(self, job, error=None):
+        """_finish с повтором: база бывает занята другим процессом дольше timeout. При остановке
+        сдаёмся — задача останется running и вернётся в очередь через _recover_orphans."""
+        while True:
+            try:
+                return await self._call(self._finish, job, error)
+            except sqlite3.Error as e:
+                logger.error(f"Job {job['id']} result save error: {e}")
+                if self._stopping:
+                    return None
+                await asyncio.sleep(1)
+
+    async def _worker(self):
+        while not self._stopping:
+            try:
+                job = await self._call(self._claim)
+            except sqlite3.Error as e:
+                logger.error(f"Job claim error: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    # Таймаут — чтобы подхватывать отложенные повторы и задачи других процессов
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._running.add(job['id'])
+            try:
+                await self._run_job(job)
+            finally:
+                self._running.discard(job['id'])
+                self._wakeup.set()
+
+    def _heartbeat(self):
+        self._db().execute(
+            "INSERT INTO job_workers (owner, seen_at) VALUES (?, ?)"
+            " ON CONFLICT(owner) DO UPDATE SET seen_at = excluded.seen_at",
+            (self.owner, time.time())
+        )
+
+    def _recover_orphans(self) -> int:
+        """Возвращает в очередь задачи процессов, которые перестали отмечаться (упали или перезапущены)."""
+        conn = self._db()
+        cutoff = time.time() - WORKER_TIMEOUT
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM job_workers WHERE seen_at < ?", (cutoff,))
+            recovered = conn.execute(
+                "UPDATE jobs SET status = 'pending', owner = NULL"
+                " WHERE status = 'running' AND (owner IS NULL OR owner NOT IN (SELECT owner FROM job_workers))"
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if recovered:
+            logger.info(f"Recovered {recovered} interrupted jobs")
+        return recovered
+
+    async def _maintenance(self):
+        while not self._stopping:
+            try:
+                await self._call(self._heartbeat)
+                if await self._call(self._recover_orphans):
+                    self._wakeup.set()
+            except sqlite3.Error as e:
+                logger.error(f"Job maintenance error: {e}")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def start(self, bot):
+        self.bot = bot
+        self._stopping = False
+        # Задачи процессов, которые больше не отмечаются (в т.ч. прошлого запуска этого), возвращаем в очередь;
+        # задачи живых соседей не трогаем
+        await self._call(self._heartbeat)
+        await self._call(self._recover_orphans)
+        await self._call(
+            self._execute, "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - DONE_JOBS_TTL,)
+        )
+        self._maintenance_task = asyncio.create_task(self._maintenance())
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 30):
+        """Перестаёт брать новые задачи и ждёт текущие; недождавшиеся подхватятся после рестарта."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        try:
+            # Без отметки процесса недоделанные задачи сразу подхватит сосед или следующий запуск
+            await self._call(self._execute, "DELETE FROM job_workers WHERE owner = ?", (self.owner,))
+        except sqlite3.Error as e:
+            logger.error(f"Job worker deregistration error: {e}")
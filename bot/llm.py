@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import aiohttp
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+import metrics
+from metrics import track_upstream
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+LLM_MODEL = "openai/gpt-4o-mini"
+
+# Потоковый режим: текст появляется в чате по мере генерации
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+# Telegram ограничивает частоту правок одного сообщения — не чаще раза в ~1.5 сек
+STREAM_EDIT_INTERVAL = 1.5
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Последняя правка с полным текстом: повторы после 429 и предел ожидания, потом — новым сообщением
+FINAL_EDIT_RETRIES = 2
+FINAL_EDIT_MAX_WAIT = 30
+
+_session = None
+
+
+class LLMError(Exception):
+    pass
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Общая сессия для OpenRouter (keep-alive вместо нового соединения на каждый запрос)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60, sock_read=30))
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _headers():
+    return {
+        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://replit.com",
+        "X-Title": "HH Resume Helper"
+    }
+
+
+def _raise_for_result(result):
+    if 'error' in result:
+        error = result['error']
+        raise LLMError(f"API: {error.get('message', error) if isinstance(error, dict) else error}")
+
+
+async def complete(prompt: str, max_tokens: int) -> str:
+    """Обычный (не потоковый) запрос к chat completions."""
+    async with track_upstream('openrouter'):
+        async with get_session().post(
+            OPENROUTER_URL,
+            headers=_headers(),
+            json={
+                "model": LLM_MODEL,
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": max_tokens
+            }
+        ) as response:
+            result = await response.json(content_type=None)
+        _raise_for_result(result)
+        if 'choices' not in result or not result['choices']:
+            raise LLMError("Неожиданный ответ API")
+    return result['choices'][0]['message']['content']
+
+
+async def stream(prompt: str, max_tokens: int):
+    """Потоковый запрос: отдаёт куски текста по мере прихода SSE-событий."""
+    started = time.perf_counter()
+    first_token_at = None
+    async with track_upstream('openrouter') as timer:
+        async with get_session().post(
+            OPENROUTER_URL,
+            headers=_headers(),
+            json={
+                "model": LLM_MODEL,
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": max_tokens,
+                "stream": True
+            }
+        ) as response:
+            if response.status != 200:
+                try:
+                    result = await response.json(content_type=None)
+                except Exception:
+                    raise LLMError(f"HTTP {response.status}")
+                _raise_for_result(result)
+                raise LLMError(f"HTTP {response.status}")
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                # Пустые строки разделяют события, ":" — keep-alive комментарии OpenRouter
+                if not line or line.startswith(':') or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    continue
+                _raise_for_result(chunk)
+                choices = chunk.get('choices') or []
+                if not choices:
+                    continue
+                delta = (choices[0].get('delta') or {}).get('content')
+                if delta:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        if metrics.ENABLED:
+                            metrics.llm_first_token.observe(first_token_at - started)
+                    # Пока потребитель правит сообщение в Telegram, время OpenRouter не идёт
+                    paused = time.perf_counter()
+                    yield delta
+                    timer.exclude(time.perf_counter() - paused)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after if isinstance(retry_after, (int, float)) else retry_after.total_seconds()
+
+
+async def _edit(message, text, parse_mode=None):
+    """Правка сообщения; RetryAfter и прочие ошибки Telegram — вызывающему."""
+    try:
+        await message.edit_text(text, parse_mode=parse_mode)
+    except BadRequest as e:
+        if 'not modified' in str(e).lower():
+            return
+        if not parse_mode:
+            raise
+        # Незакрытая разметка от модели — показываем как есть
+        await _edit(message, text)
+
+
+async def _final_edit(bot, chat_id: int, message, text: str, header: str):
+    """Полный текст вместо промежуточного с курсором; не вышло — отдельным сообщением, как без стриминга."""
+    for attempt in range(FINAL_EDIT_RETRIES + 1):
+        try:
+            await _edit(message, f"{header}{text}", parse_mode='Markdown')
+            return
+        except RetryAfter as e:
+            wait = _retry_after_seconds(e)
+            if attempt == FINAL_EDIT_RETRIES or wait > FINAL_EDIT_MAX_WAIT:
+                break
+            logger.warning(f"Final stream edit throttled by Telegram for {wait}s")
+            await asyncio.sleep(wait)
+        except TelegramError as e:
+            logger.warning(f"Final stream edit failed: {e}")
+            break
+    try:
+        # Обрезанный черновик с курсором только путал бы
+        await message.delete()
+    except TelegramError:
+        pass
+    await send_text(bot, chat_id, text, header)
+
+
+async def _drop_draft(message):
+    """Удаляет черновик прерванной генерации; не удалось — оставляет вместо него короткую строку."""
+    try:
+        await message.delete()
+        return
+    except TelegramError as e:
+        logger.warning(f"Can't delete stream draft: {e}")
+    try:
+        await message.edit_text("Генерация прервалась.")
+    except TelegramError:
+        pass
+
+
+async def stream_to_message(bot, chat_id: int, prompt: str, max_tokens: int, header: str, placeholder: str) -> str:
+    """Стримит ответ модели в одно сообщение, периодически его редактируя. Возвращает полный текст."""
+    message = await bot.send_message(chat_id=chat_id, text=placeholder)
+    limit = TELEGRAM_MESSAGE_LIMIT - len(header) - 2
+    text = ""
+    interval = STREAM_EDIT_INTERVAL
+    last_edit = time.monotonic()
+    try:
+        async for delta in stream(prompt, max_tokens):
+            text += delta
+            now = time.monotonic()
+            if now - last_edit < interval or len(text) > limit:
+                continue
+            try:
+                await _edit(message, f"{header}{text} ▌")
+            except RetryAfter as e:
+                logger.warning(f"Edit throttled by Telegram for {_retry_after_seconds(e)}s")
+                interval *= 2
+            except TelegramError as e:
+                logger.warning(f"Stream edit failed: {e}")
+            last_edit = now
+        if not text:
+            raise LLMError("Пустой ответ API")
+    except Exception:
+        # Очередь повторит задачу с новым черновиком — недописанный убираем, чтобы они не копились
+        await _drop_draft(message)
+        raise
+
+    await _final_edit(bot, chat_id, message, text[:limit], header)
+    rest = text[limit:]
+    while rest:
+        await bot.send_message(chat_id=chat_id, text=rest[:TELEGRAM_MESSAGE_LIMIT])
+        rest = rest[TELEGRAM_MESSAGE_LIMIT:]
+    return text
+
+
+async def generate_to_chat(bot, chat_id: int, prompt: str, max_tokens: int, header: str, placeholder: str) -> str:
+    """Генерирует ответ и доставляет его в чат — потоково или одним сообщением."""
+    if LLM_STREAMING:
+        return await stream_to_message(bot, chat_id, prompt, max_tokens, header, placeholder)
+    text = await complete(prompt, max_tokens)
+    await send_text(bot, chat_id, text, header)
+    return text
+
+
+async def send_text(bot, chat_id: int, text: str, header: str):
+    """Отправляет готовый текст (например, из кэша) с заголовком, разбивая по лимиту Telegram."""
+    limit = TELEGRAM_MESSAGE_LIMIT - len(header)
+    try:
+        await bot.send_message(chat_id=chat_id, text=f"{header}{text[:limit]}", parse_mode='Markdown')
+    except BadRequest:
+        await bot.send_message(chat_id=chat_id, text=f"{header}{text[:limit]}")
+    rest = text[limit:]
+    while rest:
+        await bot.send_message(chat_id=chat_id, text=rest[:TELEGRAM_MESSAGE_LIMIT])
+        rest = rest[TELEGRAM_MESSAGE_LIMIT:]
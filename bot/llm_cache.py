@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+CACHE_DB = os.getenv("LLM_CACHE_DB", "bot/llm_cache.db")
+CACHE_TTL = 30 * 24 * 60 * 60  # 30 дней
+CACHE_MAX_ENTRIES = 5000
+
+# Счётчики попаданий для статистики
+stats = {'hits': 0, 'misses': 0}
+
+_conn = None
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_DB, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " text TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+    return _conn
+
+
+def make_key(resume: str, vacancy_key: str, prompt_type: str, prompt_version: int, model: str) -> str:
+    """Ключ кэша: хэш резюме + источник/id вакансии + версия шаблона промпта + модель."""
+    resume_hash = hashlib.sha256(resume.encode('utf-8')).hexdigest()
+    raw = json.dumps([resume_hash, vacancy_key, prompt_type, prompt_version, model])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def get(key: str):
+    """Возвращает сохранённый текст или None, если записи нет или она устарела."""
+    try:
+        conn = _get_conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT text FROM llm_cache WHERE key = ? AND created_at > ?",
+            (key, now - CACHE_TTL)
+        ).fetchone()
+        if row is None:
+            stats['misses'] += 1
+            return None
+        conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        stats['hits'] += 1
+        return row[0]
+    except sqlite3.Error as e:
+        logger.error(f"LLM cache read error: {e}")
+        return None
+
+
+def contains(key: str) -> bool:
+    """Есть ли свежая запись — без счётчиков попаданий и без продления жизни записи."""
+    try:
+        return _get_conn().execute(
+            "SELECT 1 FROM llm_cache WHERE key = ? AND created_at > ?", (key, time.time() - CACHE_TTL)
+        ).fetchone() is not None
+    except sqlite3.Error as e:
+        logger.error(f"LLM cache read error: {e}")
+        return False
+
+
+def put(key: str, text: str):
+    try:
+        conn = _get_conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, text, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, text, now, now)
+        )
+        _evict(conn, now)
+    except sqlite3.Error as e:
+        logger.error(f"LLM cache write error: {e}")
+
+
+def _evict(conn, now):
+    """Удаляет устаревшие записи и самые давно использованные сверх лимита."""
+    conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - CACHE_TTL,))
+    count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    if count > CACHE_MAX_ENTRIES:
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+            (count - CACHE_MAX_ENTRIES,)
+        )
+
+
+def size() -> int:
+    try:
+        return _get_conn().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    except sqlite3.Error:
+        return 0
@@ -2,14 +2,15 @@ from dotenv import load_dotenv
 import os
 import io
 import json
+import time
+import sqlite3
 import logging
 import asyncio
-import aiohttp
-import requests
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 load_dotenv()
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice, ReplyKeyboardMarkup, ReplyKeyboardRemove, LinkPreviewOptions
+from telegram.error import Forbidden, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -21,15 +22,27 @@ from telegram.ext import (
     filters
 )
 
-try:
-    from PyPDF2 import PdfReader
-except ImportError:
-    PdfReader = None
-
-try:
-    from docx import Document
-except ImportError:
-    Document = None
+from llm import generate_to_chat, complete, send_text, close_session as close_llm_session, LLM_MODEL
+import llm_cache
+from prompts import build_prompt, PROMPT_VERSIONS
+from jobs import JobQueue, QueueFull, PRIORITY_FREE, PRIORITY_PAID, MAX_ATTEMPTS as JOB_MAX_ATTEMPTS
+import prompts
+import metrics
+import perf
+import parser_report
+import tracing
+from tracing import span
+from update_processor import ChatOrderedUpdateProcessor
+import state
+import snapshot
+import upstream
+from upstream import UpstreamError
+from outbox import OutboundScheduler, PRIORITY_BULK
+from vacancy_index import VacancyFileIndex
+from vacancy_store import VacancyStore
+import vacancy_api
+from areas import AreaDirectory, RUSSIA, normalize as normalize_area
+from subscriptions import Subscriptions, MAX_PER_USER as SUBSCRIPTIONS_PER_USER
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -40,6 +53,8 @@ logger = logging.getLogger(__name__)
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+# polling (по умолчанию) или webhook — см. webhook.py
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 ADMIN_IDS = [394363189]  # Список ID администраторов
 
 # Telegram Stars (XTR) — оплата цифровых товаров, provider_token пустой
@@ -55,74 +70,111 @@ FREE_ADAPT_LIMIT = 1
 
 STEP_START, STEP_RESUME, STEP_PREFERENCES, STEP_SEARCH, STEP_VACANCY = range(5)
 
-# Хранилище пользователей
-users = {}
-
-user_data_store = {}
-STATS_FILE = 'bot/stats.json'
-
-HH_API_URL = "https://api.hh.ru"
-TRUDVSEM_API_URL = "http://opendata.trudvsem.ru/api/v1"
+STATS_FILE = 'bot/stats.json'  # до перехода на state.py; импортируется при первом запуске
+
+# Общее хранилище (см. state.py): сессии, шаги диалога, оплаты, бесплатные лимиты, статистика.
+# С STATE_BACKEND=sqlite его делят несколько процессов бота, а перезапуск не сбрасывает диалоги.
+state_backend = state.make_backend()
+user_data_store = state.SessionStore(state_backend)
+conversations = state.ConversationStore(state_backend, 'dialog')
+entitlements = state.Entitlements(state_backend)
+quotas = state.Quotas(state_backend)
+bot_stats = state.Stats(state_backend)
+query_log = state.QueryLog(state_backend)
+subscriptions = Subscriptions(state_backend)
+# Прогретые выдачи популярных запросов (hh.ru, Trudvsem) — см. prewarm_popular_queries
+vacancy_store = VacancyStore()
+TELEGRAM_VACANCIES_FILE = 'bot/telegram_vacancies.json'
+# Индекс telegram_vacancies.json: строится один раз на версию файла, при рестарте берётся из снимка
+telegram_index = VacancyFileIndex()
+# Города и регионы hh.ru для prefs['area'] (справочник /areas, кэш на диске)
+hh_areas = AreaDirectory()
+TELEGRAM_INDEX_POLL = 30  # секунд между проверками файла вакансий на изменения
+# Задержка цикла событий для /perf и метрики bot_event_loop_lag_seconds
+loop_lag = perf.LoopLag()
+
+HH_API_URL = os.getenv("HH_API_URL", "https://api.hh.ru")
+TRUDVSEM_API_URL = os.getenv("TRUDVSEM_API_URL", "http://opendata.trudvsem.ru/api/v1")
+# Для локальных стендов (bench/fakes.py) — адрес Bot API вместо https://api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Trudvsem: страница до 100 вакансий (offset — номер страницы); догружаем параллельно, пока не наберём нужное
+TRUDVSEM_PAGE_SIZE = 100
+TRUDVSEM_TARGET = 20
+TRUDVSEM_MAX_PAGES = 5
+TRUDVSEM_PARALLEL_PAGES = 3
+TRUDVSEM_PERIOD_DAYS = 14  # как period=14 у hh
+# Регион Trudvsem — код субъекта РФ по КЛАДР (две цифры и 11 нулей). Город hh.ru поднимается до своего
+# субъекта, субъект узнаётся по характерному слову названия в справочнике hh.ru («Республика Татарстан»)
+TRUDVSEM_REGIONS = {
+    'москва': '77', 'петербург': '78', 'севастополь': '92', 'крым': '91',
+    'адыгея': '01', 'башкортостан': '02', 'бурятия': '03', 'алтай': '04', 'дагестан': '05', 'ингушетия': '06',
+    'кабардино': '07', 'калмыкия': '08', 'карачаево': '09', 'карелия': '10', 'коми': '11', 'марий': '12',
+    'мордовия': '13', 'саха': '14', 'осетия': '15', 'татарстан': '16', 'тыва': '17', 'удмуртская': '18',
+    'хакасия': '19', 'чеченская': '20', 'чувашская': '21', 'алтайский': '22', 'краснодарский': '23',
+    'красноярский': '24', 'приморский': '25', 'ставропольский': '26', 'хабаровский': '27', 'амурская': '28',
+    'архангельская': '29', 'астраханская': '30', 'белгородская': '31', 'брянская': '32', 'владимирская': '33',
+    'волгоградская': '34', 'вологодская': '35', 'воронежская': '36', 'ивановская': '37', 'иркутская': '38',
+    'калининградская': '39', 'калужская': '40', 'камчатский': '41', 'кемеровская': '42', 'кировская': '43',
+    'костромская': '44', 'курганская': '45', 'курская': '46', 'ленинградская': '47', 'липецкая': '48',
+    'магаданская': '49', 'московская': '50', 'мурманская': '51', 'нижегородская': '52', 'новгородская': '53',
+    'новосибирская': '54', 'омская': '55', 'оренбургская': '56', 'орловская': '57', 'пензенская': '58',
+    'пермский': '59', 'псковская': '60', 'ростовская': '61', 'рязанская': '62', 'самарская': '63',
+    'саратовская': '64', 'сахалинская': '65', 'свердловская': '66', 'смоленская': '67', 'тамбовская': '68',
+    'тверская': '69', 'томская': '70', 'тульская': '71', 'тюменская': '72', 'ульяновская': '73',
+    'челябинская': '74', 'забайкальский': '75', 'ярославская': '76', 'еврейская': '79',
+    # «Ямало-Ненецкий» раньше «Ненецкого»: слова названия проверяются по порядку
+    'ямало': '89', 'ненецкий': '83', 'югра': '86', 'чукотский': '87',
+}
+# Фильтров графика и опыта у API нет — проверяем по полям вакансии
+TRUDVSEM_SCHEDULES = {'remote': 'Удаленная работа', 'fullDay': 'Полный рабочий день'}
+TRUDVSEM_EXPERIENCE = {'noExperience': (0, 0), 'between1And3': (1, 2), 'between3And6': (3, 5)}
+# Прогрев: раз в PREWARM_INTERVAL самые частые запросы заново скачиваются в vacancy_store
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "20"))
+PREWARM_INTERVAL = 15 * 60
+PREWARM_PAGE_SIZE = 100
+PREWARM_FRESH = 2 * PREWARM_INTERVAL  # отвечаем из прогретой выдачи без запроса к источнику
+PREWARM_STALE = 24 * 60 * 60  # при сбое источника годится и такая
+NOTIFY_LIMIT = 5  # вакансий в одном уведомлении по подпискам, остальные — числом
+# Сколько запросов подписок (самых популярных) опрашивать в hh.ru и Trudvsem за один прогрев
+SUBSCRIPTION_POLL_LIMIT = int(os.getenv("SUBSCRIPTION_POLL_LIMIT", "100"))
+BULK_COVER_COUNT = 5  # «Письма для первых N вакансий» выдачи — одним счётом
+BULK_LLM_CONCURRENCY = 3  # писем пакета, которые модель пишет одновременно
 HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
 
-def load_stats():
-    try:
-        with open(STATS_FILE, 'r') as f:
-            stats = json.load(f)
-            # Инициализация free_usage если отсутствует
-            if 'free_usage' not in stats:
-                stats['free_usage'] = {}
-            return stats
-    except:
-        return {'users': [], 'total_searches': 0, 'free_usage': {}}
-
-def save_stats(stats):
-    try:
-        with open(STATS_FILE, 'w') as f:
-            json.dump(stats, f)
-    except Exception as e:
-        logger.error(f"Error saving stats: {e}")
-
 def can_use_free(user_id: int, action_type: str) -> bool:
     """Проверяет, может ли пользователь использовать бесплатное действие."""
-    stats = load_stats()
-    free_usage = stats.get('free_usage', {})
-    user_usage = free_usage.get(str(user_id), {})
-    
     if action_type == 'cover':
-        used = user_usage.get('cover', 0)
-        return used < FREE_COVER_LIMIT
+        return quotas.used(user_id, 'cover') < FREE_COVER_LIMIT
     elif action_type == 'adapt':
-        used = user_usage.get('adapt', 0)
-        return used < FREE_ADAPT_LIMIT
+        return quotas.used(user_id, 'adapt') < FREE_ADAPT_LIMIT
     return False
 
 def mark_free_used(user_id: int, action_type: str):
     """Отмечает использование бесплатного действия пользователем."""
-    stats = load_stats()
-    if 'free_usage' not in stats:
-        stats['free_usage'] = {}
-    free_usage = stats['free_usage']
-    
-    user_id_str = str(user_id)
-    if user_id_str not in free_usage:
-        free_usage[user_id_str] = {'cover': 0, 'adapt': 0}
-    
     if action_type in ('cover', 'adapt'):
-        free_usage[user_id_str][action_type] = free_usage[user_id_str].get(action_type, 0) + 1
-    
-    save_stats(stats)
+        quotas.use(user_id, action_type)
+
+def load_pdf_reader():
+    """PyPDF2 и python-docx нужны только для присланных файлов — не тратим на них время старта."""
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        return None
+    return PdfReader
+
+def load_docx_document():
+    try:
+        from docx import Document
+    except ImportError:
+        return None
+    return Document
 
 def track_user(user_id: int):
-    stats = load_stats()
-    if user_id not in stats['users']:
-        stats['users'].append(user_id)
-        save_stats(stats)
+    bot_stats.track_user(user_id)
 
-def track_search():
-    stats = load_stats()
-    stats['total_searches'] = stats.get('total_searches', 0) + 1
-    save_stats(stats)
+def track_search(query: str):
+    bot_stats.track_search()
+    query_log.record(query)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -149,18 +201,68 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id not in ADMIN_IDS:
         return
     
-    stats = load_stats()
-    total_users = len(stats.get('users', []))
-    total_searches = stats.get('total_searches', 0)
+    total_users = bot_stats.total_users()
+    total_searches = bot_stats.total_searches()
+    # Без Markdown: в тексте последней ошибки источника могут быть _ и *
+    sources = "\n".join(f"  {source.name}: {source.status()}" for source in upstream.UPSTREAMS)
     
     await update.message.reply_text(
-        f"📊 **Статистика бота**\n\n"
+        f"📊 Статистика бота\n\n"
         f"👥 Уникальных пользователей: {total_users}\n"
         f"🔍 Всего поисков: {total_searches}\n"
-        f"📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-        parse_mode='Markdown'
+        f"📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"Источники:\n{sources}"
     )
 
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Живые показатели процесса: память, сессии, кэши, внешние сервисы, очереди, парсер."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if context.args and context.args[0] == 'tracemalloc':
+        enabled = len(context.args) < 2 or context.args[1] != 'off'
+        perf.set_tracing(enabled)
+        await update.message.reply_text(
+            "Трассировка выделений включена: /perf покажет крупнейшие выделения с этого момента. "
+            "Выключить — /perf tracemalloc off" if enabled else "Трассировка выделений выключена"
+        )
+        return
+    
+    collect_metrics(context.application)
+    sessions, sessions_size = user_data_store.footprint()
+    # Снимок tracemalloc и чтение отчётов парсера — в потоке, не задерживая апдейты
+    allocations, runs = await asyncio.gather(
+        asyncio.to_thread(perf.top_allocations),
+        asyncio.to_thread(parser_report.load_runs)
+    )
+    if allocations is None:
+        allocation_lines = ["  выключено — /perf tracemalloc on"]
+    else:
+        allocation_lines = [f"  {where}: {perf.human_bytes(size)}, {count} блоков" for where, size, count in allocations]
+    index = telegram_index.index
+    
+    # Без Markdown: в путях и именах источников бывают _ и *
+    lines = [
+        f"⚙️ Производительность (pid {os.getpid()}, работает {perf.uptime()})",
+        "",
+        f"Память: RSS {perf.human_bytes(perf.rss_bytes())}",
+        "Крупнейшие выделения (tracemalloc):",
+        *allocation_lines,
+        f"Цикл событий: задержка {loop_lag.last * 1000:.0f}ms, максимум за минуту {loop_lag.max * 1000:.0f}ms",
+        f"Апдейты: в обработке {metrics.updates_running.get()}, ждут {metrics.updates_waiting.get()}",
+        f"Очередь генерации: {metrics.job_queue_depth.get()}, исходящие к Telegram ждут: {metrics.outbox_waiting.get()}",
+        f"Сессии: {sessions}, {perf.human_bytes(sessions_size)} в JSON",
+        f"Индекс Telegram: {len(index) if index is not None else 0} вакансий, поколение {telegram_index.generation}",
+        "",
+        "Кэши:",
+        *(perf.cache_lines() or ["  пусто"]),
+        "",
+        "Внешние сервисы с запуска:",
+        *(perf.upstream_lines() or ["  запросов ещё не было"]),
+        "",
+        f"Последний запуск парсера: {perf.format_parser_run(runs[-1] if runs else None)}",
+    ]
+    await update.message.reply_text("\n".join(lines))
+
 async def myid_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     await update.message.reply_text(f"Твой Telegram ID: `{user_id}`", parse_mode='Markdown')
@@ -179,6 +281,7 @@ async def receive_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_name = update.message.document.file_name.lower()
         
         if file_name.endswith('.pdf'):
+            PdfReader = load_pdf_reader()
             if PdfReader:
                 try:
                     pdf = PdfReader(io.BytesIO(bytes(file_bytes)))
@@ -193,6 +296,7 @@ async def receive_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return STEP_RESUME
                 
         elif file_name.endswith('.docx'):
+            Document = load_docx_document()
             if Document:
                 try:
                     doc = Document(io.BytesIO(bytes(file_bytes)))
@@ -251,7 +355,7 @@ async def receive_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE
         'schedule': None,
         'salary': None,
         'experience': None,
-        'area': 113
+        'area': RUSSIA
     }
     
     if text != 'пропустить':
@@ -277,6 +381,9 @@ async def receive_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE
             prefs['experience'] = 'between1And3'
         elif '3-6' in text or '3 год' in text or '5 год' in text:
             prefs['experience'] = 'between3And6'
+        
+        # Город из пожеланий — hh.ru сам отфильтрует выдачу по региону
+        prefs['area'] = hh_areas.find(text) or RUSSIA
     
     user_data_store[user_id]['preferences'] = prefs
     
@@ -294,13 +401,38 @@ async def receive_preferences(update: Update, context: ContextTypes.DEFAULT_TYPE
         pref_text.append(exp_map.get(prefs['experience'], ''))
     
     pref_summary = ", ".join(pref_text) if pref_text else "без фильтров"
+    # Город распознан по словам пожеланий — показываем его, чтобы ошибку можно было снять одной кнопкой
+    area_line = ""
+    reply_markup = None
+    if prefs['area'] != RUSSIA:
+        area_name = hh_areas.name(prefs['area'])
+        area_line = f"Город: {area_name}\n"
+        reply_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton(f"🌍 Не {area_name} — искать по всей России", callback_data="area_any")
+        ]])
     
     await update.message.reply_text(
-        f"Фильтры: {pref_summary}\n\n"
+        f"Фильтры: {pref_summary}\n{area_line}\n"
         "**Шаг 3 из 3**: Поиск вакансий\n\n"
         "Введи должность для поиска:\n"
         "Например: «менеджер проекта» или «Python разработчик»",
-        parse_mode='Markdown'
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+    return STEP_SEARCH
+
+
+async def reset_area(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка «искать по всей России» под распознанным городом."""
+    query = update.callback_query
+    await query.answer()
+    prefs = user_data_store.get(update.effective_user.id, {}).get('preferences')
+    if prefs is not None:
+        prefs['area'] = RUSSIA
+    await query.edit_message_text(
+        "Ищу по всей России.\n\n"
+        "Введи должность для поиска:\n"
+        "Например: «менеджер проекта» или «Python разработчик»"
     )
     return STEP_SEARCH
 
@@ -324,76 +456,159 @@ def expand_query(query: str) -> str:
             return ' OR '.join(synonyms[:5])
     return query
 
-async def search_trudvsem(query: str, prefs: dict) -> list:
+def local_results(source: str, query: str, prefs: dict, matches, max_age: float, needed: int):
+    """Прогретая выдача из vacancy_store, отфильтрованная по prefs, или None, если её нет или не хватает.
+
+    Выдачи прогреваются без фильтров по всей России, поэтому для поиска по региону не подходят.
+    """
+    if prefs.get('area', RUSSIA) != RUSSIA:
+        return None
+    try:
+        cached = vacancy_store.get_results(source, state.normalize_query(query), max_age)
+    except sqlite3.Error as e:
+        logger.error(f"Vacancy store read error: {e}")
+        return None
+    if cached is None:
+        return None
+    vacancies, found = cached
+    matched = [vac for vac in vacancies if matches(vac, prefs)]
+    # found <= len — у источника больше ничего нет, короткая выдача тоже полная
+    if len(matched) >= needed or found <= len(vacancies):
+        return matched
+    return None
+
+def trudvsem_region(area_id):
+    """Код региона Trudvsem для региона или города hh.ru; None — вся Россия, зарубежье или неизвестный субъект."""
+    if area_id is None or area_id == RUSSIA or not hh_areas.within(area_id, RUSSIA):
+        return None
+    region_id = hh_areas.region(area_id)
+    if not region_id:
+        return None
+    for word in normalize_area(hh_areas.name(region_id)).split():
+        code = TRUDVSEM_REGIONS.get(word)
+        if code:
+            return code.ljust(13, '0')
+    return None
+
+def trudvsem_request(query: str, prefs: dict):
+    """URL и параметры поиска: всё, что API умеет фильтровать сам (текст, свежесть, регион)."""
+    url = f"{TRUDVSEM_API_URL}/vacancies"
+    region = trudvsem_region(prefs.get('area'))
+    if region:
+        url = f"{url}/region/{region}"
+    modified_from = datetime.now(timezone.utc) - timedelta(days=TRUDVSEM_PERIOD_DAYS)
+    params = {
+        'text': query,
+        'limit': TRUDVSEM_PAGE_SIZE,
+        'modifiedFrom': modified_from.strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+    return url, params
+
+async def search_trudvsem(query: str, prefs: dict, target: int = TRUDVSEM_TARGET) -> list:
+    """Первая страница, затем следующие пачками по TRUDVSEM_PARALLEL_PAGES, пока не наберётся target."""
+    local = local_results('trudvsem', query, prefs, trudvsem_matches, PREWARM_FRESH, target)
+    if local is not None:
+        metrics.cache_hits.inc('prewarmed')
+        return [trudvsem_vacancy(vac) for vac in local[:target]]
+    metrics.cache_misses.inc('prewarmed')
     try:
-        params = {
-            'text': query,
-            'offset': 0,
-            'limit': 30
-        }
+        url, params = trudvsem_request(query, prefs)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{TRUDVSEM_API_URL}/vacancies",
-                params=params,
-                timeout=aiohttp.ClientTimeout(total=10)
-            ) as response:
-                if response.status != 200:
-                    return []
-                data = await response.json()
+        def fetch_page(page: int):
+            return upstream.trudvsem.get_json(url, params=dict(params, offset=page), timeout=10)
         
-        vacancies = []
-        results = data.get('results', {}).get('vacancies', [])
+        data = await fetch_page(0)
+        vacancies = parse_trudvsem_response(data, prefs)
+        total = int(data.get('meta', {}).get('total') or 0)
+        pages = min(TRUDVSEM_MAX_PAGES, -(-total // TRUDVSEM_PAGE_SIZE))
+        next_page = 1
+        while len(vacancies) < target and next_page < pages:
+            wave = [asyncio.create_task(fetch_page(page))
+                    for page in range(next_page, min(next_page + TRUDVSEM_PARALLEL_PAGES, pages))]
+            next_page += len(wave)
+            try:
+                # По порядку страниц, чтобы сохранить порядок выдачи; лишние страницы отменяем
+                for task in wave:
+                    vacancies += parse_trudvsem_response(await task, prefs)
+                    if len(vacancies) >= target:
+                        break
+            except Exception as e:
+                # Первые страницы уже есть — отдаём их, а не пустой список
+                logger.warning(f"Trudvsem page error: {e}")
+                break
+            finally:
+                for task in wave:
+                    task.cancel()
+                await asyncio.gather(*wave, return_exceptions=True)
         
-        for item in results:
-            vac = item.get('vacancy', {})
-            salary_min = vac.get('salary_min')
-            salary_max = vac.get('salary_max')
-            
-            if prefs.get('salary') and salary_max and salary_max < prefs['salary']:
-                continue
-            
-            vacancies.append({
-                'id': f"tv_{vac.get('id', '')}",
-                'name': vac.get('job-name', ''),
-                'employer': {'name': vac.get('company', {}).get('name', '')},
-                'salary': {
-                    'from': salary_min,
-                    'to': salary_max,
-                    'currency': 'RUR'
-                } if salary_min or salary_max else None,
-                'alternate_url': f"https://trudvsem.ru/vacancy/card/{vac.get('company', {}).get('companycode', '')}/{vac.get('id', '')}",
-                'area': {'name': vac.get('region', {}).get('name', '')},
-                'source': 'trudvsem'
-            })
-        return vacancies[:20]
+        return vacancies[:target]
     except Exception as e:
         logger.error(f"Trudvsem error: {e}")
-        return []
+        stale = local_results('trudvsem', query, prefs, trudvsem_matches, PREWARM_STALE, 1)
+        return [trudvsem_vacancy(vac) for vac in (stale or [])[:target]]
+
+def trudvsem_matches(vac: dict, prefs: dict) -> bool:
+    """Фильтры, которых нет в API Trudvsem: зарплата, график, опыт."""
+    salary_max = vac.get('salary_max')
+    if prefs.get('salary') and salary_max and salary_max < prefs['salary']:
+        return False
+    schedule = TRUDVSEM_SCHEDULES.get(prefs.get('schedule'))
+    if schedule and vac.get('schedule') != schedule:
+        return False
+    experience = TRUDVSEM_EXPERIENCE.get(prefs.get('experience'))
+    if experience:
+        years = (vac.get('requirement') or {}).get('experience')
+        if years is not None and not experience[0] <= years <= experience[1]:
+            return False
+    return True
+
+def trudvsem_vacancy(vac: dict) -> dict:
+    """Вакансия Trudvsem в общем формате выдачи (как у hh)."""
+    salary_min = vac.get('salary_min')
+    salary_max = vac.get('salary_max')
+    return {
+        'id': f"tv_{vac.get('id', '')}",
+        'name': vac.get('job-name', ''),
+        'employer': {'name': vac.get('company', {}).get('name', '')},
+        'salary': {
+            'from': salary_min,
+            'to': salary_max,
+            'currency': 'RUR'
+        } if salary_min or salary_max else None,
+        'alternate_url': f"https://trudvsem.ru/vacancy/card/{vac.get('company', {}).get('companycode', '')}/{vac.get('id', '')}",
+        'area': {'name': vac.get('region', {}).get('name', '')},
+        'source': 'trudvsem'
+    }
+
+def parse_trudvsem_response(data: dict, prefs: dict) -> list:
+    results = data.get('results', {}).get('vacancies', [])
+    return [trudvsem_vacancy(item.get('vacancy', {})) for item in results
+            if trudvsem_matches(item.get('vacancy', {}), prefs)]
 
 def search_telegram_vacancies(query: str, prefs: dict) -> list:
-    try:
-        with open('bot/telegram_vacancies.json', 'r', encoding='utf-8') as f:
-            all_vacancies = json.load(f)
-    except:
-        return []
-    
-    query_lower = query.lower()
-    query_words = query_lower.split()
-    
-    results = []
-    for vac in all_vacancies:
-        text = (vac.get('name', '') + ' ' + vac.get('full_text', '')).lower()
-        
-        if any(word in text for word in query_words):
-            if prefs.get('salary'):
-                sal = vac.get('salary')
-                if sal and sal.get('to') and sal['to'] < prefs['salary']:
-                    continue
-            
-            results.append(vac)
-    
-    return results[:20]
+    return telegram_index.get(TELEGRAM_VACANCIES_FILE).search(query, prefs, limit=20)
+
+def telegram_matches(vac: dict, prefs: dict) -> bool:
+    """Тот же фильтр, что в поиске по Telegram-вакансиям: только зарплата."""
+    salary_to = (vac.get('salary') or {}).get('to')
+    return not (prefs.get('salary') and salary_to and salary_to < prefs['salary'])
+
+EXCLUDE_KEYWORDS = ['менеджер по продажам', 'sales manager', 'менеджер продаж', 
+                    'торговый представитель', 'продавец-консультант', 'продавец']
+
+def merge_vacancies(vacancies: list) -> list:
+    """Убирает продажи и дубли (одинаковые название + компания) из объединённой выдачи."""
+    seen = set()
+    unique_vacancies = []
+    for vac in vacancies:
+        name_lower = vac.get('name', '').lower()
+        if any(excl in name_lower for excl in EXCLUDE_KEYWORDS):
+            continue
+        key = (name_lower, vac.get('employer', {}).get('name', '').lower())
+        if key not in seen:
+            seen.add(key)
+            unique_vacancies.append(vac)
+    return unique_vacancies
 
 def build_vacancy_keyboard(vacancies: list, page: int = 0, page_size: int = 10) -> list:
     start = page * page_size
@@ -435,9 +650,64 @@ def build_vacancy_keyboard(vacancies: list, page: int = 0, page_size: int = 10)
     if nav_row:
         keyboard.append(nav_row)
     
+    if len(vacancies) > 1:
+        keyboard.append([InlineKeyboardButton(f"✍️ Письма для первых {min(len(vacancies), BULK_COVER_COUNT)}",
+                                              callback_data="bulk_cover")])
+    keyboard.append([InlineKeyboardButton("🔔 Следить за запросом", callback_data="subscribe")])
     keyboard.append([InlineKeyboardButton("🔄 Новый поиск", callback_data="new_search")])
     return keyboard
 
+def hh_search_params(query: str, prefs: dict, per_page: int = 20) -> dict:
+    params = {
+        'text': expand_query(query),
+        'search_field': 'name',
+        'per_page': per_page,
+        'page': 0,
+        'area': prefs.get('area', RUSSIA),
+        'period': 14
+    }
+    
+    if prefs.get('schedule'):
+        params['schedule'] = prefs['schedule']
+    if prefs.get('salary'):
+        params['salary'] = prefs['salary']
+    if prefs.get('experience'):
+        params['experience'] = prefs['experience']
+    return params
+
+def hh_matches(vac: dict, prefs: dict) -> bool:
+    """Те же фильтры, что hh.ru применяет на своей стороне, — для прогретых выдач без фильтров."""
+    if prefs.get('schedule') and (vac.get('schedule') or {}).get('id') != prefs['schedule']:
+        return False
+    if prefs.get('experience') and (vac.get('experience') or {}).get('id') != prefs['experience']:
+        return False
+    salary = vac.get('salary') or {}
+    if prefs.get('salary') and salary.get('to') and salary['to'] < prefs['salary']:
+        return False
+    area_id = (vac.get('area') or {}).get('id')
+    if prefs.get('area', RUSSIA) != RUSSIA and area_id and len(hh_areas) and not hh_areas.within(area_id, prefs['area']):
+        return False
+    return True
+
+async def search_hh(query: str, prefs: dict, limit: int = 20) -> list:
+    """Свежая прогретая выдача отвечает без запроса к hh.ru; при сбое hh.ru годится и несвежая."""
+    local = local_results('hh', query, prefs, hh_matches, PREWARM_FRESH, limit)
+    if local is not None:
+        metrics.cache_hits.inc('prewarmed')
+        return local[:limit]
+    metrics.cache_misses.inc('prewarmed')
+    try:
+        data = await upstream.hh.get_json(
+            f"{HH_API_URL}/vacancies", params=hh_search_params(query, prefs, limit), headers=HEADERS,
+            timeout=15, metric='hh_search'
+        )
+    except UpstreamError:
+        stale = local_results('hh', query, prefs, hh_matches, PREWARM_STALE, 1)
+        if stale:
+            return stale[:limit]
+        raise
+    return data.get('items', [])
+
 async def search_vacancies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     query = update.message.text.strip()
@@ -446,51 +716,38 @@ async def search_vacancies(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Начни сначала: /start")
         return ConversationHandler.END
     
-    track_search()
+    track_search(query)
     prefs = user_data_store[user_id].get('preferences', {})
     
-    expanded_query = expand_query(query)
-    
     await update.message.reply_text(f"Ищу вакансии: {query}...")
     
     try:
-        params = {
-            'text': expanded_query,
-            'search_field': 'name',
-            'per_page': 20,
-            'page': 0,
-            'area': prefs.get('area', 113),
-            'period': 14
-        }
+        # Сбой hh.ru не отменяет поиск по остальным источникам
+        hh_error = None
+        with span('hh_search') as sp:
+            try:
+                hh_vacancies = await search_hh(query, prefs)
+                sp.set(results=len(hh_vacancies))
+            except UpstreamError as e:
+                logger.error(f"hh.ru search error: {e}")
+                sp.set(error=str(e))
+                hh_error = e
+                hh_vacancies = []
         
-        if prefs.get('schedule'):
-            params['schedule'] = prefs['schedule']
-        if prefs.get('salary'):
-            params['salary'] = prefs['salary']
-        if prefs.get('experience'):
-            params['experience'] = prefs['experience']
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{HH_API_URL}/vacancies",
-                params=params,
-                headers=HEADERS,
-                timeout=aiohttp.ClientTimeout(total=15)
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"HTTP {response.status}: {error_text[:200]}")
-                data = await response.json()
-        
-        hh_vacancies = data.get('items', [])
         for vac in hh_vacancies:
             vac['source'] = 'hh'
         
-        tv_vacancies = await search_trudvsem(query, prefs)
-        tg_vacancies = search_telegram_vacancies(query, prefs)
+        with span('trudvsem') as sp:
+            tv_vacancies = await search_trudvsem(query, prefs)
+            sp.set(results=len(tv_vacancies))
+        with span('telegram_search') as sp:
+            tg_vacancies = search_telegram_vacancies(query, prefs)
+            sp.set(results=len(tg_vacancies))
         
         vacancies = hh_vacancies + tv_vacancies + tg_vacancies
         
+        if not vacancies and hh_error:
+            raise hh_error
         if not vacancies:
             await update.message.reply_text(
                 "Вакансии не найдены.\n"
@@ -498,30 +755,25 @@ async def search_vacancies(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return STEP_SEARCH
         
-        seen = set()
-        unique_vacancies = []
-        exclude_keywords = ['менеджер по продажам', 'sales manager', 'менеджер продаж', 
-                           'торговый представитель', 'продавец-консультант', 'продавец']
-        for vac in vacancies:
-            name_lower = vac.get('name', '').lower()
-            if any(excl in name_lower for excl in exclude_keywords):
-                continue
-            key = (name_lower, vac.get('employer', {}).get('name', '').lower())
-            if key not in seen:
-                seen.add(key)
-                unique_vacancies.append(vac)
-        vacancies = unique_vacancies
+        with span('merge', input=len(vacancies)) as sp:
+            vacancies = merge_vacancies(vacancies)
+            sp.set(results=len(vacancies))
         
         sources = []
         if hh_vacancies:
             sources.append(f"hh.ru: {len(hh_vacancies)}")
         if tv_vacancies:
-            sources.append(f"Работа России: {len(tv_vacancies)}")
+            # Регион hh.ru, которого нет в TRUDVSEM_REGIONS, — Trudvsem искал по всей России
+            unfiltered = prefs.get('area', RUSSIA) != RUSSIA and not trudvsem_region(prefs.get('area'))
+            sources.append(f"Работа России: {len(tv_vacancies)}" + (" (по всей России)" if unfiltered else ""))
         if tg_vacancies:
             sources.append(f"Telegram: {len(tg_vacancies)}")
+        if hh_error:
+            sources.append("hh.ru временно недоступен")
         source_text = " + ".join(sources) if sources else ""
         
         user_data_store[user_id]['vacancies'] = vacancies
+        user_data_store[user_id]['last_query'] = query
         user_data_store[user_id]['current_page'] = 0
         user_data_store[user_id]['total_found'] = len(vacancies)
         user_data_store[user_id]['source_text'] = source_text
@@ -631,15 +883,10 @@ async def vacancy_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"Ссылка: {vacancy.get('alternate_url', '')}"
             )
         else:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{HH_API_URL}/vacancies/{vacancy['id']}",
-                    headers=HEADERS,
-                    timeout=aiohttp.ClientTimeout(total=15)
-                ) as response:
-                    if response.status != 200:
-                        raise Exception(f"HTTP {response.status}")
-                    vacancy_details = await response.json()
+            with span('hh_detail', vacancy_id=vacancy['id']):
+                vacancy_details = await upstream.hh.get_json(
+                    f"{HH_API_URL}/vacancies/{vacancy['id']}", headers=HEADERS, timeout=15, metric='hh_detail'
+                )
             
             description = vacancy_details.get('description', '')
             from html import unescape
@@ -701,172 +948,238 @@ async def vacancy_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return STEP_VACANCY
 
 
-async def _execute_cover_generation(context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    """Генерация сопроводительного письма (вызывается после успешной оплаты)."""
-    from html import unescape
-    import re
+def _llm_cache_key(prompt_type: str, resume: str, vacancy: dict) -> str:
+    vacancy_key = f"{vacancy.get('source', 'hh')}:{vacancy.get('id', '')}"
+    return llm_cache.make_key(resume, vacancy_key, prompt_type, PROMPT_VERSIONS[prompt_type], LLM_MODEL)
+
+
+def _has_cached_result(user_id: int, prompt_type: str) -> bool:
+    """Есть ли готовый ответ для текущего резюме и вакансии — тогда повторная выдача бесплатна."""
     resume = user_data_store[user_id].get('resume')
     vacancy = user_data_store[user_id].get('current_vacancy')
-    if not resume or not vacancy:
-        await context.bot.send_message(chat_id=user_id, text="Данные не найдены. Начни заново: /start")
-        return
-    description = vacancy.get('description', '')
-    description = re.sub(r'<[^>]+>', ' ', description)
-    description = unescape(description)
-    description = ' '.join(description.split())[:2000]
-    prompt = f"""Напиши сопроводительное письмо на русском языке. Пиши простым человеческим языком, как будто пишет живой человек, а не робот.
-
-ВАКАНСИЯ:
-Название: {vacancy.get('name', '')}
-Компания: {vacancy.get('employer', {}).get('name', '')}
-Описание: {description}
-
-РЕЗЮМЕ КАНДИДАТА:
-{resume[:2500]}
-
-ВАЖНЫЕ ПРАВИЛА СТИЛЯ:
-1. НЕ ПИШИ "С большим интересом узнал" или "С удовольствием откликаюсь" — это шаблоны
-2. Начни просто: "Увидел вашу вакансию, откликнулась потому что..." или "Заинтересовала позиция, так как..."
-3. НЕ ПИШИ про "уникальную технологию", "выдающиеся результаты", "динамичный контекст" — это пафос
-4. Мотивация должна быть честной и win-win: "У меня есть опыт X, хочу его применять и развиваться. Вижу, что вам нужен Y — могу быть полезен"
-5. Без заискивания и лести компании
-6. Коротко про релевантный опыт (1-2 конкретных примера)
-7. Длина: 120-180 слов максимум
-8. Тон: уверенный, но не высокомерный. Деловой, но человечный.
-
-Напиши только текст письма, без заголовков и подписей."""
+    return llm_cache.contains(_llm_cache_key(prompt_type, resume, vacancy))
+
+
+def _after_generation_keyboard(user_id: int, regen_button) -> list:
+    session = user_data_store.get(user_id, {})
+    vacancies = session.get('vacancies', [])
+    current_idx = session.get('current_vacancy_index', 0)
+    keyboard = []
+    if current_idx + 1 < len(vacancies[:10]):
+        keyboard.append([InlineKeyboardButton(f"➡️ Следующая ({current_idx + 2} из {len(vacancies)})", callback_data=f"vac_{current_idx + 1}")])
+    keyboard.append([regen_button])
+    keyboard.append([InlineKeyboardButton("Назад к списку вакансий", callback_data="back_to_list")])
+    keyboard.append([InlineKeyboardButton("Новый поиск", callback_data="new_search")])
+    return keyboard
+
+
+async def _execute_cover_generation(bot, user_id: int, resume: str, vacancy: dict, regenerate: bool = False):
+    """Генерация сопроводительного письма (выполняется воркером очереди или из кэша)."""
+    with span('build_prompt', type='cover'):
+        prompt = build_prompt('cover', resume, vacancy)
+    header = "**Сопроводительное письмо:**\n\n"
+    cache_key = _llm_cache_key('cover', resume, vacancy)
+    with span('llm_cache', type='cover', regenerate=regenerate) as sp:
+        cached = None if regenerate else llm_cache.get(cache_key)
+        sp.set(hit=cached is not None)
+    if cached:
+        await send_text(bot, user_id, cached, header)
+    else:
+        with span('generate', type='cover', model=LLM_MODEL) as sp:
+            cover_letter = await generate_to_chat(
+                bot, user_id, prompt, 800,
+                header=header,
+                placeholder="✍️ Пишу письмо..."
+            )
+            sp.set(chars=len(cover_letter))
+        llm_cache.put(cache_key, cover_letter)
+    keyboard = _after_generation_keyboard(user_id, InlineKeyboardButton("🔄 Сгенерировать заново", callback_data="regen_cover"))
+    await bot.send_message(
+        chat_id=user_id,
+        text=f"Ссылка: {vacancy.get('alternate_url', '')}\n\nСкопируй письмо и отправь на hh.ru",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def _execute_adapt_resume(bot, user_id: int, resume: str, vacancy: dict, regenerate: bool = False):
+    """Адаптация резюме под вакансию (выполняется воркером очереди или из кэша)."""
+    with span('build_prompt', type='adapt'):
+        prompt = build_prompt('adapt', resume, vacancy)
+    header = "**Рекомендации по адаптации резюме:**\n\n"
+    cache_key = _llm_cache_key('adapt', resume, vacancy)
+    with span('llm_cache', type='adapt', regenerate=regenerate) as sp:
+        cached = None if regenerate else llm_cache.get(cache_key)
+        sp.set(hit=cached is not None)
+    if cached:
+        await send_text(bot, user_id, cached, header)
+    else:
+        with span('generate', type='adapt', model=LLM_MODEL) as sp:
+            recommendations = await generate_to_chat(
+                bot, user_id, prompt, 1000,
+                header=header,
+                placeholder="🔍 Анализирую резюме..."
+            )
+            sp.set(chars=len(recommendations))
+        llm_cache.put(cache_key, recommendations)
+    keyboard = _after_generation_keyboard(user_id, InlineKeyboardButton("🔄 Переделать рекомендации", callback_data="regen_adapt"))
+    await bot.send_message(
+        chat_id=user_id,
+        text="Что дальше?",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+
+async def _execute_cover_batch(bot, user_id: int, resume: str, vacancies: list, delivered=(), on_delivered=None) -> list:
+    """Письма для нескольких вакансий сразу; каждое отправляется, как только готово.
+
+    Детали вакансий hh.ru загружаются параллельно, модель пишет не больше BULK_LLM_CONCURRENCY писем
+    одновременно. Готовые письма кэшируются как одиночные, поэтому повтор задачи после сбоя
+    генерирует только недостающие, а уже отправленные (номера в delivered) не отправляет снова.
+    await on_delivered(номер) — после отправки каждого письма. Возвращает [(номер, вакансия, ошибка)]
+    писем, которые не получились.
+    """
+    semaphore = asyncio.Semaphore(BULK_LLM_CONCURRENCY)
+    
+    async def write_letter(number: int, vacancy: dict):
+        try:
+            cache_key = _llm_cache_key('cover', resume, vacancy)
+            letter = llm_cache.get(cache_key)
+            if letter is None:
+                if vacancy.get('source', 'hh') == 'hh':
+                    with span('hh_detail', vacancy_id=vacancy['id']):
+                        vacancy = await upstream.hh.get_json(
+                            f"{HH_API_URL}/vacancies/{vacancy['id']}", headers=HEADERS, timeout=15, metric='hh_detail'
+                        )
+                with span('build_prompt', type='cover'):
+                    prompt = build_prompt('cover', resume, vacancy)
+                async with semaphore:
+                    with span('generate', type='cover', model=LLM_MODEL) as sp:
+                        letter = await complete(prompt, 800)
+                        sp.set(chars=len(letter))
+                llm_cache.put(cache_key, letter)
+            return number, vacancy, letter, None
+        except Exception as e:
+            logger.error(f"Bulk cover letter for {vacancy.get('id')} failed: {e}")
+            return number, vacancy, None, e
+    
+    tasks = [asyncio.create_task(write_letter(number, vacancy))
+             for number, vacancy in enumerate(vacancies, 1) if number not in delivered]
+    failed = []
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "https://replit.com",
-                    "X-Title": "HH Resume Helper"
-                },
-                json={
-                    "model": "openai/gpt-4o-mini",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 800
-                },
-                timeout=aiohttp.ClientTimeout(total=60)
-            ) as response:
-                result = await response.json()
-        if 'error' in result:
-            raise Exception(f"API: {result['error'].get('message', result['error'])}")
-        if 'choices' not in result or not result['choices']:
-            raise Exception("Неожиданный ответ API")
-        cover_letter = result['choices'][0]['message']['content']
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"**Сопроводительное письмо:**\n\n{cover_letter}",
-            parse_mode='Markdown'
-        )
-        vacancies = user_data_store[user_id].get('vacancies', [])
-        current_idx = user_data_store[user_id].get('current_vacancy_index', 0)
-        keyboard = []
-        if current_idx + 1 < len(vacancies[:10]):
-            keyboard.append([InlineKeyboardButton(f"➡️ Следующая ({current_idx + 2} из {len(vacancies)})", callback_data=f"vac_{current_idx + 1}")])
-        keyboard.append([InlineKeyboardButton("Назад к списку вакансий", callback_data="back_to_list")])
-        keyboard.append([InlineKeyboardButton("Новый поиск", callback_data="new_search")])
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"Ссылка: {vacancy.get('alternate_url', '')}\n\nСкопируй письмо и отправь на hh.ru",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    except Exception as e:
-        logger.error(f"Error generating cover letter: {e}")
-        await context.bot.send_message(chat_id=user_id, text=f"Ошибка генерации: {str(e)}")
+        for next_done in asyncio.as_completed(tasks):
+            number, vacancy, letter, error = await next_done
+            if error is not None:
+                failed.append((number, vacancy, error))
+                continue
+            await send_text(
+                bot, user_id, f"{letter}\n\nСсылка: {vacancy.get('alternate_url', '')}",
+                f"**{number}/{len(vacancies)}. {vacancy.get('name', 'Вакансия')}**\n\n"
+            )
+            if on_delivered is not None:
+                await on_delivered(number)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return sorted(failed, key=lambda item: item[0])
+
+
+async def _send_batch_summary(bot, user_id: int, total: int, failed: list, credited: bool = False):
+    text = f"Готово писем: {total - len(failed)} из {total}."
+    if failed:
+        text += "\nНе получилось для: " + ", ".join(f"{number}. {vac.get('name', '')}" for number, vac, _ in failed)
+        if credited:
+            text += f"\nОплата за них не пропадёт: добавили бесплатных писем по одной — {len(failed)}."
+        else:
+            text += "\nИх можно сгенерировать по одной из списка."
+    await bot.send_message(
+        chat_id=user_id,
+        text=text,
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("Назад к списку вакансий", callback_data="back_to_list")],
+            [InlineKeyboardButton("Новый поиск", callback_data="new_search")]
+        ])
+    )
 
 
-async def _execute_adapt_resume(context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    """Адаптация резюме под вакансию (вызывается после успешной оплаты)."""
-    from html import unescape
-    import re
-    resume = user_data_store[user_id].get('resume')
-    vacancy = user_data_store[user_id].get('current_vacancy')
-    if not resume or not vacancy:
-        await context.bot.send_message(chat_id=user_id, text="Данные не найдены. Начни заново: /start")
-        return
-    description = vacancy.get('description', '')
-    description = re.sub(r'<[^>]+>', ' ', description)
-    description = unescape(description)
-    description = ' '.join(description.split())[:2000]
-    prompt = f"""Ты редактор резюме. Дай КОНКРЕТНЫЕ правки для адаптации этого резюме под вакансию.
+GENERATION_ERRORS = {'cover': "Ошибка генерации", 'adapt': "Ошибка анализа", 'cover_batch': "Ошибка генерации писем"}
 
-ВАКАНСИЯ:
-{vacancy.get('name', '')} в {vacancy.get('employer', {}).get('name', '')}
-{description}
 
-РЕЗЮМЕ КАНДИДАТА:
-{resume[:3000]}
+async def run_generation_job(bot, job):
+    """Выполняет задачу из очереди; при повторной попытке берёт уже готовый ответ из кэша, если он есть."""
+    payload = job['payload']
+    regenerate = payload.get('regenerate', False) and job['attempts'] == 0
+    execute = _execute_cover_generation if job['kind'] == 'cover' else _execute_adapt_resume
+    with tracing.trace(f"job:{job['kind']}", user_id=job['user_id'], job_id=job['id'], attempt=job['attempts']):
+        await execute(bot, job['user_id'], payload['resume'], payload['vacancy'], regenerate=regenerate)
 
-ВАЖНО: Не пиши общие советы! Давай ТОЧНЫЕ правки к КОНКРЕТНЫМ местам резюме.
 
-Формат ответа:
+async def run_cover_batch_job(bot, job):
+    """Оплаченный пакет писем: недоделанные письма повторяются в этой же задаче, после последней
+    попытки не получившиеся возвращаются бесплатными письмами — второй раз за них не платят."""
+    payload = job['payload']
+    user_id = job['user_id']
+    delivered = set(payload.get('delivered', []))
+    
+    async def on_delivered(number: int):
+        # Прогресс — в задачу: повтор и перезапуск не отправят письмо второй раз
+        delivered.add(number)
+        payload['delivered'] = sorted(delivered)
+        await generation_jobs.update_payload(job['id'], payload)
+    
+    with tracing.trace("job:cover_batch", user_id=user_id, job_id=job['id'], attempt=job['attempts']):
+        failed = await _execute_cover_batch(bot, user_id, payload['resume'], payload['vacancies'],
+                                            delivered, on_delivered)
+    if failed and job['attempts'] + 1 < JOB_MAX_ATTEMPTS:
+        # Очередь повторит задачу с паузой; готовые письма уже отправлены и отмечены
+        raise RuntimeError(f"{len(failed)} of {len(payload['vacancies'])} letters failed: {failed[0][2]}")
+    if failed:
+        quotas.credit(user_id, 'cover', len(failed))
+    await _send_batch_summary(bot, user_id, len(payload['vacancies']), failed, credited=bool(failed))
+
+
+async def on_generation_failed(bot, job, error):
+    """Задача исчерпала попытки. Бесплатная попытка или оплата списаны при постановке в очередь —
+    возвращаем их квотой (как run_cover_batch_job): следующая генерация будет бесплатной."""
+    if job['kind'] == 'cover_batch':
+        action = 'cover'
+        credited = len(job['payload']['vacancies']) - len(job['payload'].get('delivered', []))
+    else:
+        action, credited = job['kind'], 1
+    if credited > 0:
+        quotas.credit(job['user_id'], action, credited)
+    if credited > 1:
+        refund = f"\n\nОплата не пропадёт: добавили бесплатных писем по одной — {credited}."
+    elif credited:
+        refund = "\n\nСписанная попытка возвращена: следующая генерация бесплатна — просто нажми кнопку ещё раз."
+    else:
+        refund = ""
+    await bot.send_message(
+        chat_id=job['user_id'],
+        text=f"{GENERATION_ERRORS.get(job['kind'], 'Ошибка')}: {str(error)}{refund}"
+    )
 
-📝 ПРАВКИ В РЕЗЮМЕ:
 
-1. В разделе "Опыт работы" → [название компании/должности из резюме]:
-   БЫЛО: "[точная цитата из резюме]"
-   СТАЛО: "[переписанная версия]"
+async def enqueue_generation(user_id: int, kind: str, priority: int, regenerate: bool = False) -> int:
+    """Снимок резюме и вакансии кладём в задачу — она выполнится даже после перезапуска бота."""
+    payload = {
+        'resume': user_data_store[user_id]['resume'],
+        'vacancy': user_data_store[user_id]['current_vacancy'],
+        'regenerate': regenerate
+    }
+    return await generation_jobs.enqueue(kind, user_id, payload, priority=priority)
 
-2. В разделе "Навыки":
-   ДОБАВИТЬ: [конкретный навык из требований вакансии]
 
-3. В разделе "О себе" / "Цель":
-   БЫЛО: "[цитата]"
-   СТАЛО: "[новая версия]"
+def _queue_position_text(ahead: int) -> str:
+    if ahead < generation_jobs.workers:
+        return ""
+    return f"\nПеред тобой в очереди: {ahead}."
 
-🎯 КЛЮЧЕВЫЕ СЛОВА ИЗ ВАКАНСИИ (добавь в резюме):
-- [слово 1] — вставить в [конкретный раздел]
-- [слово 2] — вставить в [конкретный раздел]
 
-Дай 3-5 конкретных правок. Цитируй реальные фразы из резюме пользователя."""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "https://replit.com",
-                    "X-Title": "HH Resume Helper"
-                },
-                json={
-                    "model": "openai/gpt-4o-mini",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 1000
-                },
-                timeout=aiohttp.ClientTimeout(total=60)
-            ) as response:
-                result = await response.json()
-        if 'error' in result:
-            raise Exception(f"API: {result['error'].get('message', result['error'])}")
-        if 'choices' not in result or not result['choices']:
-            raise Exception("Неожиданный ответ API")
-        recommendations = result['choices'][0]['message']['content']
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"**Рекомендации по адаптации резюме:**\n\n{recommendations}",
-            parse_mode='Markdown'
-        )
-        vacancies = user_data_store[user_id].get('vacancies', [])
-        current_idx = user_data_store[user_id].get('current_vacancy_index', 0)
-        keyboard = []
-        if current_idx + 1 < len(vacancies[:10]):
-            keyboard.append([InlineKeyboardButton(f"➡️ Следующая ({current_idx + 2} из {len(vacancies)})", callback_data=f"vac_{current_idx + 1}")])
-        keyboard.append([InlineKeyboardButton("Назад к списку вакансий", callback_data="back_to_list")])
-        keyboard.append([InlineKeyboardButton("Новый поиск", callback_data="new_search")])
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="Что дальше?",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    except Exception as e:
-        logger.error(f"Error adapting resume: {e}")
-        await context.bot.send_message(chat_id=user_id, text=f"Ошибка анализа: {str(e)}")
+generation_jobs = JobQueue()
+generation_jobs.register('cover', run_generation_job)
+generation_jobs.register('adapt', run_generation_job)
+generation_jobs.register('cover_batch', run_cover_batch_job)
+generation_jobs.on_failure = on_generation_failed
 
 
 async def generate_cover_letter(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -885,11 +1198,24 @@ async def generate_cover_letter(update: Update, context: ContextTypes.DEFAULT_TY
         await query.edit_message_text("Вакансия не выбрана. Начни заново: /start")
         return ConversationHandler.END
     
+    # «Сгенерировать заново» — мимо кэша, как новая генерация
+    regenerate = query.data == "regen_cover"
+    
+    # Письмо под это резюме и вакансию уже было — отдаём сохранённое без списания
+    if not regenerate and _has_cached_result(user_id, 'cover'):
+        await query.edit_message_text("Письмо для этой вакансии уже готово:")
+        await _execute_cover_generation(context.bot, user_id, resume, vacancy)
+        return STEP_VACANCY
+    
     # Проверка бесплатного лимита
     if can_use_free(user_id, 'cover'):
+        try:
+            ahead = await enqueue_generation(user_id, 'cover', PRIORITY_FREE, regenerate)
+        except QueueFull:
+            await query.edit_message_text("Сейчас слишком много запросов. Попробуй через минуту.")
+            return STEP_VACANCY
         mark_free_used(user_id, 'cover')
-        await query.edit_message_text("Генерирую сопроводительное письмо (10-20 сек)...")
-        await _execute_cover_generation(context, user_id)
+        await query.edit_message_text("Генерирую сопроводительное письмо (10-20 сек)..." + _queue_position_text(ahead))
         return STEP_VACANCY
     
     # Лимит исчерпан - отправляем invoice
@@ -898,7 +1224,7 @@ async def generate_cover_letter(update: Update, context: ContextTypes.DEFAULT_TY
         chat_id=user_id,
         title="Сопроводительное письмо (AI)",
         description="Генерация сопроводительного письма под выбранную вакансию",
-        payload="cover",
+        payload="cover_regen" if regenerate else "cover",
         provider_token=PAYMENT_PROVIDER_TOKEN,
         currency=PAYMENT_CURRENCY,
         prices=[LabeledPrice(label="Сопроводительное письмо", amount=STARS_COVER)]
@@ -906,6 +1232,46 @@ async def generate_cover_letter(update: Update, context: ContextTypes.DEFAULT_TY
     return STEP_VACANCY
 
 
+async def bulk_cover_letters(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Письма для первых BULK_COVER_COUNT вакансий выдачи: один счёт, генерация параллельно."""
+    query = update.callback_query
+    await query.answer()
+    user_id = update.effective_user.id
+    session = user_data_store.get(user_id)
+    if not session or not session.get('resume'):
+        await query.edit_message_text("Сессия истекла. Начни заново: /start")
+        return ConversationHandler.END
+    resume = session['resume']
+    vacancies = session.get('vacancies', [])[:BULK_COVER_COUNT]
+    if not vacancies:
+        await query.edit_message_text("Вакансии не найдены. Начни заново: /start")
+        return ConversationHandler.END
+    
+    # Готовые письма (уже генерировались для этого резюме) в счёт не входят
+    uncached = [vac for vac in vacancies if not llm_cache.contains(_llm_cache_key('cover', resume, vac))]
+    if not uncached:
+        await query.edit_message_text("Письма для этих вакансий уже готовы:")
+        failed = await _execute_cover_batch(context.bot, user_id, resume, vacancies)
+        await _send_batch_summary(context.bot, user_id, len(vacancies), failed)
+        return STEP_VACANCY
+    
+    # Оплата придёт отдельным апдейтом — запоминаем, для каких вакансий счёт
+    user_data_store[user_id]['bulk_vacancies'] = vacancies
+    await query.edit_message_text(
+        f"Ниже счёт на {len(uncached)} писем. После оплаты письма будут приходить в этот чат по мере готовности."
+    )
+    await context.bot.send_invoice(
+        chat_id=user_id,
+        title=f"Сопроводительные письма × {len(uncached)} (AI)",
+        description=f"Письма под первые {len(vacancies)} вакансий выдачи",
+        payload="cover_bulk",
+        provider_token=PAYMENT_PROVIDER_TOKEN,
+        currency=PAYMENT_CURRENCY,
+        prices=[LabeledPrice(label=f"Сопроводительное письмо × {len(uncached)}", amount=STARS_COVER * len(uncached))]
+    )
+    return STEP_VACANCY
+
+
 async def adapt_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -919,11 +1285,22 @@ async def adapt_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Данные не найдены. Начни заново: /start")
         return ConversationHandler.END
     
+    regenerate = query.data == "regen_adapt"
+    
+    if not regenerate and _has_cached_result(user_id, 'adapt'):
+        await query.edit_message_text("Рекомендации для этой вакансии уже готовы:")
+        await _execute_adapt_resume(context.bot, user_id, resume, vacancy)
+        return STEP_VACANCY
+    
     # Проверка бесплатного лимита
     if can_use_free(user_id, 'adapt'):
+        try:
+            ahead = await enqueue_generation(user_id, 'adapt', PRIORITY_FREE, regenerate)
+        except QueueFull:
+            await query.edit_message_text("Сейчас слишком много запросов. Попробуй через минуту.")
+            return STEP_VACANCY
         mark_free_used(user_id, 'adapt')
-        await query.edit_message_text("Анализирую и адаптирую резюме (10-20 сек)...")
-        await _execute_adapt_resume(context, user_id)
+        await query.edit_message_text("Анализирую и адаптирую резюме (10-20 сек)..." + _queue_position_text(ahead))
         return STEP_VACANCY
     
     # Лимит исчерпан - отправляем invoice
@@ -932,7 +1309,7 @@ async def adapt_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id=user_id,
         title="Адаптация резюме (AI)",
         description="Рекомендации по адаптации резюме под выбранную вакансию в формате БЫЛО/СТАЛО",
-        payload="adapt",
+        payload="adapt_regen" if regenerate else "adapt",
         provider_token=PAYMENT_PROVIDER_TOKEN,
         currency=PAYMENT_CURRENCY,
         prices=[LabeledPrice(label="Адаптация резюме", amount=STARS_ADAPT)]
@@ -976,17 +1353,37 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
     
     logger.info(f"Successful payment received: user_id={user_id}, payload={payload}")
     
-    if payload == "cover":
-        await update.message.reply_text("Оплата получена. Генерирую письмо (10–20 сек)...")
-        await _execute_cover_generation(context, user_id)
-    elif payload == "adapt":
-        await update.message.reply_text("Оплата получена. Анализирую резюме (10–20 сек)...")
-        await _execute_adapt_resume(context, user_id)
+    if payload in ("cover", "cover_regen", "adapt", "adapt_regen"):
+        kind = payload.split('_')[0]
+        session = user_data_store.get(user_id, {})
+        if not session.get('resume') or not session.get('current_vacancy'):
+            await update.message.reply_text("Данные не найдены. Начни заново: /start")
+            return
+        # Оплаченная задача принимается всегда и обгоняет бесплатные
+        ahead = await enqueue_generation(user_id, kind, PRIORITY_PAID, regenerate=payload.endswith('_regen'))
+        if kind == "cover":
+            await update.message.reply_text("Оплата получена. Генерирую письмо (10–20 сек)..." + _queue_position_text(ahead))
+        else:
+            await update.message.reply_text("Оплата получена. Анализирую резюме (10–20 сек)..." + _queue_position_text(ahead))
+    elif payload == "cover_bulk":
+        session = user_data_store.get(user_id, {})
+        if not session.get('resume') or not session.get('bulk_vacancies'):
+            await update.message.reply_text("Данные не найдены. Начни заново: /start")
+            return
+        ahead = await generation_jobs.enqueue(
+            'cover_batch', user_id,
+            {'resume': session['resume'], 'vacancies': session['bulk_vacancies']},
+            priority=PRIORITY_PAID
+        )
+        await update.message.reply_text(
+            f"Оплата получена. Пишу {len(session['bulk_vacancies'])} писем, пришлю по мере готовности..."
+            + _queue_position_text(ahead)
+        )
     elif payload == "HR_ANALYSIS_100":
-        # TODO: сохранить user_id + payment.invoice_payload в БД
+        entitlements.grant(user_id, "hr_analysis")
         await update.message.reply_text("✅ Оплата прошла успешно! Доступ активирован.")
     elif payload == "paid_access":
-        users[user_id] = {"paid": True}
+        entitlements.grant(user_id, "paid")
         await update.message.reply_text("Оплата прошла успешно. Доступ открыт.")
     else:
         await update.message.reply_text("Оплата зачислена. Если ожидался другой результат — напиши в поддержку.")
@@ -996,13 +1393,59 @@ async def premium_feature(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Пример премиум-функции с проверкой доступа."""
     user_id = update.effective_user.id
     
-    if user_id not in users or not users[user_id].get("paid"):
+    if not entitlements.has(user_id, "paid"):
         await update.message.reply_text("Доступ только для оплативших. Используй /buy")
         return
     
     await update.message.reply_text("Вот премиум-функция")
 
 
+async def subscribe_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = update.effective_user.id
+    session = user_data_store.get(user_id) or {}
+    search = session.get('last_query')
+    if not search:
+        await query.answer("Сначала выполни поиск")
+        return STEP_VACANCY
+    if subscriptions.add(user_id, search, session.get('preferences', {})):
+        await query.answer(f"Пришлю новые вакансии по запросу «{search}». Подписки: /subscriptions", show_alert=True)
+    else:
+        await query.answer(f"Не больше {SUBSCRIPTIONS_PER_USER} подписок — удали лишние: /subscriptions", show_alert=True)
+    return STEP_VACANCY
+
+
+async def subscriptions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    subs = subscriptions.for_user(update.effective_user.id)
+    if not subs:
+        await update.message.reply_text(
+            "Подписок нет. После поиска нажми «🔔 Следить за запросом» — "
+            "пришлю новые вакансии, как только они появятся."
+        )
+        return
+    lines = [f"{number}. {sub['query']}" for number, sub in enumerate(subs, 1)]
+    await update.message.reply_text(
+        "🔔 Твои подписки:\n\n" + "\n".join(lines) +
+        "\n\nhh.ru и Работа России проверяются раз в 15 минут, Telegram-каналы — после каждого сбора. "
+        "Присылаю только вакансии, которых не было в выдаче на момент подписки."
+        "\n\nОтписаться: /unsubscribe <номер> или /unsubscribe all"
+    )
+
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    subs = subscriptions.for_user(user_id)
+    arg = context.args[0] if context.args else ''
+    if arg == 'all':
+        removed = subscriptions.remove(user_id)
+    elif arg.isdigit() and 1 <= int(arg) <= len(subs):
+        removed = subscriptions.remove(user_id, subs[int(arg) - 1]['query'])
+    else:
+        await update.message.reply_text("Укажи номер из /subscriptions или all: /unsubscribe 1")
+        return
+    await update.message.reply_text(f"Удалено подписок: {removed}")
+
+
 async def back_to_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1034,7 +1477,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "**Что умеет бот:**\n"
         "• Анализирует твоё резюме\n"
         "• Ищет вакансии с фильтрами (зарплата, удалёнка, опыт)\n"
-        "• Генерирует сопроводительные письма\n"
+        "• Генерирует сопроводительные письма — по одной вакансии или сразу для первых пяти\n"
         "• Даёт рекомендации по адаптации резюме\n\n"
         "**Как пользоваться:**\n"
         "1️⃣ Загрузи резюме (PDF, Word или текст)\n"
@@ -1044,6 +1487,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "**Команды:**\n"
         "/start — Начать поиск работы\n"
         "/help — Справка\n"
+        "/subscriptions — Подписки на новые вакансии\n"
         "/cancel — Отменить\n\n"
         "📎 Форматы резюме: PDF, DOCX, TXT",
         parse_mode='Markdown'
@@ -1057,6 +1501,9 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def callback_fallback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик для нажатий кнопок, когда диалог не активен (сессия истекла или бот перезапущен)."""
+    # group=2 получает и те нажатия, которые уже обработал диалог — отвечаем только без сессии
+    if update.effective_user.id in user_data_store:
+        return
     query = update.callback_query
     await query.answer()
     await query.edit_message_text(
@@ -1064,35 +1511,256 @@ async def callback_fallback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def run_parser_periodically():
+def record_parser_run(run):
+    """Переносит последний запуск из отчёта парсера (он работает в отдельном процессе) в метрики бота."""
+    metrics.parser_runs.inc('ok')
+    if not run:
+        return
+    metrics.parser_last_duration.set(run.get('duration', 0))
+    metrics.parser_new_vacancies.set(run.get('new', 0))
+    metrics.parser_stored_vacancies.set(run.get('stored', 0))
+    for record in run.get('channels') or []:
+        metrics.upstream_latency.observe(record.get('fetch', 0.0), 'tme')
+        if record.get('status') != 200:
+            metrics.upstream_errors.inc('tme')
+
+
+def collect_metrics(application):
+    metrics.cache_hits.set(llm_cache.stats['hits'], 'llm')
+    metrics.cache_misses.set(llm_cache.stats['misses'], 'llm')
+    metrics.cache_entries.set(llm_cache.size(), 'llm')
+    for name, cache in (('vacancy_digest', prompts._vacancy_digests), ('resume_digest', prompts._resume_digests)):
+        metrics.cache_hits.set(cache.hits, name)
+        metrics.cache_misses.set(cache.misses, name)
+        metrics.cache_entries.set(len(cache), name)
+    metrics.cache_entries.set(vacancy_store.count(), 'prewarmed')
+    metrics.job_queue_depth.set(generation_jobs.depth())
+    if isinstance(application.bot.rate_limiter, OutboundScheduler):
+        metrics.outbox_waiting.set(application.bot.rate_limiter.waiting)
+    processor = application.update_processor
+    if isinstance(processor, ChatOrderedUpdateProcessor):
+        metrics.updates_running.set(processor.running)
+        metrics.updates_waiting.set(processor.waiting)
+
+
+async def run_parser_periodically(bot):
     """Run telegram parser every 12 hours"""
     await asyncio.sleep(120)
     while True:
         try:
             logger.info("Starting scheduled parser run...")
-            import subprocess
-            result = subprocess.run(
-                ['python3', 'bot/telegram_parser.py'],
-                capture_output=True,
-                text=True,
-                timeout=300
+            # Отдельный процесс, которого бот ждёт, не блокируя обработку апдейтов
+            process = await asyncio.create_subprocess_exec(
+                'python3', 'bot/telegram_parser.py',
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
             )
-            if result.returncode == 0:
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), timeout=300)
+            except asyncio.TimeoutError:
+                process.kill()
+                _, stderr = await process.communicate()
+            if process.returncode == 0:
                 logger.info("Parser completed successfully")
+                # Новый индекс строится в фоне и подменяет прежний, поиск не ждёт
+                await telegram_index.reload(TELEGRAM_VACANCIES_FILE)
+                run = await asyncio.to_thread(parser_report.last_run)
+                notified = await notify_new_telegram_vacancies(bot, run)
+                if notified:
+                    logger.info(f"Notified {notified} subscribers about new Telegram vacancies")
+                if metrics.ENABLED:
+                    record_parser_run(run)
             else:
-                logger.error(f"Parser error: {result.stderr}")
+                logger.error(f"Parser error: {stderr.decode(errors='replace')[-2000:]}")
+                if metrics.ENABLED:
+                    metrics.parser_runs.inc('error')
         except Exception as e:
             logger.error(f"Parser exception: {e}")
+            if metrics.ENABLED:
+                metrics.parser_runs.inc('error')
         await asyncio.sleep(12 * 60 * 60)
 
+def restore_snapshot() -> bool:
+    """Индекс вакансий и кэши дайджестов из снимка прошлой остановки."""
+    parts = snapshot.load()
+    restored = telegram_index.restore(parts.get('telegram_index'))
+    digests = prompts.load_digests(parts.get('digests'))
+    logger.info(f"Snapshot: index {'restored' if restored else 'stale or missing'}, {digests} digests")
+    return restored
+
+def save_snapshot() -> bool:
+    return snapshot.save({
+        'telegram_index': telegram_index.snapshot(),
+        'digests': prompts.dump_digests(),
+    })
+
+async def prewarm_hh(query: str):
+    data = await upstream.hh.get_json(
+        f"{HH_API_URL}/vacancies", params=hh_search_params(query, {}, PREWARM_PAGE_SIZE), headers=HEADERS,
+        timeout=15, metric='hh_search'
+    )
+    items = data.get('items', [])
+    return items, data.get('found', len(items))
+
+async def prewarm_trudvsem(query: str):
+    url, params = trudvsem_request(query, {})
+    data = await upstream.trudvsem.get_json(url, params=dict(params, offset=0), timeout=10)
+    items = [item.get('vacancy', {}) for item in data.get('results', {}).get('vacancies', [])]
+    return items, int(data.get('meta', {}).get('total') or len(items))
+
+async def prewarm_popular_queries(limit: int = PREWARM_TOP_N):
+    """Заново скачивает выдачи самых частых запросов и запросов подписок (без фильтров) в vacancy_store.
+
+    Перед каждым запросом ждёт, пока у источника останется запас лимита для пользователей.
+    Возвращает число обновлённых выдач и {источник: вакансии, которых раньше не было}.
+    """
+    warmed = 0
+    new = {'hh': [], 'trudvsem': []}
+    queries = [query for query, _ in query_log.top(limit)] if limit else []
+    # Подписка сверяется с новыми вакансиями выдачи своего же запроса, а не только популярных
+    queries += [query for query in subscriptions.queries(SUBSCRIPTION_POLL_LIMIT) if query not in queries]
+    for query in queries:
+        for source, client, fetch in (('hh', upstream.hh, prewarm_hh), ('trudvsem', upstream.trudvsem, prewarm_trudvsem)):
+            await client.wait_idle()
+            try:
+                vacancies, found = await fetch(query)
+                new[source] += vacancy_store.save_results(source, query, vacancies, found)
+                warmed += 1
+            except (UpstreamError, sqlite3.Error) as e:
+                logger.warning(f"Prewarm {source} {query!r}: {e}")
+    return warmed, new
+
+# Как сверять с подписками новые вакансии источника: текст для слов запроса, фильтры, вид для уведомления
+SUBSCRIPTION_SOURCES = {
+    'hh': (lambda vac: vac.get('name', ''), hh_matches, lambda vac: dict(vac, source='hh')),
+    'trudvsem': (lambda vac: vac.get('job-name', ''), trudvsem_matches, trudvsem_vacancy),
+    'telegram': (lambda vac: vac.get('name', '') + ' ' + vac.get('full_text', ''), telegram_matches, lambda vac: vac),
+}
+
+def telegram_index_version():
+    """Индекс Telegram-вакансий и метка версии файла, по которой он построен (для курсоров API)."""
+    telegram_index.get(TELEGRAM_VACANCIES_FILE)
+    return telegram_index.loaded()
+
+# Локальный JSON API для веб-интерфейса (только при заданном API_PORT)
+vacancy_api_server = vacancy_api.VacancyApi(telegram_index_version, SUBSCRIPTION_SOURCES)
+
+def match_subscriptions(new: dict) -> dict:
+    """{источник: новые вакансии} -> {user_id: [(запрос, вакансия)]}."""
+    matched = {}
+    for source, vacancies in new.items():
+        text, matches, convert = SUBSCRIPTION_SOURCES[source]
+        for user_id, found in subscriptions.match(vacancies, text, matches).items():
+            matched.setdefault(user_id, []).extend((query, convert(vac)) for query, vac in found)
+    return matched
+
+async def notify_subscribers(bot, matched: dict) -> int:
+    """Одно сообщение на пользователя за пачку новых вакансий; возвращает число отправленных.
+
+    Отправляются параллельно: темп задаёт очередь исходящих (outbox.py), ответы пользователям идут раньше.
+    """
+    async def notify(user_id, found):
+        lines = [
+            f"«{query}»: {vac.get('name', '')} • {(vac.get('employer') or {}).get('name', '')}\n{vac.get('alternate_url', '')}"
+            for query, vac in found[:NOTIFY_LIMIT]
+        ]
+        if len(found) > NOTIFY_LIMIT:
+            lines.append(f"…и ещё {len(found) - NOTIFY_LIMIT}")
+        try:
+            await bot.send_message(
+                user_id,
+                "🔔 Новые вакансии по подпискам:\n\n" + "\n\n".join(lines) + "\n\nПодписки: /subscriptions",
+                link_preview_options=LinkPreviewOptions(is_disabled=True),
+                rate_limit_args={'priority': PRIORITY_BULK}
+            )
+            return True
+        except Forbidden:
+            # Пользователь заблокировал бота — подписки больше не нужны
+            subscriptions.remove(user_id)
+        except TelegramError as e:
+            logger.warning(f"Subscription notification to {user_id} failed: {e}")
+        return False
+
+    results = await asyncio.gather(*(notify(user_id, found) for user_id, found in matched.items()))
+    return sum(results)
+
+async def notify_new_telegram_vacancies(bot, run) -> int:
+    """Новые вакансии запуска парсера (new_ids в его записи parser_runs.jsonl) — подписчикам."""
+    new_ids = set((run or {}).get('new_ids') or [])
+    if not new_ids or not len(subscriptions):
+        return 0
+    await telegram_index.reload(TELEGRAM_VACANCIES_FILE)
+    index = await asyncio.to_thread(telegram_index.get, TELEGRAM_VACANCIES_FILE)
+    # Парсер записывает новые вакансии в начало файла
+    new = [vac for vac in map(index.vacancy, range(min(len(new_ids), len(index)))) if vac.get('id') in new_ids]
+    return await notify_subscribers(bot, match_subscriptions({'telegram': new}))
+
+async def run_prewarm_periodically(bot):
+    await asyncio.sleep(60)
+    while True:
+        try:
+            # Процессов бота может быть несколько — прогревает тот, кто первым заметил, что пора
+            last = state_backend.get('meta', 'prewarm_at') or 0
+            if time.time() - last >= PREWARM_INTERVAL * 0.9:
+                state_backend.set('meta', 'prewarm_at', time.time())
+                started = time.perf_counter()
+                with tracing.trace('prewarm') as sp:
+                    warmed, new = await prewarm_popular_queries()
+                    sp.set(results=warmed)
+                logger.info(f"Prewarmed {warmed} result pages in {time.perf_counter() - started:.1f}s")
+                notified = await notify_subscribers(bot, match_subscriptions(new))
+                if notified:
+                    logger.info(f"Notified {notified} subscribers about new hh.ru / Trudvsem vacancies")
+        except Exception as e:
+            logger.error(f"Prewarm exception: {e}")
+        await asyncio.sleep(PREWARM_INTERVAL)
+
+async def fetch_hh_areas() -> list:
+    return await upstream.hh.get_json(f"{HH_API_URL}/areas", headers=HEADERS, timeout=30, metric='hh_areas')
+
 async def post_init(application):
+    if not restore_snapshot():
+        # Строим в фоне: поиск до готовности индекса просто построит его сам
+        asyncio.create_task(telegram_index.reload(TELEGRAM_VACANCIES_FILE))
+    # Файл мог обновить и парсер, запущенный не ботом (cron), — подхватываем без перезапуска.
+    # --backfill файл не трогает: история идёт только в vacancy_store
+    asyncio.create_task(telegram_index.watch(TELEGRAM_VACANCIES_FILE, TELEGRAM_INDEX_POLL))
+    state.import_stats_json(state_backend, STATS_FILE)
+    purged = user_data_store.purge() + conversations.purge()
+    if purged:
+        logger.info(f"Purged {purged} stale sessions")
+    query_log.purge()
+    vacancy_store.purge()
     await application.bot.set_my_commands([
         ("start", "Начать поиск работы"),
         ("help", "Справка и возможности"),
+        ("subscriptions", "Подписки на новые вакансии"),
         ("cancel", "Отменить текущий поиск")
     ])
+    asyncio.create_task(hh_areas.keep_fresh(fetch_hh_areas))
+    asyncio.create_task(loop_lag.run())
     # Запуск фоновой задачи парсера
-    asyncio.create_task(run_parser_periodically())
+    asyncio.create_task(run_parser_periodically(application.bot))
+    if PREWARM_TOP_N or SUBSCRIPTION_POLL_LIMIT:
+        asyncio.create_task(run_prewarm_periodically(application.bot))
+    # Воркеры очереди AI-задач (подхватывают и задачи, прерванные прошлым перезапуском)
+    await generation_jobs.start(application.bot)
+    if metrics.ENABLED:
+        metrics.add_collector(lambda: collect_metrics(application))
+        await metrics.start_server()
+    if vacancy_api.ENABLED:
+        await vacancy_api_server.start()
+
+async def post_stop(application):
+    # Application.stop() уже не берёт новые апдейты, но бот и очередь исходящих ещё работают:
+    # дожидаемся генераций, пока им есть куда отправить результат
+    await metrics.stop_server()
+    await vacancy_api_server.stop()
+    await generation_jobs.stop()
+
+async def post_shutdown(application):
+    await close_llm_session()
+    await upstream.close_all()
+    save_snapshot()
 
 def main():
     if not TOKEN:
@@ -1106,12 +1774,49 @@ def main():
         return
     
     try:
-        application = Application.builder().token(TOKEN).post_init(post_init).build()
+        application = build_application(TOKEN)
     except Exception as e:
         logger.error(f"Ошибка при создании Application: {e}")
         return
+
+    logger.info("Bot starting...")
+    logger.info(f"TOKEN loaded: {'Yes' if TOKEN else 'No'}")
+    logger.info(f"OPENROUTER_API_KEY loaded: {'Yes' if OPENROUTER_API_KEY else 'No'}")
     
-    conv_handler = ConversationHandler(
+    try:
+        if BOT_MODE == "webhook":
+            from webhook import run_webhook
+            logger.info("Starting webhook server...")
+            asyncio.run(run_webhook(application))
+        else:
+            logger.info("Starting run_polling()...")
+            application.run_polling(
+                drop_pending_updates=True
+            )
+        logger.info("Bot stopped")
+    except KeyboardInterrupt:
+        logger.info("Bot stopped by user")
+    except Exception as e:
+        logger.error(f"Ошибка при запуске бота: {e}", exc_info=True)
+        raise
+
+
+def build_application(token: str, update_processor=None) -> Application:
+    """Создаёт Application со всеми обработчиками (используется main() и нагрузочным стендом)."""
+    builder = Application.builder().token(token).post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    # Сессии сохраняются после каждого апдейта, апдейты одного чата не идут параллельно и между процессами
+    builder = builder.application_class(state.SharedStateApplication, kwargs={'state_backend': state_backend})
+    # Апдейты разных пользователей обрабатываются параллельно, одного пользователя — по порядку
+    builder = builder.concurrent_updates(update_processor or ChatOrderedUpdateProcessor())
+    # Все исходящие запросы — через общую очередь с лимитами Telegram
+    builder = builder.rate_limiter(OutboundScheduler())
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if tracing.ENABLED:
+        builder = builder.request(tracing.make_request())
+    application = builder.build()
+    
+    conv_handler = state.SharedConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             STEP_RESUME: [
@@ -1122,6 +1827,7 @@ def main():
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_preferences)
             ],
             STEP_SEARCH: [
+                CallbackQueryHandler(reset_area, pattern='^area_any$'),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, search_vacancies)
             ],
             STEP_VACANCY: [
@@ -1130,8 +1836,10 @@ def main():
                 CallbackQueryHandler(vacancy_selected, pattern='^back_search$'),
                 CallbackQueryHandler(vacancy_selected, pattern=r'^page_\d+$'),
                 CallbackQueryHandler(back_to_list, pattern='^back_to_list$'),
-                CallbackQueryHandler(generate_cover_letter, pattern='^gen_cover$'),
-                CallbackQueryHandler(adapt_resume, pattern='^adapt_resume$'),
+                CallbackQueryHandler(subscribe_search, pattern='^subscribe$'),
+                CallbackQueryHandler(generate_cover_letter, pattern='^(gen_cover|regen_cover)$'),
+                CallbackQueryHandler(bulk_cover_letters, pattern='^bulk_cover$'),
+                CallbackQueryHandler(adapt_resume, pattern='^(adapt_resume|regen_adapt)$'),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, search_vacancies)
             ]
         },
@@ -1139,7 +1847,9 @@ def main():
             CommandHandler('start', start),
             CommandHandler('cancel', cancel)
         ],
-        allow_reentry=True
+        allow_reentry=True,
+        name='dialog',
+        store=conversations
     )
     
    # ===== ПЛАТЕЖИ (САМЫЙ ВЫСОКИЙ ПРИОРИТЕТ) =====
@@ -1154,7 +1864,10 @@ def main():
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command), group=1)
     application.add_handler(CommandHandler("stats", stats_command), group=1)
+    application.add_handler(CommandHandler("perf", perf_command), group=1)
     application.add_handler(CommandHandler("myid", myid_command), group=1)
+    application.add_handler(CommandHandler("subscriptions", subscriptions_command), group=1)
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command), group=1)
     application.add_handler(CommandHandler("premium", premium_feature), group=1)
 
     # ===== DIALOG FLOW =====
@@ -1163,22 +1876,11 @@ def main():
     # Обработчик нажатий кнопок вне диалога (group=2 — после conv_handler)
     application.add_handler(CallbackQueryHandler(callback_fallback), group=2)
 
-    logger.info("Bot starting...")
-    logger.info(f"TOKEN loaded: {'Yes' if TOKEN else 'No'}")
-    logger.info(f"OPENROUTER_API_KEY loaded: {'Yes' if OPENROUTER_API_KEY else 'No'}")
-    
-    try:
-        logger.info("Starting run_polling()...")
-        application.run_polling(
-            application.run_polling()
-            drop_pending_updates=True
-        )
-        logger.info("run_polling() completed (this should not happen normally)")
-    except KeyboardInterrupt:
-        logger.info("Bot stopped by user")
-    except Exception as e:
-        logger.error(f"Ошибка при запуске бота: {e}", exc_info=True)
-        raise
+    # Замеры времени и ошибок всех обработчиков (только при заданном METRICS_PORT)
+    metrics.instrument_application(application)
+    # Трассы апдейтов (только при TRACE_SAMPLE_RATE или TRACE_SLOW_MS)
+    tracing.instrument_application(application)
+    return application
 
 
 if __name__ == "__main__":
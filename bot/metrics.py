@@ -0,0 +1,257 @@
+import os
+import time
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Порт HTTP-эндпоинта /metrics в формате Prometheus; не задан — метрики выключены и ничего не стоят
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+ENABLED = bool(METRICS_PORT)
+# Текстовый формат экспозиции Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+_registry = []
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def render(self, kind='counter'):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {kind}"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def render(self, kind='gauge'):
+        return super().render(kind)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам..., +Inf], сумма, количество
+        self.values = {}
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def quantile(self, q, *labels):
+        """Оценка квантиля по корзинам (верхняя граница корзины, как histogram_quantile без интерполяции)."""
+        entry = self.values.get(labels)
+        if not entry or not entry[2]:
+            return None
+        rank = q * entry[2]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), entry[0]):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+handler_latency = Histogram('bot_handler_duration_seconds', 'Время обработки апдейта', ['handler'])
+handler_errors = Counter('bot_handler_errors_total', 'Исключения в обработчиках', ['handler'])
+handler_in_flight = Gauge('bot_handler_in_flight', 'Апдейты в обработке', ['handler'])
+upstream_latency = Histogram('bot_upstream_duration_seconds', 'Время запросов к внешним сервисам', ['upstream'])
+upstream_errors = Counter('bot_upstream_errors_total', 'Ошибки запросов к внешним сервисам', ['upstream'])
+upstream_in_flight = Gauge('bot_upstream_in_flight', 'Запросы к внешним сервисам в процессе', ['upstream'])
+upstream_retries = Counter('bot_upstream_retries_total', 'Повторные запросы к внешним сервисам', ['upstream'])
+upstream_rejected = Counter('bot_upstream_rejected_total', 'Запросы, отклонённые предохранителем без обращения к сервису', ['upstream'])
+upstream_coalesced = Counter('bot_upstream_coalesced_total', 'Запросы, получившие ответ уже идущего такого же запроса', ['upstream'])
+upstream_breaker_state = Gauge('bot_upstream_breaker_state', 'Предохранитель: 0 — закрыт, 1 — проверка, 2 — открыт', ['upstream'])
+llm_first_token = Histogram('bot_llm_first_token_seconds', 'Время до первого куска текста в стриминге')
+cache_hits = Counter('bot_cache_hits_total', 'Попадания в кэши', ['cache'])
+cache_misses = Counter('bot_cache_misses_total', 'Промахи кэшей', ['cache'])
+cache_entries = Gauge('bot_cache_entries', 'Записей в кэше', ['cache'])
+event_loop_lag = Gauge('bot_event_loop_lag_seconds', 'Максимальная задержка цикла событий за минуту')
+updates_running = Gauge('bot_updates_running', 'Апдейты, обрабатываемые прямо сейчас')
+updates_waiting = Gauge('bot_updates_waiting', 'Апдейты, ждущие слот или предыдущий апдейт своего чата')
+job_queue_depth = Gauge('bot_job_queue_depth', 'Задач генерации в очереди')
+outbox_waiting = Gauge('bot_outbox_waiting', 'Исходящие запросы к Telegram, ждущие лимита')
+outbox_coalesced = Counter('bot_outbox_coalesced_total', 'Правки сообщений, заменённые более поздней правкой до отправки')
+outbox_retry_after = Counter('bot_outbox_retry_after_total', 'Ответы 429 (flood limit) от Telegram')
+parser_runs = Counter('bot_parser_runs_total', 'Запуски парсера Telegram-каналов', ['result'])
+parser_last_duration = Gauge('bot_parser_last_run_seconds', 'Длительность последнего запуска парсера')
+parser_new_vacancies = Gauge('bot_parser_last_new_vacancies', 'Новых вакансий за последний запуск парсера')
+parser_stored_vacancies = Gauge('bot_parser_stored_vacancies', 'Вакансий в хранилище после запуска парсера')
+
+
+# Функции, обновляющие метрики перед отдачей (счётчики кэшей, глубина очереди) — без затрат на горячем пути
+_collectors = []
+
+
+def add_collector(fn):
+    _collectors.append(fn)
+
+
+def render() -> str:
+    for collect in _collectors:
+        try:
+            collect()
+        except Exception as e:
+            logger.error(f"Metrics collector error: {e}")
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class _UpstreamTimer:
+    __slots__ = ('upstream', 'started')
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+
+    def exclude(self, seconds: float):
+        """Не считать время, когда ждали не сервис (потребитель потокового ответа)."""
+        self.started += seconds
+
+    def __enter__(self):
+        upstream_in_flight.inc(self.upstream)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        upstream_latency.observe(time.perf_counter() - self.started, self.upstream)
+        upstream_in_flight.dec(self.upstream)
+        # Отмена задачи и закрытие генератора — не ошибка сервиса
+        if exc_type is not None and issubclass(exc_type, Exception):
+            upstream_errors.inc(self.upstream)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def track_upstream(upstream: str):
+    """async with track_upstream('hh_search'): ... — время, ошибки и число запросов в процессе.
+
+    Пишется и без METRICS_PORT (для /perf): на фоне сетевого запроса пара обращений к словарю незаметна.
+    """
+    return _UpstreamTimer(upstream)
+
+
+def _wrap_callback(name, callback):
+    async def instrumented(update, context):
+        handler_in_flight.inc(name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+            handler_in_flight.dec(name)
+    instrumented.__name__ = name
+    instrumented.__wrapped__ = callback
+    return instrumented
+
+
+def iter_handlers(handlers):
+    for handler in handlers:
+        # ConversationHandler — оборачиваем вложенные обработчики всех состояний
+        if hasattr(handler, 'entry_points') and hasattr(handler, 'states'):
+            yield from iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from iter_handlers(state_handlers)
+            yield from iter_handlers(handler.fallbacks)
+        elif getattr(handler, 'callback', None) is not None:
+            yield handler
+
+
+def instrument_application(application):
+    """Оборачивает колбэки всех зарегистрированных обработчиков замером времени и ошибок."""
+    if not ENABLED:
+        return
+    for group_handlers in application.handlers.values():
+        for handler in iter_handlers(group_handlers):
+            if not hasattr(handler.callback, '__wrapped__'):
+                handler.callback = _wrap_callback(handler.callback.__name__, handler.callback)
+
+
+_runner = None
+
+
+async def start_server():
+    global _runner
+    if not ENABLED or _runner is not None:
+        return
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        # content_type= в aiohttp не принимает параметры, а version=0.0.4 нужен Prometheus — заголовок целиком
+        return web.Response(body=render().encode('utf-8'), headers={
+            'Content-Type': CONTENT_TYPE,
+            'X-Content-Type-Options': 'nosniff',
+        })
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, METRICS_HOST, int(METRICS_PORT)).start()
+    logger.info(f"Metrics endpoint: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,193 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+from upstream import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в секунду на бота (Telegram: не больше ~30); при нескольких процессах делится между ними
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+GLOBAL_BURST = 5
+# Личный чат — ~1 сообщение в секунду в среднем: ответы на действия пользователя идут пачкой,
+# а стриминг и рассылки упираются в лимит; группа — 20 в минуту
+PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST = 1.0, 10
+GROUP_CHAT_RATE, GROUP_CHAT_BURST = 20 / 60, 3
+# Сколько раз повторять запрос после 429 (Retry-After приостанавливает отправки в чат или все)
+MAX_RETRIES = 2
+MAX_RETRY_AFTER = 30
+
+# rate_limit_args={'priority': ...} у методов бота; ответы пользователю идут раньше рассылок
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EDIT = 5  # правки (прогресс стриминга) — после новых ответов, но раньше рассылок
+PRIORITY_BULK = 10
+
+# Правки сообщения, которые ещё ждут очереди, заменяются более поздней правкой того же сообщения
+COALESCED_ENDPOINTS = {'editMessageText'}
+
+
+class _Edit:
+    """Правка, ждущая отправки: args подменяются более поздней правкой того же сообщения."""
+
+    def __init__(self, key, args):
+        self.key = key
+        self.args = args
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Общая очередь исходящих запросов к Bot API: лимиты на бота и на чат, приоритеты, склейка правок.
+
+    Подключается к Application как rate limiter, поэтому через неё идут все вызовы bot.* из
+    обработчиков, очереди генерации и рассылок. Запросы одного чата уходят по порядку и не чаще
+    лимита чата; общий лимит раздаётся по приоритету (rate_limit_args), внутри приоритета — по
+    очереди. Запросы без chat_id (answerCallbackQuery, getFile, ...) не ограничиваются.
+    """
+
+    def __init__(self, global_rate: float = OUTBOX_GLOBAL_RATE):
+        self.bucket = TokenBucket(global_rate, GLOBAL_BURST)
+        self._chats = {}  # chat_id -> [TokenBucket, asyncio.Lock, ожидающих]
+        self._waiting = []  # куча (приоритет, номер, future) ждущих общего лимита
+        self._order = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._edits = {}  # (chat_id, message_id) -> _Edit, ещё не отправленная
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    async def initialize(self):
+        # ExtBot.initialize зовёт нас при каждом вызове, а Application.initialize вызывает его дважды
+        # (сам и через Updater) — второй диспетчер остался бы висеть без shutdown
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for _, _, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting) + sum(chat[2] for chat in self._chats.values())
+
+    async def _dispatch(self):
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self.bucket.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                self.bucket.tokens -= 1
+                future.set_result(None)
+
+    async def _acquire_global(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._order), future))
+        self._wakeup.set()
+        await future
+
+    def _chat(self, chat_id):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) > 10000:
+                self._forget_idle_chats()
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+            chat = self._chats[chat_id] = [bucket, asyncio.Lock(), 0]
+        return chat
+
+    def _forget_idle_chats(self):
+        for chat_id, (bucket, lock, waiting) in list(self._chats.items()):
+            if not waiting and not lock.locked() and bucket.delay() == 0 and bucket.tokens >= bucket.burst:
+                del self._chats[chat_id]
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None or self._dispatcher is None:
+            return await callback(*args, **kwargs)
+        if endpoint not in COALESCED_ENDPOINTS or data.get('message_id') is None:
+            priority = (rate_limit_args or {}).get('priority', PRIORITY_INTERACTIVE)
+            return await self._send(chat_id, priority, callback, args, kwargs)
+        priority = (rate_limit_args or {}).get('priority', PRIORITY_EDIT)
+        key = (chat_id, data['message_id'])
+        pending = self._edits.get(key)
+        if pending is not None:
+            # Прошлая правка ещё в очереди — вместо неё уйдёт эта, результат получат обе
+            pending.args = args
+            self.coalesced += 1
+            metrics.outbox_coalesced.inc()
+            return await asyncio.shield(pending.future)
+        edit = self._edits[key] = _Edit(key, args)
+        try:
+            result = await self._send(chat_id, priority, callback, args, kwargs, edit)
+        except Exception as e:
+            edit.future.set_exception(e)
+            # Помечаем ошибку полученной: склеенных правок могло и не быть
+            edit.future.exception()
+            raise
+        except BaseException:
+            edit.future.cancel()
+            raise
+        finally:
+            if self._edits.get(key) is edit:
+                del self._edits[key]
+        edit.future.set_result(result)
+        return result
+
+    async def _send(self, chat_id, priority, callback, args, kwargs, edit=None):
+        bucket, lock, _ = chat = self._chat(chat_id)
+        # Запросы чата уходят строго по порядку
+        chat[2] += 1
+        try:
+            await lock.acquire()
+        finally:
+            chat[2] -= 1
+        try:
+            attempt = 0
+            while True:
+                await bucket.acquire()
+                await self._acquire_global(priority)
+                if edit is not None and self._edits.get(edit.key) is edit:
+                    # Дальше правки сообщения копятся уже для следующей отправки
+                    args = edit.args
+                    del self._edits[edit.key]
+                try:
+                    result = await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    retry_after = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                    metrics.outbox_retry_after.inc()
+                    # Чат и так отправлял на пределе — 429 за него, иначе за общий лимит: пауза для всех
+                    if bucket.tokens < 1:
+                        bucket.block_for(retry_after)
+                    else:
+                        self.bucket.block_for(retry_after)
+                    if attempt >= MAX_RETRIES or retry_after > MAX_RETRY_AFTER:
+                        raise
+                    attempt += 1
+                    self.retried += 1
+                    logger.warning(f"Flood limit on chat {chat_id}, retry in {retry_after}s")
+                    continue
+                self.sent += 1
+                return result
+        finally:
+            lock.release()
@@ -0,0 +1,245 @@
+"""Отчёт о запуске парсера Telegram-каналов: по каждому каналу — где ушло время и сколько пользы.
+
+    python bot/parser_report.py                 # последний запуск
+    python bot/parser_report.py --runs 20       # сводка по последним 20 запускам: самые медленные и бесполезные каналы
+
+На канал: DNS, соединение (TCP+TLS), TTFB (запрос → заголовки ответа), загрузка тела, разбор HTML,
+извлечение вакансий, число сообщений, доля вакансий среди них, новые, повторы и класс ошибки.
+Отчёты запусков дописываются в PARSER_REPORT_FILE (JSONL, последние PARSER_REPORT_RUNS).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime
+
+import aiohttp
+
+PARSER_REPORT_FILE = os.getenv("PARSER_REPORT_FILE", "bot/parser_runs.jsonl")
+PARSER_REPORT_RUNS = 100
+
+TIMINGS = ('dns', 'connect', 'ttfb', 'download', 'parse', 'extract')
+
+
+def channel_record(channel: str) -> dict:
+    # fetch — полное время загрузки страницы, в том числе неудачной (для upstream_latency{tme} в боте)
+    record = {'channel': channel, 'error': None, 'status': None, 'bytes': 0, 'fetch': 0.0,
+              'messages': 0, 'vacancies': 0, 'new': 0, 'duplicates': 0}
+    record.update(dict.fromkeys(TIMINGS, 0.0))
+    return record
+
+
+def error_class(error) -> str:
+    return type(error).__name__
+
+
+async def _on_request_start(session, ctx, params):
+    marks = ctx.trace_request_ctx
+    if marks is not None:
+        marks['start'] = marks['ready'] = time.perf_counter()
+
+
+async def _on_dns_start(session, ctx, params):
+    if ctx.trace_request_ctx is not None:
+        ctx.trace_request_ctx['dns_start'] = time.perf_counter()
+
+
+async def _on_dns_end(session, ctx, params):
+    marks = ctx.trace_request_ctx
+    if marks is not None and 'dns_start' in marks:
+        marks['dns'] = time.perf_counter() - marks['dns_start']
+
+
+async def _on_connection_start(session, ctx, params):
+    if ctx.trace_request_ctx is not None:
+        ctx.trace_request_ctx['connect_start'] = time.perf_counter()
+
+
+async def _on_connection_end(session, ctx, params):
+    marks = ctx.trace_request_ctx
+    if marks is not None:
+        marks['ready'] = time.perf_counter()
+        if 'connect_start' in marks:
+            # Создание соединения включает DNS — вычитаем, чтобы фазы не пересекались
+            marks['connect'] = marks['ready'] - marks['connect_start'] - marks.get('dns', 0.0)
+
+
+async def _on_connection_reused(session, ctx, params):
+    if ctx.trace_request_ctx is not None:
+        ctx.trace_request_ctx['ready'] = time.perf_counter()
+
+
+async def _on_request_end(session, ctx, params):
+    # Вызывается, когда получены заголовки ответа; тело ещё не читалось
+    marks = ctx.trace_request_ctx
+    if marks is not None:
+        marks['headers'] = time.perf_counter()
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    """Замеры фаз запроса; включаются для запроса через session.get(..., trace_request_ctx={})."""
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(_on_request_start)
+    config.on_dns_resolvehost_start.append(_on_dns_start)
+    config.on_dns_resolvehost_end.append(_on_dns_end)
+    config.on_connection_create_start.append(_on_connection_start)
+    config.on_connection_create_end.append(_on_connection_end)
+    config.on_connection_reuseconn.append(_on_connection_reused)
+    config.on_request_end.append(_on_request_end)
+    return config
+
+
+def apply_marks(record: dict, marks: dict, body_read: float = None):
+    """Переносит отметки trace_config() в запись канала; body_read — когда дочитано тело ответа."""
+    record['dns'] = marks.get('dns', 0.0)
+    record['connect'] = marks.get('connect', 0.0)
+    if 'headers' in marks:
+        record['ttfb'] = marks['headers'] - marks['ready']
+        if body_read is not None:
+            record['download'] = body_read - marks['headers']
+
+
+def fetch_time(record: dict) -> float:
+    return record['dns'] + record['connect'] + record['ttfb'] + record['download']
+
+
+def build_run(started_at: datetime, duration: float, records: list, new_ids: list, stored: int) -> dict:
+    """Запись запуска; new_ids — id новых вакансий, по ним бот уведомляет подписчиков."""
+    totals = {name: sum(record[name] for record in records) for name in TIMINGS}
+    for name in ('messages', 'vacancies', 'new', 'duplicates', 'bytes'):
+        totals[name] = sum(record[name] for record in records)
+    totals['errors'] = sum(1 for record in records if record['error'])
+    return {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'duration': duration,
+        'new': len(new_ids),
+        'stored': stored,
+        'totals': totals,
+        'channels': records,
+        'new_ids': new_ids,
+    }
+
+
+def save_run(run: dict, path: str = PARSER_REPORT_FILE, keep: int = PARSER_REPORT_RUNS):
+    runs = load_runs(path)[-(keep - 1):] if keep > 1 else []
+    runs.append(run)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for item in runs:
+            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def load_runs(path: str = PARSER_REPORT_FILE) -> list:
+    runs = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    runs.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return runs
+
+
+def last_run(path: str = PARSER_REPORT_FILE):
+    """Последний запуск из отчёта или None."""
+    runs = load_runs(path)
+    return runs[-1] if runs else None
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:7.0f}"
+
+
+def format_run(run: dict, top: int = 5) -> str:
+    """Сводка запуска: итоги по фазам, самые медленные каналы, каналы без новых вакансий и с ошибками."""
+    totals = run['totals']
+    records = run['channels']
+    lines = [
+        f"Parser run {run['started_at']}: {run['duration']:.1f}s, {len(records)} channels, "
+        f"{totals['messages']} messages, {totals['vacancies']} vacancies "
+        f"({totals['new']} new, {totals['duplicates']} duplicates), {totals['errors']} errors",
+        "  time, s: " + ', '.join(f"{name} {totals[name]:.2f}" for name in TIMINGS),
+    ]
+    slowest = sorted(records, key=lambda r: fetch_time(r) + r['parse'] + r['extract'], reverse=True)[:top]
+    if slowest:
+        lines.append(f"{'  slowest, ms:':<34}{'dns':>7} {'connect':>7} {'ttfb':>7} {'download':>8} {'parse':>7} {'extract':>7}")
+        for r in slowest:
+            lines.append(f"    @{r['channel']:<28.28} {_ms(r['dns'])} {_ms(r['connect'])} {_ms(r['ttfb'])} "
+                         f"{_ms(r['download']):>8} {_ms(r['parse'])} {_ms(r['extract'])}")
+    useless = [r['channel'] for r in records if not r['error'] and not r['new']]
+    if useless:
+        lines.append(f"  no new vacancies ({len(useless)}): " + ', '.join(f"@{c}" for c in useless[:20])
+                     + (' …' if len(useless) > 20 else ''))
+    failed = [r for r in records if r['error']]
+    if failed:
+        lines.append(f"  errors ({len(failed)}): " + ', '.join(f"@{r['channel']} {r['error']}" for r in failed[:20])
+                     + (' …' if len(failed) > 20 else ''))
+    return '\n'.join(lines)
+
+
+def aggregate(runs: list) -> list:
+    """По каналу за несколько запусков: медианное время, вакансий и новых на запуск, доля ошибок."""
+    by_channel = {}
+    for run in runs:
+        for record in run['channels']:
+            by_channel.setdefault(record['channel'], []).append(record)
+    rows = []
+    for channel, records in by_channel.items():
+        ok = [r for r in records if not r['error']]
+        messages = sum(r['messages'] for r in ok)
+        rows.append({
+            'channel': channel,
+            'runs': len(records),
+            'errors': len(records) - len(ok),
+            'time': statistics.median(fetch_time(r) + r['parse'] + r['extract'] for r in records),
+            'ttfb': statistics.median(r['ttfb'] for r in records),
+            'yield': sum(r['vacancies'] for r in ok) / messages if messages else 0.0,
+            'new': sum(r['new'] for r in records) / len(records),
+            'duplicates': sum(r['duplicates'] for r in records) / len(records),
+        })
+    return rows
+
+
+def format_aggregate(rows: list, runs: int, top: int) -> str:
+    header = f"    {'channel':<29} {'runs':>4} {'errors':>6} {'time ms':>8} {'ttfb ms':>8} {'yield':>6} {'new/run':>7} {'dup/run':>7}"
+
+    def table(items):
+        return [f"    @{r['channel']:<28.28} {r['runs']:>4} {r['errors']:>6} {r['time'] * 1000:>8.0f} "
+                f"{r['ttfb'] * 1000:>8.0f} {r['yield']:>6.0%} {r['new']:>7.1f} {r['duplicates']:>7.1f}" for r in items]
+
+    lines = [f"{len(rows)} channels over {runs} runs", "", "Slowest:", header]
+    lines += table(sorted(rows, key=lambda r: r['time'], reverse=True)[:top])
+    # Бесполезные: меньше всего новых вакансий на запуск, при равенстве — чаще ошибки и дольше
+    lines += ["", "Least useful:", header]
+    lines += table(sorted(rows, key=lambda r: (r['new'], -r['errors'], -r['time']))[:top])
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=PARSER_REPORT_FILE)
+    parser.add_argument('--runs', type=int, default=1, help='сколько последних запусков свести')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help='вывести отчёт последнего запуска как есть')
+    args = parser.parse_args()
+
+    runs = load_runs(args.file)
+    if not runs:
+        print(f"No parser runs in {args.file}", file=sys.stderr)
+        return
+    if args.json:
+        print(json.dumps(runs[-1], ensure_ascii=False, indent=2))
+    elif args.runs <= 1:
+        print(format_run(runs[-1], args.top))
+    else:
+        print(format_aggregate(aggregate(runs[-args.runs:]), min(args.runs, len(runs)), args.top))
+
+
+if __name__ == '__main__':
+    main()
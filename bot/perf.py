@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import tracemalloc
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Цикл событий замеряется раз в LOOP_LAG_INTERVAL секунд; в /perf — последняя задержка и максимум за окно
+LOOP_LAG_INTERVAL = 0.5
+LOOP_LAG_WINDOW = 120  # замеров (минута)
+# Кадров стека в трассировке выделений (/perf tracemalloc on): 1 — дешевле всего, достаточно строки
+TRACEMALLOC_FRAMES = 1
+TOP_ALLOCATIONS = 5
+
+STARTED_AT = time.time()
+
+
+class LoopLag:
+    """Насколько позже заказанного просыпается sleep: всё, что блокирует цикл (синхронный SQLite,
+    разбор JSON, CPU в обработчике), сразу видно здесь — задерживаются все апдейты процесса."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, window: int = LOOP_LAG_WINDOW):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+
+    @property
+    def last(self) -> float:
+        return self.samples[-1] if self.samples else 0.0
+
+    @property
+    def max(self) -> float:
+        return max(self.samples, default=0.0)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+            metrics.event_loop_lag.set(self.max)
+
+
+def rss_bytes():
+    """Текущий RSS процесса (Linux, /proc), иначе пиковый из getrusage; None — неизвестно."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux — килобайты, macOS — байты
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def set_tracing(enabled: bool):
+    """Трассировка выделений замедляет аллокации и ест память — включается админом на время."""
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def top_allocations(limit: int = TOP_ALLOCATIONS):
+    """[(файл:строка, байт, блоков)] крупнейших живых выделений с момента включения; None — трассировка выключена."""
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+    top = []
+    for stat in snapshot.statistics('lineno')[:limit]:
+        frame = stat.traceback[0]
+        top.append((f"{os.path.basename(frame.filename)}:{frame.lineno}", stat.size, stat.count))
+    return top
+
+
+def human_bytes(size) -> str:
+    if size is None:
+        return '?'
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def hit_rate(hits: int, misses: int) -> str:
+    total = hits + misses
+    return f"{hits / total:.0%}" if total else '—'
+
+
+def cache_lines() -> list:
+    """Кэши из метрик cache_* (перед вызовом обновить их collect_metrics): записей и доля попаданий."""
+    names = {labels[0] for labels in metrics.cache_hits.values}
+    names |= {labels[0] for labels in metrics.cache_misses.values}
+    names |= {labels[0] for labels in metrics.cache_entries.values}
+    lines = []
+    for name in sorted(names):
+        hits, misses = metrics.cache_hits.get(name), metrics.cache_misses.get(name)
+        entries = metrics.cache_entries.values.get((name,))
+        lines.append(f"  {name}: {'—' if entries is None else entries} записей, "
+                     f"попаданий {hit_rate(hits, misses)} ({hits}/{hits + misses})")
+    return lines
+
+
+def upstream_lines() -> list:
+    """p50/p95 запросов к внешним сервисам с запуска (верхние границы корзин гистограммы)."""
+    lines = []
+    for labels, (_, _, count) in sorted(metrics.upstream_latency.values.items()):
+        p50 = metrics.upstream_latency.quantile(0.5, *labels)
+        p95 = metrics.upstream_latency.quantile(0.95, *labels)
+        errors = metrics.upstream_errors.get(*labels)
+        lines.append(f"  {labels[0]}: p50 ≤{_seconds(p50)}, p95 ≤{_seconds(p95)}, {count} запросов, {errors} ошибок")
+    return lines
+
+
+def _seconds(value) -> str:
+    if value == float('inf'):
+        return f"∞ (>{metrics.LATENCY_BUCKETS[-1]}s)"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:g}s"
+
+
+def format_parser_run(run) -> str:
+    if not run:
+        return 'нет данных'
+    started = run.get('started_at', '?')
+    totals = run.get('totals') or {}
+    return (f"{started}, {run.get('duration', 0):.1f}s, каналов {len(run.get('channels') or [])}, "
+            f"новых {run.get('new', 0)}, ошибок {totals.get('errors', 0)}")
+
+
+def uptime() -> str:
+    seconds = int(time.time() - STARTED_AT)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    return f"{days}d {hours}h {seconds // 60}m" if days else f"{hours}h {seconds // 60}m"
+
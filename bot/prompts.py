@@ -0,0 +1,292 @@
+import re
+import hashlib
+from html import unescape
+from collections import OrderedDict
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Версии шаблонов промптов: при изменении текста промпта увеличить, чтобы не отдавать старые ответы из кэша
+PROMPT_VERSIONS = {'cover': 2, 'adapt': 2}
+
+# Бюджеты входных токенов на вакансию и резюме для каждого типа промпта
+TOKEN_BUDGETS = {
+    'cover': {'vacancy': 600, 'resume': 800},
+    'adapt': {'vacancy': 600, 'resume': 1100},
+}
+DIGEST_CACHE_SIZE = 2000
+
+_encoding = None
+
+VACANCY_SECTION_WEIGHTS = [
+    (('требован', 'ожидаем', 'нам важно', 'requirements', 'qualifications', 'you have', 'что нужно'), 3.0),
+    (('обязанност', 'задачи', 'чем предстоит', 'что делать', 'responsibilities', 'you will'), 2.5),
+    (('плюсом', 'преимуществ', 'nice to have', 'bonus', 'желательно'), 1.5),
+    (('условия', 'предлагаем', 'мы даём', 'мы даем', 'offer', 'benefits'), 0.7),
+    (('о компании', 'о нас', 'about us', 'кто мы'), 0.4),
+]
+RESUME_SECTION_WEIGHTS = [
+    (('опыт', 'experience', 'места работы', 'work history'), 3.0),
+    (('навык', 'skills', 'компетенц', 'технологи', 'стек'), 2.5),
+    (('о себе', 'about', 'summary', 'цель', 'profile'), 2.0),
+    (('достижени', 'проект', 'projects', 'achievements'), 2.0),
+    (('образован', 'education', 'курсы', 'сертификат', 'courses'), 1.0),
+    (('языки', 'languages', 'хобби', 'интересы', 'hobbies'), 0.5),
+]
+
+_TAG_BREAK = re.compile(r'<\s*(?:br|/p|/li|/h\d|/div|/ul|/ol)\s*/?>', re.IGNORECASE)
+_TAG_ITEM = re.compile(r'<\s*li[^>]*>', re.IGNORECASE)
+_TAG = re.compile(r'<[^>]+>')
+_WORD = re.compile(r'[a-zа-яё0-9+#]{3,}', re.IGNORECASE)
+_SENTENCE_END = re.compile(r'(?<=[.!?;])\s+|\n')
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов: точно через tiktoken, если установлен, иначе оценка по символам."""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text))
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    # Кириллица у gpt-4o-mini выходит примерно в 2.5 символа на токен, латиница — в 4
+    return int(non_ascii / 2.5 + (len(text) - non_ascii) / 4) + 1
+
+
+def clean_html(html: str) -> str:
+    """Убирает HTML, сохраняя переносы строк между абзацами и пунктами списков."""
+    text = _TAG_ITEM.sub('\n• ', html)
+    text = _TAG_BREAK.sub('\n', text)
+    text = unescape(_TAG.sub(' ', text))
+    lines = (' '.join(line.split()) for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def _is_heading(line: str, weights) -> bool:
+    if len(line) >= 60:
+        return False
+    if line.endswith(':') or (line.isupper() and len(line) > 3):
+        return True
+    # «Опыт работы», «Навыки» и т.п. без двоеточия — типично для резюме из PDF
+    line_lower = line.lower()
+    return len(line) < 35 and not line.endswith('.') and any(
+        line_lower.startswith(kw) for keywords, _ in weights for kw in keywords
+    )
+
+
+def _split_sections(text: str, weights) -> list:
+    """Делит текст на секции [заголовок, [строки]] по коротким строкам-заголовкам."""
+    sections = [['', []]]
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        if _is_heading(line, weights):
+            sections.append([line, []])
+        else:
+            sections[-1][1].append(line)
+    return [section for section in sections if section[0] or section[1]]
+
+
+def _section_weight(heading: str, weights) -> float:
+    heading_lower = heading.lower()
+    for keywords, weight in weights:
+        if any(kw in heading_lower for kw in keywords):
+            return weight
+    return 1.0
+
+
+def _terms(text: str) -> set:
+    return set(word.lower() for word in _WORD.findall(text))
+
+
+def _build_digest(text: str, weights) -> list:
+    digest = []
+    for position, (heading, lines) in enumerate(_split_sections(text, weights)):
+        body = '\n'.join(lines)
+        full = f"{heading}\n{body}" if heading and body else heading or body
+        digest.append({
+            'position': position,
+            'text': full,
+            'tokens': count_tokens(full),
+            'weight': _section_weight(heading, weights),
+            'terms': _terms(full),
+        })
+    return digest
+
+
+class _LRU(OrderedDict):
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        if key in self:
+            self.hits += 1
+            self.move_to_end(key)
+            return self[key]
+        self.misses += 1
+        value = build()
+        self[key] = value
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+        return value
+
+
+_vacancy_digests = _LRU(DIGEST_CACHE_SIZE)
+_resume_digests = _LRU(DIGEST_CACHE_SIZE)
+
+
+def vacancy_text(vacancy: dict) -> str:
+    """Очищенное описание вакансии (hh — из HTML, Telegram — полный текст поста)."""
+    return clean_html(vacancy.get('description') or vacancy.get('full_text') or '')
+
+
+def vacancy_digest(vacancy: dict) -> list:
+    # Хэш исходного текста, а не длина: правка вакансии (в том числе поста без description) — новый ключ
+    raw = vacancy.get('description') or vacancy.get('full_text') or ''
+    text_hash = hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+    key = f"{vacancy.get('source', 'hh')}:{vacancy.get('id', '')}:{text_hash}"
+    return _vacancy_digests.get_or_build(key, lambda: _build_digest(vacancy_text(vacancy), VACANCY_SECTION_WEIGHTS))
+
+
+def resume_digest(resume: str) -> list:
+    key = hashlib.sha256(resume.encode('utf-8')).hexdigest()
+    return _resume_digests.get_or_build(key, lambda: _build_digest(resume, RESUME_SECTION_WEIGHTS))
+
+
+def dump_digests() -> dict:
+    """Содержимое кэшей дайджестов для снимка при остановке (см. snapshot.py)."""
+    return {
+        'weights': (VACANCY_SECTION_WEIGHTS, RESUME_SECTION_WEIGHTS),
+        'vacancy': list(_vacancy_digests.items()),
+        'resume': list(_resume_digests.items()),
+    }
+
+
+def load_digests(data: dict) -> int:
+    """Прогревает кэши из снимка; снимок со старыми весами секций не используется."""
+    if not data or data.get('weights') != (VACANCY_SECTION_WEIGHTS, RESUME_SECTION_WEIGHTS):
+        return 0
+    for cache, items in ((_vacancy_digests, data['vacancy']), (_resume_digests, data['resume'])):
+        for key, digest in items[-cache.maxsize:]:
+            cache[key] = digest
+    return len(_vacancy_digests) + len(_resume_digests)
+
+
+def _truncate_to_budget(text: str, budget: int) -> str:
+    """Обрезает текст по границам предложений так, чтобы уложиться в бюджет."""
+    result = []
+    used = 0
+    for sentence in _SENTENCE_END.split(text):
+        tokens = count_tokens(sentence)
+        if used + tokens > budget:
+            break
+        result.append(sentence)
+        used += tokens
+    if not result:
+        # Одно длинное «предложение» без знаков препинания — режем пропорционально
+        return text[:int(len(text) * budget / max(count_tokens(text), 1))]
+    return ' '.join(result)
+
+
+def fill_budget(digest: list, budget: int, context_terms: set) -> str:
+    """Набирает самые релевантные секции до бюджета и выводит их в исходном порядке."""
+    def score(section):
+        overlap = len(section['terms'] & context_terms) / (len(section['terms']) or 1)
+        return section['weight'] * (1 + 2 * overlap)
+
+    chosen = {}
+    remaining = budget
+    oversized = []
+    # Сначала целиком всё, что помещается, затем остаток бюджета делим на обрезки крупных секций
+    for section in sorted(digest, key=score, reverse=True):
+        if section['tokens'] <= remaining:
+            chosen[section['position']] = section['text']
+            remaining -= section['tokens']
+        else:
+            oversized.append(section)
+    for section in oversized:
+        if remaining <= 20:
+            break
+        partial = _truncate_to_budget(section['text'], remaining)
+        if partial:
+            chosen[section['position']] = partial
+            remaining -= count_tokens(partial)
+    return '\n'.join(chosen[position] for position in sorted(chosen))
+
+
+COVER_TEMPLATE = """Напиши сопроводительное письмо на русском языке. Пиши простым человеческим языком, как будто пишет живой человек, а не робот.
+
+ВАКАНСИЯ:
+Название: {name}
+Компания: {company}
+Описание: {description}
+
+РЕЗЮМЕ КАНДИДАТА:
+{resume}
+
+ВАЖНЫЕ ПРАВИЛА СТИЛЯ:
+1. НЕ ПИШИ "С большим интересом узнал" или "С удовольствием откликаюсь" — это шаблоны
+2. Начни просто: "Увидел вашу вакансию, откликнулась потому что..." или "Заинтересовала позиция, так как..."
+3. НЕ ПИШИ про "уникальную технологию", "выдающиеся результаты", "динамичный контекст" — это пафос
+4. Мотивация должна быть честной и win-win: "У меня есть опыт X, хочу его применять и развиваться. Вижу, что вам нужен Y — могу быть полезен"
+5. Без заискивания и лести компании
+6. Коротко про релевантный опыт (1-2 конкретных примера)
+7. Длина: 120-180 слов максимум
+8. Тон: уверенный, но не высокомерный. Деловой, но человечный.
+
+Напиши только текст письма, без заголовков и подписей."""
+
+ADAPT_TEMPLATE = """Ты редактор резюме. Дай КОНКРЕТНЫЕ правки для адаптации этого резюме под вакансию.
+
+ВАКАНСИЯ:
+{name} в {company}
+{description}
+
+РЕЗЮМЕ КАНДИДАТА:
+{resume}
+
+ВАЖНО: Не пиши общие советы! Давай ТОЧНЫЕ правки к КОНКРЕТНЫМ местам резюме.
+
+Формат ответа:
+
+📝 ПРАВКИ В РЕЗЮМЕ:
+
+1. В разделе "Опыт работы" → [название компании/должности из резюме]:
+   БЫЛО: "[точная цитата из резюме]"
+   СТАЛО: "[переписанная версия]"
+
+2. В разделе "Навыки":
+   ДОБАВИТЬ: [конкретный навык из требований вакансии]
+
+3. В разделе "О себе" / "Цель":
+   БЫЛО: "[цитата]"
+   СТАЛО: "[новая версия]"
+
+🎯 КЛЮЧЕВЫЕ СЛОВА ИЗ ВАКАНСИИ (добавь в резюме):
+- [слово 1] — вставить в [конкретный раздел]
+- [слово 2] — вставить в [конкретный раздел]
+
+Дай 3-5 конкретных правок. Цитируй реальные фразы из резюме пользователя."""
+
+TEMPLATES = {'cover': COVER_TEMPLATE, 'adapt': ADAPT_TEMPLATE}
+
+
+def build_prompt(prompt_type: str, resume: str, vacancy: dict) -> str:
+    """Собирает промпт: из вакансии и резюме берутся самые релевантные друг другу секции в пределах бюджета."""
+    budgets = TOKEN_BUDGETS[prompt_type]
+    vacancy_sections = vacancy_digest(vacancy)
+    resume_sections = resume_digest(resume)
+    vacancy_terms = set().union(*(s['terms'] for s in vacancy_sections)) | _terms(vacancy.get('name', ''))
+    resume_terms = set().union(*(s['terms'] for s in resume_sections))
+    return TEMPLATES[prompt_type].format(
+        name=vacancy.get('name', ''),
+        company=vacancy.get('employer', {}).get('name', ''),
+        description=fill_budget(vacancy_sections, budgets['vacancy'], resume_terms),
+        resume=fill_budget(resume_sections, budgets['resume'], vacancy_terms),
+    )
@@ -0,0 +1,41 @@
+import os
+import time
+import pickle
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Снимок прогретых структур (индекс вакансий, кэши дайджестов), пишется при остановке бота
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "bot/warm_snapshot.pickle")
+# Меняется при несовместимом изменении формата — старый снимок тогда просто не читается
+SNAPSHOT_VERSION = 1
+
+
+def save(parts: dict, path: str = SNAPSHOT_FILE) -> bool:
+    """Пишет снимок атомарно (через временный файл), чтобы упавшая запись не испортила старый."""
+    started = time.perf_counter()
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': SNAPSHOT_VERSION, 'parts': parts}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"Snapshot write error: {e}")
+        return False
+    logger.info(f"Snapshot saved to {path} in {time.perf_counter() - started:.2f}s")
+    return True
+
+
+def load(path: str = SNAPSHOT_FILE) -> dict:
+    """Части снимка; пустой словарь, если снимка нет или он от другой версии."""
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Snapshot read error: {e}")
+        return {}
+    if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+        return {}
+    return data['parts']
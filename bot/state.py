@@ -0,0 +1,515 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+import contextlib
+import contextvars
+from collections.abc import MutableMapping
+
+from telegram import Update
+from telegram.ext import Application, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# memory — всё в памяти процесса (один воркер, тесты); sqlite — общий файл для нескольких процессов бота
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB = os.getenv("STATE_DB", "bot/state.db")
+SESSION_TTL = 30 * 24 * 60 * 60  # сессии и шаги диалога неактивных пользователей
+# Аренда чата на время апдейта: апдейт дольше этого считается зависшим, и чат достаётся другому процессу
+CHAT_LEASE_TTL = 60
+CHAT_LEASE_POLL = (0.01, 0.2)  # пауза между попытками взять занятый чат: от и до
+
+
+class MemoryBackend:
+    """Хранилище в памяти процесса; значения отдаются как есть, без копирования."""
+
+    shared_objects = True
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, namespace: str, key: str):
+        entry = self._data.get(namespace, {}).get(key)
+        return entry[0] if entry else None
+
+    def set(self, namespace: str, key: str, value):
+        self._data.setdefault(namespace, {})[key] = [value, time.time()]
+
+    def delete(self, namespace: str, key: str):
+        self._data.get(namespace, {}).pop(key, None)
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        value = (self.get(namespace, key) or 0) + amount
+        self.set(namespace, key, value)
+        return value
+
+    def count(self, namespace: str) -> int:
+        return len(self._data.get(namespace, {}))
+
+    def footprint(self, namespace: str) -> tuple:
+        entries = self._data.get(namespace, {})
+        size = sum(len(json.dumps(value, ensure_ascii=False).encode()) for value, _ in entries.values())
+        return len(entries), size
+
+    def keys(self, namespace: str) -> list:
+        return list(self._data.get(namespace, {}))
+
+    def top(self, namespace: str, limit: int) -> list:
+        entries = self._data.get(namespace, {})
+        return sorted(((key, value) for key, (value, _) in entries.items()), key=lambda kv: -kv[1])[:limit]
+
+    def try_lease(self, key: str, owner: str, ttl: float) -> bool:
+        leases = self._data.setdefault('lease', {})
+        entry = leases.get(key)
+        now = time.time()
+        if entry and entry[0] != owner and entry[1] > now:
+            return False
+        leases[key] = [owner, now + ttl]
+        return True
+
+    def release_lease(self, key: str, owner: str):
+        leases = self._data.get('lease', {})
+        if leases.get(key, [None])[0] == owner:
+            del leases[key]
+
+    def purge(self, namespace: str, older_than: float) -> int:
+        cutoff = time.time() - older_than
+        entries = self._data.get(namespace, {})
+        stale = [key for key, (_, updated_at) in entries.items() if updated_at < cutoff]
+        for key in stale:
+            del entries[key]
+        return len(stale)
+
+
+class SQLiteBackend:
+    """Общее хранилище для нескольких процессов: одна таблица (namespace, key) -> JSON, WAL."""
+
+    shared_objects = False
+
+    def __init__(self, path: str = STATE_DB):
+        self.path = path
+        self._conn = None
+        # Аренды чатов берутся из потоков (chat_lease) — своё соединение, по одному потоку за раз
+        self._lease_conn = None
+        self._lease_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_state_updated ON state (namespace, updated_at)")
+        return conn
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    def get_raw(self, namespace: str, key: str):
+        row = self._db().execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_raw(self, namespace: str, key: str, raw: str):
+        self._db().execute(
+            "INSERT INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+            (namespace, key, raw, time.time())
+        )
+
+    def get(self, namespace: str, key: str):
+        raw = self.get_raw(namespace, key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace: str, key: str, value):
+        self.set_raw(namespace, key, json.dumps(value, ensure_ascii=False))
+
+    def delete(self, namespace: str, key: str):
+        self._db().execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        """Атомарно даже между процессами — одним UPSERT."""
+        row = self._db().execute(
+            "INSERT INTO state (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(namespace, key) DO UPDATE SET"
+            " value = CAST(value AS INTEGER) + excluded.value, updated_at = excluded.updated_at"
+            " RETURNING value",
+            (namespace, key, amount, time.time())
+        ).fetchone()
+        return int(row[0])
+
+    def count(self, namespace: str) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM state WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+    def footprint(self, namespace: str) -> tuple:
+        count, size = self._db().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM state WHERE namespace = ?",
+            (namespace,)
+        ).fetchone()
+        return count, size
+
+    def keys(self, namespace: str) -> list:
+        return [row[0] for row in self._db().execute("SELECT key FROM state WHERE namespace = ?", (namespace,))]
+
+    def top(self, namespace: str, limit: int) -> list:
+        """Ключи с наибольшими числовыми значениями (счётчики incr)."""
+        return [(key, int(value)) for key, value in self._db().execute(
+            "SELECT key, value FROM state WHERE namespace = ? ORDER BY CAST(value AS INTEGER) DESC LIMIT ?",
+            (namespace, limit)
+        )]
+
+    def try_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """Аренда ключа (чата) для owner: строка ('lease', key) с владельцем и сроком в updated_at.
+
+        Одним UPSERT, поэтому атомарно между процессами: запись меняется, только если ключ свободен,
+        аренда истекла или уже принадлежит owner; иначе RETURNING ничего не возвращает.
+        """
+        now = time.time()
+        with self._lease_lock:
+            if self._lease_conn is None:
+                self._lease_conn = self._connect()
+            row = self._lease_conn.execute(
+                "INSERT INTO state (namespace, key, value, updated_at) VALUES ('lease', ?, ?, ?)"
+                " ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at"
+                " WHERE state.value = excluded.value OR state.updated_at < ?"
+                " RETURNING value",
+                (key, owner, now + ttl, now)
+            ).fetchone()
+        return row is not None
+
+    def release_lease(self, key: str, owner: str):
+        with self._lease_lock:
+            self._lease_conn.execute(
+                "DELETE FROM state WHERE namespace = 'lease' AND key = ? AND value = ?", (key, owner)
+            )
+
+    def purge(self, namespace: str, older_than: float) -> int:
+        return self._db().execute(
+            "DELETE FROM state WHERE namespace = ? AND updated_at < ?", (namespace, time.time() - older_than)
+        ).rowcount
+
+
+def make_backend(kind: str = STATE_BACKEND, path: str = STATE_DB):
+    if kind == 'memory':
+        return MemoryBackend()
+    if kind == 'sqlite':
+        return SQLiteBackend(path)
+    raise ValueError(f"Unknown STATE_BACKEND {kind!r}, expected memory or sqlite")
+
+
+# --- Загрузка на время апдейта ---
+#
+# Сессия и шаг диалога читаются из хранилища при первом обращении в апдейте и записываются
+# обратно (только если изменились) после его обработки. Между апдейтами процесс ничего не
+# кэширует, поэтому следующий апдейт пользователя может обработать любой процесс.
+
+_scope = contextvars.ContextVar('state_scope', default=None)
+
+
+class update_scope:
+    """with update_scope(): ... — всё загруженное из SessionStore / ConversationStore сохраняется на выходе."""
+
+    def __enter__(self):
+        self.loaded = {}
+        self._token = _scope.set(self.loaded)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _scope.reset(self._token)
+        for (namespace, key), (value, snapshot, store) in self.loaded.items():
+            try:
+                store.save(key, value, snapshot)
+            except Exception as e:
+                logger.error(f"State save error ({namespace}/{key}): {e}")
+        return False
+
+
+def chat_key(update):
+    """Ключ, по которому упорядочиваются апдейты: чат, а без чата — пользователь; None — не упорядочивать."""
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        # pre_checkout_query, inline-запросы — без чата, упорядочиваем по пользователю
+        if update.effective_user:
+            return update.effective_user.id
+    return None
+
+
+async def _call(backend, method, *args):
+    # SQLite может ждать блокировку записи другого процесса — не в цикле событий
+    if backend.shared_objects:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+
+@contextlib.asynccontextmanager
+async def chat_lease(backend, key, owner: str, ttl: float = CHAT_LEASE_TTL):
+    """async with chat_lease(...): — апдейты одного чата обрабатываются по одному во всех процессах.
+
+    Внутри процесса порядок держит ChatOrderedUpdateProcessor; аренда в хранилище не даёт двум
+    процессам за одним вебхуком одновременно прочитать одну сессию и затереть запись друг друга.
+    """
+    key = str(key)
+    delay = CHAT_LEASE_POLL[0]
+    while not await _call(backend, backend.try_lease, key, owner, ttl):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, CHAT_LEASE_POLL[1])
+    try:
+        yield
+    finally:
+        try:
+            await _call(backend, backend.release_lease, key, owner)
+        except Exception as e:
+            logger.error(f"Chat lease release error ({key}): {e}")
+
+
+_MISSING = object()
+
+
+class _ScopedStore(MutableMapping):
+    def __init__(self, backend, namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+
+    def _key(self, key) -> str:
+        return str(key)
+
+    def _load(self, key):
+        scope = _scope.get()
+        if scope is not None and (self.namespace, key) in scope:
+            return scope[(self.namespace, key)][0]
+        if self.backend.shared_objects:
+            value, snapshot = self.backend.get(self.namespace, self._key(key)), None
+        else:
+            snapshot = self.backend.get_raw(self.namespace, self._key(key))
+            value = json.loads(snapshot) if snapshot is not None else None
+        if value is None:
+            return _MISSING
+        if scope is not None:
+            scope[(self.namespace, key)] = [value, snapshot, self]
+        return value
+
+    def save(self, key, value, snapshot=None):
+        if value is _MISSING:
+            self.backend.delete(self.namespace, self._key(key))
+        elif self.backend.shared_objects:
+            self.backend.set(self.namespace, self._key(key), value)
+        else:
+            raw = json.dumps(value, ensure_ascii=False)
+            if raw != snapshot:
+                self.backend.set_raw(self.namespace, self._key(key), raw)
+
+    def __getitem__(self, key):
+        value = self._load(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        scope = _scope.get()
+        if scope is None:
+            self.save(key, value)
+            return
+        entry = scope.get((self.namespace, key))
+        if entry is None:
+            # Снимок нужен, чтобы на выходе не перезаписывать неизменённое
+            self._load(key)
+            entry = scope.setdefault((self.namespace, key), [None, None, self])
+        entry[0] = value
+
+    def __delitem__(self, key):
+        if self._load(key) is _MISSING:
+            raise KeyError(key)
+        scope = _scope.get()
+        if scope is None:
+            self.save(key, _MISSING)
+        else:
+            scope[(self.namespace, key)][0] = _MISSING
+
+    def __contains__(self, key):
+        return self._load(key) is not _MISSING
+
+    def __iter__(self):
+        return iter(self.backend.keys(self.namespace))
+
+    def __len__(self):
+        return self.backend.count(self.namespace)
+
+    def footprint(self) -> tuple:
+        """(записей, байт в JSON) — для /perf; в памяти процесса объекты занимают в несколько раз больше."""
+        return self.backend.footprint(self.namespace)
+
+    def purge(self, older_than: float = SESSION_TTL) -> int:
+        return self.backend.purge(self.namespace, older_than)
+
+
+class SessionStore(_ScopedStore):
+    """user_data_store: user_id -> dict сессии (резюме, фильтры, найденные вакансии)."""
+
+    def __init__(self, backend):
+        super().__init__(backend, 'session')
+
+    def _key(self, key) -> str:
+        return str(int(key))
+
+
+class ConversationStore(_ScopedStore):
+    """Шаги ConversationHandler: (chat_id, user_id) -> состояние."""
+
+    def __init__(self, backend, name: str):
+        super().__init__(backend, f"conversation:{name}")
+
+    def _key(self, key) -> str:
+        return ':'.join(str(part) for part in key)
+
+    def __iter__(self):
+        return (tuple(int(part) for part in key.split(':')) for key in self.backend.keys(self.namespace))
+
+
+class SharedConversationHandler(ConversationHandler):
+    """ConversationHandler, который хранит шаги диалога в общем хранилище, а не в словаре процесса.
+
+    BasePersistence из python-telegram-bot читает состояния один раз при старте и сбрасывает их
+    периодически — этого хватает для перезапуска, но не для нескольких процессов за одним вебхуком.
+    Поэтому подменяем сам словарь состояний; шаги хранятся как обычные значения (block=False,
+    при котором в словарь попадает PendingState, здесь не поддерживается).
+    """
+
+    def __init__(self, *args, store: ConversationStore, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._conversations = store
+
+
+class SharedStateApplication(Application):
+    """Application, который обрабатывает каждый апдейт под арендой его чата и внутри update_scope.
+
+    Не зависит от update processor: сессии и шаги диалога сохраняются и с SimpleUpdateProcessor,
+    а аренда чата в общем хранилище упорядочивает апдейты одного чата между процессами.
+    """
+
+    __slots__ = ('state_backend',)
+
+    def __init__(self, *, state_backend, **kwargs):
+        super().__init__(**kwargs)
+        self.state_backend = state_backend
+
+    async def process_update(self, update):
+        key = chat_key(update)
+        if key is None:
+            with update_scope():
+                await super().process_update(update)
+            return
+        owner = f"{os.getpid()}:{update.update_id}"
+        async with chat_lease(self.state_backend, key, owner):
+            with update_scope():
+                await super().process_update(update)
+
+
+class Entitlements:
+    """Оплаченный доступ: переживает перезапуск и виден всем процессам."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def grant(self, user_id: int, name: str):
+        self.backend.set('entitlement', f"{user_id}:{name}", time.time())
+
+    def has(self, user_id: int, name: str) -> bool:
+        return self.backend.get('entitlement', f"{user_id}:{name}") is not None
+
+
+class Quotas:
+    """Счётчики использованных бесплатных действий."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def used(self, user_id: int, action: str) -> int:
+        return self.backend.get('quota', f"{user_id}:{action}") or 0
+
+    def use(self, user_id: int, action: str) -> int:
+        return self.backend.incr('quota', f"{user_id}:{action}")
+
+    def credit(self, user_id: int, action: str, amount: int = 1) -> int:
+        """Возвращает оплаченные, но не выполненные действия: столько следующих будут бесплатными."""
+        return self.backend.incr('quota', f"{user_id}:{action}", -amount)
+
+
+class Stats:
+    """Статистика для /stats: уникальные пользователи и число поисков."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def track_user(self, user_id: int):
+        if self.backend.get('user', str(user_id)) is None:
+            self.backend.set('user', str(user_id), time.time())
+
+    def track_search(self):
+        self.backend.incr('counter', 'total_searches')
+
+    def total_users(self) -> int:
+        return self.backend.count('user')
+
+    def total_searches(self) -> int:
+        return self.backend.get('counter', 'total_searches') or 0
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class QueryLog:
+    """Сколько раз искали каждый запрос (без учёта фильтров) — для прогрева популярных."""
+
+    MAX_LENGTH = 100
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def record(self, query: str):
+        query = normalize_query(query)
+        if query and len(query) <= self.MAX_LENGTH:
+            self.backend.incr('query', query)
+
+    def top(self, limit: int) -> list:
+        """[(запрос, число поисков)] по убыванию."""
+        return self.backend.top('query', limit)
+
+    def purge(self, older_than: float = SESSION_TTL) -> int:
+        """Забывает запросы, которые не повторялись дольше older_than."""
+        return self.backend.purge('query', older_than)
+
+
+def import_stats_json(backend, path: str) -> bool:
+    """Однократный перенос stats.json (пользователи, поиски, бесплатные действия) в хранилище."""
+    if backend.count('user') or not os.path.exists(path):
+        return False
+    try:
+        with open(path, 'r') as f:
+            stats = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Can't import {path}: {e}")
+        return False
+    for user_id in stats.get('users', []):
+        backend.set('user', str(user_id), time.time())
+    if stats.get('total_searches'):
+        backend.set('counter', 'total_searches', stats['total_searches'])
+    for user_id, usage in stats.get('free_usage', {}).items():
+        for action, used in usage.items():
+            if used:
+                backend.set('quota', f"{user_id}:{action}", used)
+    logger.info(f"Imported {len(stats.get('users', []))} users from {path}")
+    return True
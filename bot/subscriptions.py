@@ -0,0 +1,124 @@
+import os
+import re
+import logging
+
+from state import normalize_query
+
+logger = logging.getLogger(__name__)
+
+MAX_PER_USER = int(os.getenv("SUBSCRIPTIONS_PER_USER", "5"))
+# Слово запроса короче не индексируется (предлоги, «и», «в»)
+MIN_TERM_LENGTH = 2
+
+_TOKEN = re.compile(r'[\w+#]+')
+
+
+def terms(text: str) -> set:
+    return {token for token in _TOKEN.findall(text.lower()) if len(token) >= MIN_TERM_LENGTH}
+
+
+class Subscriptions:
+    """Сохранённые поиски (запрос + фильтры) и сверка с ними новых вакансий.
+
+    Подписки пользователя лежат одним списком в общем хранилище (namespace 'subscription'),
+    поэтому их видят все процессы бота. Для сверки в памяти процесса держится обратный индекс
+    «слово -> запросы подписок»: новая вакансия проверяется только по запросам, слова которых
+    в ней встречаются, а не по всем. Слово запроса совпадает с началом слова вакансии
+    («разработчик» — «разработчика»), подписка срабатывает, когда совпали все её слова.
+    Одинаковые запросы разных пользователей сверяются один раз, фильтры — уже для каждого.
+    Индекс перестраивается, когда подписки изменились (счётчик версии в 'meta').
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._version = None
+        self._index = {}  # слово -> set(запрос)
+        self._queries = {}  # запрос -> (число слов, [(user_id, фильтры)])
+        self._count = 0
+        self._max_term = 0
+
+    def for_user(self, user_id: int) -> list:
+        """[{'query', 'prefs'}] в порядке добавления."""
+        return self.backend.get('subscription', str(user_id)) or []
+
+    def add(self, user_id: int, query: str, prefs: dict) -> bool:
+        """Сохраняет поиск (повтор того же запроса обновляет фильтры); False — превышен MAX_PER_USER."""
+        query = normalize_query(query)
+        subs = [sub for sub in self.for_user(user_id) if sub['query'] != query]
+        if len(subs) >= MAX_PER_USER or not terms(query):
+            return False
+        subs.append({'query': query, 'prefs': prefs or {}})
+        self.backend.set('subscription', str(user_id), subs)
+        self.backend.incr('meta', 'subscriptions_version')
+        return True
+
+    def remove(self, user_id: int, query: str = None) -> int:
+        """Удаляет подписку на query или все подписки пользователя; возвращает число удалённых."""
+        subs = self.for_user(user_id)
+        kept = [sub for sub in subs if query is not None and sub['query'] != normalize_query(query)]
+        if len(kept) == len(subs):
+            return 0
+        if kept:
+            self.backend.set('subscription', str(user_id), kept)
+        else:
+            self.backend.delete('subscription', str(user_id))
+        self.backend.incr('meta', 'subscriptions_version')
+        return len(subs) - len(kept)
+
+    def __len__(self):
+        self._sync()
+        return self._count
+
+    def queries(self, limit: int = None) -> list:
+        """Запросы подписок, самые популярные первыми — их выдачи hh.ru и Trudvsem опрашиваются при прогреве."""
+        self._sync()
+        ordered = sorted(self._queries, key=lambda query: -len(self._queries[query][1]))
+        return ordered[:limit] if limit is not None else ordered
+
+    def _sync(self):
+        version = self.backend.get('meta', 'subscriptions_version') or 0
+        if version == self._version:
+            return
+        index, queries, count = {}, {}, 0
+        for user_key in self.backend.keys('subscription'):
+            for sub in self.backend.get('subscription', user_key) or []:
+                query = sub['query']
+                if query not in queries:
+                    words = terms(query)
+                    queries[query] = (len(words), [])
+                    for word in words:
+                        index.setdefault(word, set()).add(query)
+                queries[query][1].append((int(user_key), sub.get('prefs') or {}))
+                count += 1
+        self._index, self._queries, self._count, self._version = index, queries, count, version
+        self._max_term = max(map(len, index), default=0)
+
+    def match(self, vacancies: list, text, matches) -> dict:
+        """{user_id: [(запрос, вакансия)]} — каждая вакансия не больше одного раза на пользователя.
+
+        text(vac) — текст, по которому сверяются слова; matches(vac, prefs) — фильтры источника.
+        """
+        self._sync()
+        if not self._queries:
+            return {}
+        found = {}
+        for vac in vacancies:
+            matched_terms = set()
+            for token in terms(text(vac)):
+                for end in range(MIN_TERM_LENGTH, min(len(token), self._max_term) + 1):
+                    if token[:end] in self._index:
+                        matched_terms.add(token[:end])
+            hits = {}
+            for term in matched_terms:
+                for query in self._index[term]:
+                    hits[query] = hits.get(query, 0) + 1
+            notified = set()
+            for query, count in hits.items():
+                needed, subscribers = self._queries[query]
+                if count != needed:
+                    continue
+                for user_id, prefs in subscribers:
+                    if user_id not in notified and matches(vac, prefs):
+                        notified.add(user_id)
+                        found.setdefault(user_id, []).append((query, vac))
+        return found
@@ -2,11 +2,17 @@ import os
 import json
 import asyncio
 import logging
+import argparse
 import re
+import time
+import sqlite3
 import aiohttp
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from bs4 import BeautifulSoup
 
+from vacancy_store import VacancyStore
+import parser_report
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -67,6 +73,16 @@ CHANNELS = [
 ]
 
 VACANCIES_FILE = 'bot/telegram_vacancies.json'
+TELEGRAM_WEB_URL = os.getenv('TELEGRAM_WEB_URL', 'https://t.me')
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+
+# Догрузка истории (--backfill): курсоры каналов, чтобы прерванный запуск продолжился с того же места
+BACKFILL_STATE_FILE = os.getenv('BACKFILL_STATE_FILE', 'bot/backfill_state.json')
+BACKFILL_CONCURRENCY = 4  # каналов одновременно
+BACKFILL_MAX_MESSAGES = 1000  # на канал, если не задана дата
+BACKFILL_BATCH_SIZE = 200  # вакансий на одну транзакцию vacancy_store
+BACKFILL_PAGE_DELAY = float(os.getenv('BACKFILL_PAGE_DELAY', '1'))  # пауза между страницами одного канала
+BACKFILL_RETRIES = 3
 
 JOB_KEYWORDS = [
     'вакансия', 'ищем', 'hiring', 'требуется', 'нужен', 'открыта позиция',
@@ -91,8 +107,11 @@ def load_vacancies():
         return []
 
 def save_vacancies(vacancies):
-    with open(VACANCIES_FILE, 'w', encoding='utf-8') as f:
+    # Через временный файл: бот перечитывает файл на ходу и не должен увидеть его недописанным
+    tmp_path = f"{VACANCIES_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         json.dump(vacancies, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, VACANCIES_FILE)
 
 def extract_salary(text):
     match = SALARY_PATTERN.search(text)
@@ -152,73 +171,273 @@ def extract_company(text):
                 return company
     return 'Telegram'
 
-async def parse_channel_web(session, channel):
-    url = f"https://t.me/s/{channel}"
+def extract_vacancies(html, channel, url=None):
+    """Достаёт вакансии из HTML страницы t.me/s/{channel}."""
+    return extract_page(html, channel, url)[0]
+
+def extract_page(html, channel, url=None, timings=None):
+    """Вакансии страницы и курсор на более старые сообщения.
+
+    Возвращает (вакансии, before для следующей страницы или None, дата самого старого сообщения, число сообщений).
+    В timings (если передан) записывается время разбора HTML ('parse') и извлечения вакансий ('extract').
+    """
+    url = url or f"{TELEGRAM_WEB_URL}/s/{channel}"
+    started = time.perf_counter()
+    soup = BeautifulSoup(html, 'html.parser')
+    messages = soup.find_all('div', class_='tgme_widget_message_wrap')
+    parsed = time.perf_counter()
+    vacancies = []
+    oldest = None
+    for msg in messages:
+        time_tag = msg.find('time', datetime=True)
+        posted_at = time_tag['datetime'] if time_tag else None
+        if posted_at and (oldest is None or posted_at < oldest):
+            oldest = posted_at
+        text_div = msg.find('div', class_='tgme_widget_message_text')
+        if not text_div:
+            continue
+        text = text_div.get_text(separator='\n', strip=True)
+        if not is_job_posting(text):
+            continue
+        link_tag = msg.find('a', class_='tgme_widget_message_date')
+        msg_url = link_tag['href'] if link_tag else url
+        msg_id = msg_url.split('/')[-1] if msg_url else '0'
+        vacancy = {
+            'id': f"tg_{channel}_{msg_id}",
+            'name': extract_job_title(text),
+            'employer': {'name': extract_company(text)},
+            'salary': extract_salary(text),
+            'alternate_url': msg_url,
+            'area': {'name': 'Remote' if is_remote(text) else 'Россия'},
+            'source': 'telegram',
+            'channel': f"@{channel}",
+            'text_hash': text[:100],
+            'full_text': text[:1000],
+            'posted_at': posted_at,
+            'parsed_at': datetime.now().isoformat()
+        }
+        vacancies.append(vacancy)
+    # Ссылка «загрузить ещё» ведёт на ?before=<id самого старого сообщения>
+    more = soup.find('a', class_='tme_messages_more', attrs={'data-before': True})
+    before = int(more['data-before']) if more and more['data-before'].isdigit() else None
+    if timings is not None:
+        timings['parse'] = parsed - started
+        timings['extract'] = time.perf_counter() - parsed
+    return vacancies, before, oldest, len(messages)
+
+async def parse_channel_web(session, channel, record=None):
+    """Вакансии канала; record (parser_report.channel_record) заполняется замерами и итогами."""
+    url = f"{TELEGRAM_WEB_URL}/s/{channel}"
+    record = record if record is not None else parser_report.channel_record(channel)
+    marks = {}
     try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as response:
-            if response.status != 200:
-                logger.error(f"Failed to fetch {channel}: {response.status}")
-                return []
-            html = await response.text()
-        soup = BeautifulSoup(html, 'html.parser')
-        messages = soup.find_all('div', class_='tgme_widget_message_wrap')
-        vacancies = []
-        for msg in messages:
-            text_div = msg.find('div', class_='tgme_widget_message_text')
-            if not text_div:
-                continue
-            text = text_div.get_text(separator='\n', strip=True)
-            if not is_job_posting(text):
-                continue
-            link_tag = msg.find('a', class_='tgme_widget_message_date')
-            msg_url = link_tag['href'] if link_tag else url
-            msg_id = msg_url.split('/')[-1] if msg_url else '0'
-            vacancy = {
-                'id': f"tg_{channel}_{msg_id}",
-                'name': extract_job_title(text),
-                'employer': {'name': extract_company(text)},
-                'salary': extract_salary(text),
-                'alternate_url': msg_url,
-                'area': {'name': 'Remote' if is_remote(text) else 'Россия'},
-                'source': 'telegram',
-                'channel': f"@{channel}",
-                'text_hash': text[:100],
-                'full_text': text[:1000],
-                'parsed_at': datetime.now().isoformat()
-            }
-            vacancies.append(vacancy)
+        started = time.perf_counter()
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=15), trace_request_ctx=marks) as response:
+                record['status'] = response.status
+                if response.status != 200:
+                    record['fetch'] = time.perf_counter() - started
+                    parser_report.apply_marks(record, marks)
+                    record['error'] = f"HTTP {response.status}"
+                    logger.error(f"Failed to fetch {channel}: {response.status}")
+                    return []
+                body = await response.read()
+                parser_report.apply_marks(record, marks, time.perf_counter())
+                html = body.decode(response.get_encoding(), errors='replace')
+        except Exception:
+            record['fetch'] = time.perf_counter() - started
+            parser_report.apply_marks(record, marks)
+            raise
+        record['fetch'] = time.perf_counter() - started
+        record['bytes'] = len(body)
+        vacancies, _, _, record['messages'] = extract_page(html, channel, url, timings=record)
+        record['vacancies'] = len(vacancies)
         logger.info(f"Parsed {len(vacancies)} vacancies from @{channel}")
         return vacancies
     except Exception as e:
+        record['error'] = parser_report.error_class(e)
         logger.error(f"Error parsing {channel}: {e}")
         return []
 
 async def parse_all_channels():
     logger.info("Starting web parser...")
+    started = time.perf_counter()
+    started_at = datetime.now()
+    records = []
     existing = load_vacancies()
     existing_hashes = set(v.get('text_hash', '')[:100] for v in existing)
     all_new_vacancies = []
-    async with aiohttp.ClientSession(headers={
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    }) as session:
+    async with aiohttp.ClientSession(headers=HEADERS, trace_configs=[parser_report.trace_config()]) as session:
         for channel in CHANNELS:
+            record = parser_report.channel_record(channel)
+            records.append(record)
             try:
-                vacancies = await parse_channel_web(session, channel)
+                vacancies = await parse_channel_web(session, channel, record)
                 for vac in vacancies:
                     if vac['text_hash'] not in existing_hashes:
                         all_new_vacancies.append(vac)
                         existing_hashes.add(vac['text_hash'])
+                        record['new'] += 1
+                    else:
+                        record['duplicates'] += 1
                 await asyncio.sleep(1)
             except Exception as e:
+                record['error'] = record['error'] or parser_report.error_class(e)
                 logger.error(f"Error with {channel}: {e}")
     combined = all_new_vacancies + existing
     combined = combined[:500]
     save_vacancies(combined)
+    # В файле — только последние 500 для поиска бота, в vacancy_store — все (туда же пишет --backfill)
+    try:
+        VacancyStore().save_vacancies('telegram', all_new_vacancies)
+    except sqlite3.Error as e:
+        logger.error(f"Vacancy store write error: {e}")
+    duration = time.perf_counter() - started
+    run = parser_report.build_run(started_at, duration, records, [vac['id'] for vac in all_new_vacancies],
+                                  len(combined))
+    try:
+        parser_report.save_run(run)
+    except OSError as e:
+        logger.error(f"Failed to save parser report: {e}")
     logger.info(f"Total: {len(all_new_vacancies)} new, {len(combined)} stored")
+    logger.info(parser_report.format_run(run))
+
+def load_backfill_state():
+    try:
+        with open(BACKFILL_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_backfill_state(state):
+    tmp_path = f"{BACKFILL_STATE_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, BACKFILL_STATE_FILE)
+
+async def fetch_page(session, url):
+    """HTML страницы; при 429 и сетевых ошибках повторяет с нарастающей паузой, None — если так и не удалось."""
+    for attempt in range(BACKFILL_RETRIES + 1):
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as response:
+                if response.status == 200:
+                    return await response.text()
+                error = f"HTTP {response.status}"
+                if response.status != 429 and response.status < 500:
+                    logger.error(f"Failed to fetch {url}: {error}")
+                    return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = f"{type(e).__name__}: {e}"
+        if attempt < BACKFILL_RETRIES:
+            await asyncio.sleep(5 * 2 ** attempt)
+    logger.error(f"Failed to fetch {url}: {error}")
+    return None
+
+class Backfill:
+    """Догрузка старых сообщений каналов страницами t.me/s/{channel}?before=<id> до даты или числа сообщений.
+
+    Вакансии пишутся в vacancy_store пачками по BACKFILL_BATCH_SIZE; после каждой пачки сохраняются
+    курсоры каналов, поэтому прерванная догрузка продолжается с последней записанной страницы.
+    telegram_vacancies.json (последние 500 для поиска бота) не меняется, подписчики не уведомляются.
+    """
+
+    def __init__(self, channels, until=None, max_messages=None, concurrency=BACKFILL_CONCURRENCY, restart=False):
+        self.channels = channels
+        self.until = until
+        self.max_messages = max_messages if max_messages or until else BACKFILL_MAX_MESSAGES
+        self.concurrency = concurrency
+        self.store = VacancyStore()
+        self.state = {} if restart else load_backfill_state()
+        target = {'until': until.isoformat() if until else None, 'max_messages': self.max_messages}
+        if self.state.get('target') != target:
+            # Новая цель (например, глубже) — продолжаем с сохранённых курсоров, но каналы не считаем законченными
+            for progress in self.state.get('channels', {}).values():
+                progress['done'] = False
+        self.state['target'] = target
+        self.state.setdefault('channels', {})
+        self._batch = []
+        self.saved = 0
+
+    def _progress(self, channel):
+        return self.state['channels'].setdefault(channel, {'before': None, 'messages': 0, 'vacancies': 0, 'done': False})
+
+    def _flush(self):
+        """Записывает накопленные вакансии, затем курсоры — курсор не опережает записанные данные."""
+        if self._batch:
+            self.store.save_vacancies('telegram', self._batch)
+            self.saved += len(self._batch)
+            self._batch = []
+        save_backfill_state(self.state)
+
+    def _reached_target(self, progress, oldest):
+        if self.max_messages and progress['messages'] >= self.max_messages:
+            return True
+        return bool(self.until and oldest and datetime.fromisoformat(oldest) < self.until)
+
+    async def channel(self, session, channel):
+        progress = self._progress(channel)
+        while not progress['done']:
+            url = f"{TELEGRAM_WEB_URL}/s/{channel}"
+            if progress['before']:
+                url = f"{url}?before={progress['before']}"
+            html = await fetch_page(session, url)
+            if html is None:
+                # Не помечаем законченным — следующий запуск продолжит с этой страницы
+                return
+            vacancies, before, oldest, count = extract_page(html, channel, url)
+            progress['messages'] += count
+            progress['vacancies'] += len(vacancies)
+            self._batch.extend(vacancies)
+            if not count or before is None or (progress['before'] and before >= progress['before']):
+                progress['done'] = True  # дошли до начала канала
+            else:
+                progress['before'] = before
+                progress['done'] = self._reached_target(progress, oldest)
+            if len(self._batch) >= BACKFILL_BATCH_SIZE or progress['done']:
+                self._flush()
+            if not progress['done']:
+                await asyncio.sleep(BACKFILL_PAGE_DELAY)
+        logger.info(f"Backfilled @{channel}: {progress['messages']} messages, {progress['vacancies']} vacancies")
+
+    async def run(self):
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(channel):
+            async with semaphore:
+                try:
+                    await self.channel(session, channel)
+                except Exception as e:
+                    logger.error(f"Backfill error with {channel}: {e}")
+
+        async with aiohttp.ClientSession(headers=HEADERS) as session:
+            try:
+                await asyncio.gather(*(limited(channel) for channel in self.channels))
+            finally:
+                self._flush()
+        pending = [channel for channel in self.channels if not self._progress(channel)['done']]
+        logger.info(f"Backfill: {self.saved} vacancies saved in {time.perf_counter() - started:.0f}s, "
+                    f"{len(pending)} channels unfinished" + (" (run again to resume)" if pending else ""))
+        return self.saved
 
-async def main():
+async def main(args=None):
+    if args is not None and args.backfill:
+        until = datetime.strptime(args.until, '%Y-%m-%d').replace(tzinfo=timezone.utc) if args.until else None
+        channels = args.channels.split(',') if args.channels else CHANNELS
+        await Backfill(channels, until, args.max_messages, args.concurrency, args.restart).run()
+        return
     await parse_all_channels()
     logger.info("Parsing complete")
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description='Парсер вакансий из публичных Telegram-каналов')
+    parser.add_argument('--backfill', action='store_true',
+                        help='догрузить историю каналов в vacancy_store (продолжает прерванную догрузку); '
+                             'только хранилище и просмотр через API — в поиск бота (telegram_vacancies.json) '
+                             'и уведомления подписок старые посты не попадают')
+    parser.add_argument('--channels', help='каналы через запятую (по умолчанию все)')
+    parser.add_argument('--until', help='догружать до даты YYYY-MM-DD')
+    parser.add_argument('--max-messages', type=int, help=f'сообщений на канал (по умолчанию {BACKFILL_MAX_MESSAGES}, если нет --until)')
+    parser.add_argument('--concurrency', type=int, default=BACKFILL_CONCURRENCY, help='каналов одновременно')
+    parser.add_argument('--restart', action='store_true', help='начать догрузку заново, забыв курсоры')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,290 @@
+"""Трассировка апдейтов: дерево замеров (span) для каждого шага обработки, запись в ротируемый JSONL.
+
+    python bot/tracing.py --top 10                  # самые медленные трассы
+    python bot/tracing.py --name search_vacancies   # только по одному обработчику
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import itertools
+import contextvars
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv("TRACE_FILE", "bot/traces.jsonl")
+# Доля апдейтов, которые пишутся целиком (0 — только медленные)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# Апдейты медленнее порога пишутся всегда, независимо от сэмплирования (0 — выключено)
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUPS = 3
+ENABLED = TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_MS > 0
+
+# Имя трассы апдейта, пока его не сработал ни один обработчик
+UPDATE_TRACE = 'update'
+
+_current = contextvars.ContextVar('trace_span', default=None)
+_trace_ids = itertools.count(1)
+_writer = None
+
+
+class _RotatingWriter:
+    """Дописывает строки в файл; при превышении размера сдвигает file → file.1 → … → file.N."""
+
+    def __init__(self, path, max_bytes, backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+
+    def write(self, line):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(line + '\n')
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        _writer = _RotatingWriter(TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUPS)
+    return _writer
+
+
+class Span:
+    __slots__ = ('trace', 'id', 'parent', 'name', 'attrs', 'started', 'duration', 'error', '_token')
+
+    def __init__(self, trace, name, parent, attrs):
+        self.trace = trace
+        self.id = len(trace.spans)
+        self.parent = parent
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        trace.spans.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        if exc is not None:
+            self.error = repr(exc)
+        _current.reset(self._token)
+        if self.parent is None:
+            self.trace.finish(self)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def to_dict(self, origin):
+        return {
+            'id': self.id,
+            'parent': self.parent,
+            'name': self.name,
+            'start_ms': round((self.started - origin) * 1000, 2),
+            'duration_ms': round(self.duration * 1000, 2) if self.duration is not None else None,
+            'attrs': self.attrs,
+            'error': self.error,
+        }
+
+
+class Trace:
+    __slots__ = ('id', 'sampled', 'started_at', 'spans')
+
+    def __init__(self, sampled):
+        self.id = f"{os.getpid():x}-{next(_trace_ids):x}"
+        self.sampled = sampled
+        self.started_at = datetime.now().isoformat(timespec='milliseconds')
+        self.spans = []
+
+    def finish(self, root):
+        duration_ms = root.duration * 1000
+        if not self.sampled and not (TRACE_SLOW_MS and duration_ms >= TRACE_SLOW_MS):
+            return
+        record = {
+            'trace_id': self.id,
+            'name': root.name,
+            'started_at': self.started_at,
+            'duration_ms': round(duration_ms, 2),
+            'error': root.error,
+            'attrs': root.attrs,
+            'spans': [span.to_dict(root.started) for span in self.spans[1:]],
+        }
+        try:
+            _get_writer().write(json.dumps(record, ensure_ascii=False, default=str))
+        except Exception as e:
+            logger.error(f"Trace write error: {e}")
+
+
+class _NoopSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def trace(name: str, **attrs):
+    """Корневой span новой трассы (апдейт или задача очереди)."""
+    if not ENABLED:
+        return _NOOP
+    return Span(Trace(random.random() < TRACE_SAMPLE_RATE), name, None, attrs)
+
+
+def span(name: str, **attrs):
+    """Дочерний span текущей трассы; вне трассы — пустой контекст-менеджер."""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(parent.trace, name, parent.id, attrs)
+
+
+def update_attrs(update):
+    attrs = {'update_id': update.update_id}
+    if update.effective_user:
+        attrs['user_id'] = update.effective_user.id
+    if update.callback_query:
+        attrs['callback'] = update.callback_query.data
+    elif update.message and update.message.text and update.message.text.startswith('/'):
+        attrs['command'] = update.message.text.split()[0]
+    return attrs
+
+
+def _wrap_callback(name, callback):
+    async def traced(update, context):
+        parent = _current.get()
+        if parent is not None:
+            root = parent.trace.spans[0]
+            # Трасса апдейта называется по первому сработавшему обработчику (для --name)
+            if root.name == UPDATE_TRACE:
+                root.name = name
+        with span(name):
+            return await callback(update, context)
+    traced.__name__ = name
+    traced._traced = True
+    return traced
+
+
+def instrument_application(application):
+    """Добавляет span на каждый вызов обработчика в трассу апдейта.
+
+    Саму трассу открывает ChatOrderedUpdateProcessor: все обработчики одного апдейта (из разных групп)
+    и ожидание очереди чата попадают в одну запись.
+    """
+    if not ENABLED:
+        return
+    from metrics import iter_handlers
+    for group_handlers in application.handlers.values():
+        for handler in iter_handlers(group_handlers):
+            if not getattr(handler.callback, '_traced', False):
+                handler.callback = _wrap_callback(handler.callback.__name__, handler.callback)
+
+
+def make_request():
+    """HTTP-клиент Bot API, записывающий каждый вызов (sendMessage, editMessageText…) как span."""
+    from telegram.request import HTTPXRequest
+
+    class TracingRequest(HTTPXRequest):
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            with span('telegram', method=url.rsplit('/', 1)[-1]) as sp:
+                code, payload = await super().do_request(url, method, request_data=request_data, **kwargs)
+                sp.set(status=code)
+                return code, payload
+
+    return TracingRequest()
+
+
+# --- CLI: сводка по самым медленным трассам ---
+
+def read_traces(path):
+    files = [f"{path}.{i}" for i in range(TRACE_BACKUPS, 0, -1)] + [path]
+    for name in files:
+        if not os.path.exists(name):
+            continue
+        with open(name, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def format_trace(record):
+    lines = [f"{record['duration_ms']:>9.1f} ms  {record['name']}  {record['started_at']}  "
+             f"{json.dumps(record.get('attrs') or {}, ensure_ascii=False)}"
+             + (f"  ERROR {record['error']}" if record.get('error') else '')]
+    children = {}
+    for sp in record['spans']:
+        children.setdefault(sp['parent'], []).append(sp)
+
+    def walk(parent, depth):
+        for sp in children.get(parent, []):
+            duration = f"{sp['duration_ms']:>9.1f}" if sp['duration_ms'] is not None else f"{'?':>9}"
+            attrs = ' '.join(f"{k}={v}" for k, v in (sp.get('attrs') or {}).items())
+            error = f"  ERROR {sp['error']}" if sp.get('error') else ''
+            lines.append(f"{duration} ms  {'  ' * depth}+{sp['start_ms']:.0f}ms {sp['name']} {attrs}{error}")
+            walk(sp['id'], depth + 1)
+    walk(0, 1)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=TRACE_FILE)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--name', help='только трассы этого обработчика')
+    args = parser.parse_args()
+
+    traces = [r for r in read_traces(args.file) if not args.name or r['name'] == args.name]
+    if not traces:
+        print(f"No traces in {args.file}", file=sys.stderr)
+        return
+    traces.sort(key=lambda r: r['duration_ms'], reverse=True)
+    durations = sorted(r['duration_ms'] for r in traces)
+    print(f"{len(traces)} traces, p50 {durations[len(durations) // 2]:.1f} ms, "
+          f"p95 {durations[min(len(durations) - 1, int(len(durations) * 0.95))]:.1f} ms\n")
+    for record in traces[:args.top]:
+        print(format_trace(record))
+        print()
+
+
+if __name__ == '__main__':
+    main()
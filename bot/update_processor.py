@@ -0,0 +1,79 @@
+import os
+import time
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import tracing
+from state import chat_key
+
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов обрабатывается одновременно (по всем чатам)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+# Сколько апдейтов может ждать своей очереди (в том числе за предыдущим апдейтом того же чата)
+MAX_PENDING_UPDATES = MAX_CONCURRENT_UPDATES * 16
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов разных чатов, строго по порядку — внутри одного чата.
+
+    Апдейты одного пользователя идут через общий asyncio.Lock (он FIFO), поэтому ConversationHandler
+    видит их в том же порядке, что и при последовательной обработке. Глобальный лимит берётся уже
+    после блокировки чата: апдейты, ждущие предыдущий апдейт своего чата, не занимают слоты
+    обработки и не тормозят остальных пользователей.
+    """
+
+    def __init__(self, max_running: int = MAX_CONCURRENT_UPDATES, max_pending: int = MAX_PENDING_UPDATES):
+        super().__init__(max_pending)
+        self.max_running = max_running
+        self._running = asyncio.Semaphore(max_running)
+        # chat_id -> [lock, число апдейтов этого чата в обработке или ожидании]
+        self._chats = {}
+        self.running = 0
+
+    chat_key = staticmethod(chat_key)
+
+    @property
+    def waiting(self) -> int:
+        return self.current_concurrent_updates - self.running
+
+    async def do_process_update(self, update, coroutine):
+        # Одна трасса на апдейт: обработчики добавляют в неё свои span (tracing.instrument_application)
+        attrs = tracing.update_attrs(update) if isinstance(update, Update) else {}
+        started = time.perf_counter()
+        with tracing.trace(tracing.UPDATE_TRACE, **attrs) as root:
+            key = self.chat_key(update)
+            if key is None:
+                await self._run(coroutine, root, started)
+                return
+            entry = self._chats.get(key)
+            if entry is None:
+                entry = self._chats[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    await self._run(coroutine, root, started)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._chats[key]
+
+    async def _run(self, coroutine, root, started):
+        async with self._running:
+            # Ожидание предыдущих апдейтов чата и свободного слота
+            root.set(queued_ms=round((time.perf_counter() - started) * 1000, 2))
+            self.running += 1
+            try:
+                # Сессии и аренду чата между процессами берёт state.SharedStateApplication.process_update
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
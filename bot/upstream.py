@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+import metrics
+from metrics import track_upstream
+
+logger = logging.getLogger(__name__)
+
+# Запросов в секунду и запас для всплесков на каждый источник
+HH_RATE_LIMIT = float(os.getenv("HH_RATE_LIMIT", "10"))
+TRUDVSEM_RATE_LIMIT = float(os.getenv("TRUDVSEM_RATE_LIMIT", "5"))
+# Повторы GET при сетевых ошибках и 5xx: пауза ~ RETRY_BASE_DELAY * 2^попытка со случайным разбросом
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.3
+# Retry-After длиннее этого не ждём — пользователь ждёт ответа, отдаём ошибку сразу
+MAX_RETRY_AFTER = 5
+# Предохранитель: после FAILURE_THRESHOLD ошибок подряд источник считается недоступным RESET_TIMEOUT сек
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+RETRY_STATUSES = {500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    def __init__(self, upstream: str, message: str, status: int = None):
+        super().__init__(message)
+        self.upstream = upstream
+        self.status = status
+
+
+class CircuitOpen(UpstreamError):
+    """Источник недавно сбоил — запрос не отправлялся."""
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас; acquire() ждёт, пока токен появится."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        # До этого момента запросы не отправляются (Retry-After от источника)
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Через сколько секунд будет свободный токен (0 — прямо сейчас)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def block_for(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = None
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+        # Полуоткрыт: пропускаем один пробный запрос, остальные отклоняем до его результата
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit opened after {self.failures} failures: {error}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Пробный запрос не дал ответа (отменён) — следующий снова может быть пробным."""
+        self._probing = False
+
+    def retry_in(self) -> float:
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+def parse_retry_after(value) -> float:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Flight:
+    """Запрос, который уже выполняется; waiters — сколько вызовов ждут его ответа."""
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class Upstream:
+    """Клиент одного внешнего API: общая сессия, ограничение частоты, повторы и предохранитель.
+
+    Одинаковые GET, пришедшие, пока такой же запрос ещё выполняется, к источнику не уходят:
+    они ждут ответа уже идущего запроса (при всплеске одинаковых поисков или открытий вакансии).
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, retries: int = MAX_RETRIES):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker()
+        self.retries = retries
+        self._session = None
+        self._flights = {}  # (url, параметры, заголовки) -> _Flight
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _set_state_metric(self):
+        metrics.upstream_breaker_state.set(
+            {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}[self.breaker.state],
+            self.name
+        )
+
+    async def get_json(self, url: str, params=None, headers=None, timeout: float = 10, metric: str = None):
+        """GET с повторами; UpstreamError — если ответа так и не получили, CircuitOpen — если и не пытались.
+
+        Каждый вызов получает свою копию ответа (разбирает общее тело сам) — её можно менять.
+        """
+        key = (url, json.dumps(params, sort_keys=True, default=str), json.dumps(headers, sort_keys=True))
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(
+                self._fetch(url, params, headers, timeout, metric)
+            ))
+            flight.task.add_done_callback(lambda task: self._landed(key, flight))
+        else:
+            metrics.upstream_coalesced.inc(self.name)
+        flight.waiters += 1
+        try:
+            body = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            # Ответ больше никому не нужен — запрос отменяется, как и без склейки
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()
+        return json.loads(body) if body.strip() else None
+
+    def _landed(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Ошибку получают ждавшие вызовы; помечаем её полученной, даже если их не осталось
+            flight.task.exception()
+
+    async def _fetch(self, url, params, headers, timeout, metric) -> bytes:
+        if not self.breaker.allow():
+            metrics.upstream_rejected.inc(self.name)
+            raise CircuitOpen(self.name, f"{self.name} недоступен, повтор через {self.breaker.retry_in():.0f} сек")
+        try:
+            result = await self._get_with_retries(url, params, headers, timeout, metric or self.name)
+        except UpstreamError as e:
+            if e.status is None or e.status in RETRY_STATUSES:
+                self.breaker.record_failure(str(e))
+            else:
+                # 4xx и ограничение частоты — источник жив
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record_success()
+            return result
+        finally:
+            self._set_state_metric()
+
+    async def _get_with_retries(self, url, params, headers, timeout, metric):
+        attempt = 0
+        while True:
+            retry_after = None
+            wait = self.bucket.delay()
+            if wait > MAX_RETRY_AFTER:
+                raise UpstreamError(self.name, f"{self.name}: лимит запросов, повтор через {wait:.0f} сек", 429)
+            await self.bucket.acquire()
+            try:
+                async with track_upstream(metric):
+                    async with self.session().get(url, params=params, headers=headers,
+                                                  timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                        if response.status == 200:
+                            return await response.read()
+                        body = await response.text()
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        raise UpstreamError(self.name, f"HTTP {response.status}: {body[:200]}", response.status)
+            except UpstreamError as e:
+                error = e
+                if e.status == 429 or (e.status == 503 and retry_after is not None):
+                    # Пауза для всех запросов к источнику, а не только для этого
+                    self.bucket.block_for(retry_after if retry_after is not None else RETRY_BASE_DELAY * 2 ** attempt)
+                elif e.status not in RETRY_STATUSES:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = UpstreamError(self.name, f"{type(e).__name__}: {e}")
+            if attempt >= self.retries:
+                raise error
+            attempt += 1
+            metrics.upstream_retries.inc(self.name)
+            if self.bucket.delay() <= 0:
+                await asyncio.sleep(RETRY_BASE_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+    async def wait_idle(self, reserve: float = 0.5):
+        """Для фоновых запросов: ждёт, пока в bucket не накопится запас (доля burst) для пользователей."""
+        while True:
+            wait = self.bucket.delay()
+            if wait <= 0 and self.bucket.tokens >= self.bucket.burst * reserve:
+                return
+            await asyncio.sleep(max(wait, 1 / self.bucket.rate))
+
+    def status(self) -> str:
+        breaker = self.breaker
+        if breaker.state == CircuitBreaker.OPEN:
+            return f"недоступен, повтор через {breaker.retry_in():.0f} сек ({breaker.last_error})"
+        if breaker.state == CircuitBreaker.HALF_OPEN:
+            return "проверяется"
+        if breaker.failures:
+            return f"ok, ошибок подряд: {breaker.failures}"
+        return "ok"
+
+
+hh = Upstream('hh', HH_RATE_LIMIT, burst=int(HH_RATE_LIMIT * 2))
+trudvsem = Upstream('trudvsem', TRUDVSEM_RATE_LIMIT, burst=int(TRUDVSEM_RATE_LIMIT * 2))
+UPSTREAMS = (hh, trudvsem)
+
+
+async def close_all():
+    for upstream in UPSTREAMS:
+        await upstream.close()
@@ -0,0 +1,183 @@
+import os
+import json
+import base64
+import asyncio
+import hashlib
+import logging
+
+from aiohttp import web
+
+from vacancy_store import VacancyStore
+
+logger = logging.getLogger(__name__)
+
+# Порт локального JSON API вакансий для веб-интерфейса; не задан — API выключен
+API_PORT = os.getenv("API_PORT")
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+# Origin фронтенда для CORS (http://localhost:5173); не задан — только same-origin/прокси Vite
+API_CORS_ORIGIN = os.getenv("API_CORS_ORIGIN")
+ENABLED = bool(API_PORT)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Сколько строк хранилища просматривать за запрос, если фильтры отсеивают почти всё:
+# страница может прийти неполной, но с курсором — клиент просто запрашивает следующую
+MAX_SCAN = 2000
+# Ответы меньше этого не сжимаются — gzip не окупается
+GZIP_MIN_SIZE = 1024
+
+EXPERIENCE_VALUES = {'noExperience', 'between1And3', 'between3And6'}
+
+
+class BadRequest(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def encode_cursor(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest("invalid cursor")
+    if not isinstance(data, dict):
+        raise BadRequest("invalid cursor")
+    return data
+
+
+def parse_prefs(query) -> dict:
+    """Фильтры из строки запроса в формате prefs из receive_preferences."""
+    prefs = {'schedule': None, 'salary': None, 'experience': None}
+    remote = query.get('remote', '').lower()
+    if remote in ('1', 'true', 'yes'):
+        prefs['schedule'] = 'remote'
+    elif remote not in ('', '0', 'false', 'no'):
+        raise BadRequest("remote must be 1 or 0")
+    if query.get('salary'):
+        try:
+            prefs['salary'] = int(query['salary'])
+        except ValueError:
+            raise BadRequest("salary must be an integer")
+    experience = query.get('experience')
+    if experience:
+        if experience not in EXPERIENCE_VALUES:
+            raise BadRequest(f"experience must be one of: {', '.join(sorted(EXPERIENCE_VALUES))}")
+        prefs['experience'] = experience
+    return prefs
+
+
+class VacancyApi:
+    """Только чтение: поиск по индексу Telegram-вакансий и просмотр vacancy_store по источникам.
+
+    GET /api/vacancies?q=&source=&remote=&salary=&experience=&limit=&cursor=
+      q — поиск по тому же индексу, что и в боте (только source=telegram);
+      без q — вакансии источника из хранилища, новые первыми.
+    Фильтры применяются так же, как в боте для этого источника (sources: источник -> (текст,
+    фильтр, вид для выдачи), как SUBSCRIPTION_SOURCES в main); для source=telegram — только salary,
+    remote и experience отклоняются с 400. Страницы — по курсору next_cursor,
+    а не по номеру: вставки новых вакансий не сдвигают уже отданные страницы.
+    """
+
+    def __init__(self, telegram, sources: dict, store: VacancyStore = None):
+        # telegram() -> (VacancyIndex, метка версии файла); курсор поиска годится только для этой версии
+        self.telegram = telegram
+        self.sources = sources
+        # Своё соединение: чтения идут в потоке, не мешая записям бота
+        self.store = store or VacancyStore()
+        self._runner = None
+
+    async def search(self, q: str, prefs: dict, limit: int, cursor: dict) -> dict:
+        index, stamp = await asyncio.to_thread(self.telegram)
+        version = '-'.join(map(str, stamp or ()))
+        if cursor and not isinstance(cursor.get('p'), int):
+            raise BadRequest("invalid cursor")
+        if cursor and cursor.get('v') != version:
+            raise BadRequest("cursor expired: vacancies were reloaded, start from the first page", 410)
+        vacancies, last = index.search_page(q, prefs, after=cursor.get('p', -1) if cursor else -1, limit=limit)
+        next_cursor = encode_cursor({'v': version, 'p': last}) if len(vacancies) == limit else None
+        return {'items': vacancies, 'next_cursor': next_cursor}
+
+    def browse(self, source: str, prefs: dict, limit: int, cursor: dict) -> dict:
+        _, matches, convert = self.sources[source]
+        before = (cursor['t'], cursor['k']) if cursor else None
+        items = []
+        scanned = 0
+        while len(items) < limit and scanned < MAX_SCAN:
+            batch = min(max(limit * 2, 100), MAX_SCAN - scanned)
+            rows = self.store.page(source, before, batch)
+            for first_seen, key, vac in rows:
+                before = (first_seen, key)
+                scanned += 1
+                if matches(vac, prefs):
+                    items.append(convert(vac))
+                    if len(items) >= limit:
+                        break
+            else:
+                if len(rows) < batch:
+                    # Источник закончился
+                    return {'items': items, 'next_cursor': None}
+        return {'items': items, 'next_cursor': encode_cursor({'t': before[0], 'k': before[1]})}
+
+    async def handle_vacancies(self, request):
+        query = request.query
+        try:
+            prefs = parse_prefs(query)
+            try:
+                limit = int(query.get('limit', DEFAULT_LIMIT))
+            except ValueError:
+                raise BadRequest("limit must be an integer")
+            limit = max(1, min(limit, MAX_LIMIT))
+            cursor = decode_cursor(query['cursor']) if query.get('cursor') else None
+            q = query.get('q', '').strip()
+            source = query.get('source', 'telegram')
+            if source not in self.sources:
+                raise BadRequest(f"source must be one of: {', '.join(self.sources)}")
+            # У постов Telegram нет полей графика и опыта — фильтр молча вернул бы всё подряд
+            if source == 'telegram' and (prefs['schedule'] or prefs['experience']):
+                raise BadRequest("remote and experience are not supported for source=telegram, only salary")
+            if q:
+                if source != 'telegram':
+                    raise BadRequest("q is only supported for source=telegram")
+                result = await self.search(q, prefs, limit, cursor)
+            else:
+                if cursor and not (isinstance(cursor.get('t'), (int, float)) and isinstance(cursor.get('k'), str)):
+                    raise BadRequest("invalid cursor")
+                result = await asyncio.to_thread(self.browse, source, prefs, limit, cursor)
+        except BadRequest as e:
+            return self.json_response(request, {'error': str(e)}, status=e.status)
+        return self.json_response(request, result)
+
+    def json_response(self, request, data: dict, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        headers = {'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if API_CORS_ORIGIN:
+            headers['Access-Control-Allow-Origin'] = API_CORS_ORIGIN
+            headers['Access-Control-Expose-Headers'] = 'ETag'
+        if status == 200:
+            # Слабый ETag: тело одинаковое и в сжатом, и в несжатом виде
+            etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            headers['ETag'] = etag
+            if etag in {tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')}:
+                return web.Response(status=304, headers=headers)
+        response = web.Response(body=body, status=status, content_type='application/json',
+                                charset='utf-8', headers=headers)
+        if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response.enable_compression(web.ContentCoding.gzip)
+        return response
+
+    async def start(self, host: str = API_HOST, port: int = None):
+        app = web.Application()
+        app.router.add_get('/api/vacancies', self.handle_vacancies)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, int(port or API_PORT)).start()
+        logger.info(f"Vacancy API: http://{host}:{port or API_PORT}/api/vacancies")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
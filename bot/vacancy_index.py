@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import bisect
+import asyncio
+import logging
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Сколько разных слов запроса помнить вместе с найденными для них вакансиями
+WORD_CACHE_SIZE = 2048
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+class VacancyIndex:
+    """Поиск по вакансиям из Telegram без просмотра всего списка на каждый запрос.
+
+    Совпадение то же, что и раньше: слово запроса — подстрока текста вакансии (название + пост).
+    Слово запроса не содержит пробелов, поэтому оно может встретиться только внутри одного
+    «слова» текста (куска между пробелами). Индекс хранит словарь таких кусков одной строкой
+    и для каждого — номера вакансий; поиск подстроки идёт по словарю, а не по всем постам.
+
+    В снимке (pickle) вакансии лежат JSON-строками: распаковка сотен тысяч словарей — основная
+    цена восстановления, а декодировать нужно только то, что попало в выдачу.
+    """
+
+    def __init__(self, vacancies: list):
+        self.vacancies = vacancies
+        postings = {}
+        self._salary_to = []
+        for position, vac in enumerate(vacancies):
+            text = (vac.get('name', '') + ' ' + vac.get('full_text', '')).lower()
+            for token in set(text.split()):
+                postings.setdefault(token, []).append(position)
+            self._salary_to.append((vac.get('salary') or {}).get('to'))
+        self.tokens = list(postings)
+        self.postings = [array('i', postings[token]) for token in self.tokens]
+        # Разделитель \n не встречается внутри кусков (split() режет и по нему)
+        self._blob = '\n'.join(self.tokens)
+        self._starts = []
+        offset = 0
+        for token in self.tokens:
+            self._starts.append(offset)
+            offset += len(token) + 1
+        self._word_cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.vacancies)
+
+    def vacancy(self, position: int) -> dict:
+        vac = self.vacancies[position]
+        return json.loads(vac) if isinstance(vac, str) else vac
+
+    def _matching(self, word: str) -> set:
+        cached = self._word_cache.get(word)
+        if cached is not None:
+            self._word_cache.move_to_end(word)
+            return cached
+        found = set()
+        blob, starts, postings = self._blob, self._starts, self.postings
+        seen = -1
+        at = blob.find(word)
+        while at != -1:
+            token_no = bisect.bisect_right(starts, at) - 1
+            if token_no != seen:
+                found.update(postings[token_no])
+                seen = token_no
+            # Дальше в этом куске искать незачем — переходим к следующему
+            next_start = starts[token_no + 1] if token_no + 1 < len(starts) else len(blob)
+            at = blob.find(word, max(at + 1, next_start))
+        self._word_cache[word] = found
+        if len(self._word_cache) > WORD_CACHE_SIZE:
+            self._word_cache.popitem(last=False)
+        return found
+
+    def search(self, query: str, prefs: dict, limit: int = 20) -> list:
+        return self.search_page(query, prefs, limit=limit)[0]
+
+    def search_page(self, query: str, prefs: dict, after: int = -1, limit: int = 20) -> tuple:
+        """(вакансии, позиция последней из них или None) — выдача search(), начиная после позиции after."""
+        positions = set()
+        for word in query.lower().split():
+            positions |= self._matching(word)
+        results = []
+        last = None
+        min_salary = prefs.get('salary')
+        # Порядок как в файле — как при последовательном просмотре
+        ordered = sorted(positions)
+        for position in ordered[bisect.bisect_right(ordered, after):]:
+            if min_salary:
+                salary_to = self._salary_to[position]
+                if salary_to and salary_to < min_salary:
+                    continue
+            results.append(self.vacancy(position))
+            last = position
+            if len(results) >= limit:
+                break
+        return results, last
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['vacancies'] = [vac if isinstance(vac, str) else json.dumps(vac, ensure_ascii=False)
+                              for vac in self.vacancies]
+        state['_word_cache'] = OrderedDict()
+        return state
+
+
+def _file_stamp(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _load_list(text: str) -> list:
+    """json.loads для JSON-массива, но по элементу за вызов.
+
+    Один json.loads большого файла держит GIL всё время разбора, и при сборке индекса в потоке
+    бот на это время замирает; между элементами поток отдаёт GIL циклу событий.
+    """
+    decoder = json.JSONDecoder()
+    match = _WHITESPACE.match
+    pos = match(text, 0).end()
+    if text[pos:pos + 1] != '[':
+        return json.loads(text)
+    pos = match(text, pos + 1).end()
+    items = []
+    if text[pos:pos + 1] == ']':
+        return items
+    while True:
+        item, pos = decoder.raw_decode(text, pos)
+        items.append(item)
+        pos = match(text, pos).end()
+        if text[pos:pos + 1] == ',':
+            pos = match(text, pos + 1).end()
+        elif text[pos:pos + 1] == ']' and not text[match(text, pos + 1).end():]:
+            return items
+        else:
+            raise ValueError(f"Expecting ',' or ']' at char {pos}")
+
+
+class VacancyFileIndex:
+    """Индекс JSON-файла вакансий, который парсер перезаписывает, пока бот работает.
+
+    Поиск берёт готовый индекс без проверки файла. Новая версия файла (уведомление после запуска
+    парсера или watch(), следящий за mtime/размером) индексируется в потоке, пока поиск идёт по
+    прежнему индексу, и подменяет его одним присваиванием — недостроенный индекс никто не видит.
+    """
+
+    def __init__(self):
+        self._loaded = (None, None, None)  # (путь, метка файла, индекс) — меняются только вместе
+        self._failed_stamp = None
+        self._reload_lock = asyncio.Lock()
+        self.generation = 0
+
+    @property
+    def path(self):
+        return self._loaded[0]
+
+    @property
+    def stamp(self):
+        return self._loaded[1]
+
+    @property
+    def index(self):
+        return self._loaded[2]
+
+    def get(self, path: str) -> VacancyIndex:
+        """Текущий индекс; строится здесь же, только если его ещё нет (первый поиск до фоновой сборки)."""
+        loaded_path, _, index = self._loaded
+        if index is None or path != loaded_path:
+            stamp = _file_stamp(path)
+            try:
+                index = self._build(path) if stamp else VacancyIndex([])
+            except (OSError, ValueError) as e:
+                logger.error(f"Can't load {path}: {e}")
+                index = VacancyIndex([])
+            self._swap(path, stamp, index)
+        return index
+
+    def loaded(self) -> tuple:
+        """(индекс, метка файла, по которой он построен) — согласованные между собой."""
+        _, stamp, index = self._loaded
+        return index, stamp
+
+    async def reload(self, path: str) -> bool:
+        """Переиндексирует файл в фоне, если он изменился; True — индекс заменён новым."""
+        async with self._reload_lock:
+            stamp = _file_stamp(path)
+            if not stamp or (path, stamp) == self._loaded[:2] or stamp == self._failed_stamp:
+                return False
+            try:
+                index = await asyncio.to_thread(self._build, path)
+            except (OSError, ValueError) as e:
+                # Недописанный или битый файл: остаёмся на прежнем индексе до следующего изменения
+                logger.error(f"Can't reload {path}: {e}")
+                self._failed_stamp = stamp
+                return False
+            self._swap(path, stamp, index)
+            return True
+
+    async def watch(self, path: str, interval: float):
+        """Следит за файлом (вакансии мог обновить и парсер, запущенный не ботом)."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload(path)
+            except Exception as e:
+                logger.error(f"Vacancy index reload error: {e}")
+
+    def _swap(self, path, stamp, index):
+        self._loaded = (path, stamp, index)
+        self.generation += 1
+
+    def _build(self, path: str) -> VacancyIndex:
+        started = time.perf_counter()
+        with open(path, 'r', encoding='utf-8') as f:
+            # Кусками: декодирование всего файла разом — тоже одна долгая операция под GIL
+            vacancies = _load_list(''.join(iter(lambda: f.read(1 << 20), '')))
+        index = VacancyIndex(vacancies)
+        logger.info(f"Indexed {len(index)} vacancies from {path} in {time.perf_counter() - started:.2f}s")
+        return index
+
+    def snapshot(self):
+        path, stamp, index = self._loaded
+        if index is None:
+            return None
+        return {'path': path, 'stamp': stamp, 'index': index}
+
+    def restore(self, snapshot) -> bool:
+        """Берёт индекс из снимка, если файл с тех пор не менялся."""
+        if not snapshot or _file_stamp(snapshot['path']) != snapshot['stamp']:
+            return False
+        self._swap(snapshot['path'], snapshot['stamp'], snapshot['index'])
+        return True
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+VACANCY_DB = os.getenv("VACANCY_DB", "bot/vacancies.db")
+# Вакансии, которые давно не приходили ни в одной выдаче, и старые выдачи удаляются при старте
+VACANCY_TTL = 14 * 24 * 60 * 60
+RESULTS_TTL = 2 * 24 * 60 * 60
+# Посты Telegram-каналов больше нигде не обновляются (история догружается --backfill парсера) — храним дольше
+SOURCE_TTL = {'telegram': 180 * 24 * 60 * 60}
+
+
+class VacancyStore:
+    """Локальная копия вакансий источников и выдач по запросам (запрос -> id вакансий по порядку).
+
+    Общая для процессов бота (SQLite, WAL). Вакансии хранятся в формате источника, ключ — source:id.
+    """
+
+    def __init__(self, path: str = VACANCY_DB):
+        self.path = path
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS vacancies ("
+                " key TEXT PRIMARY KEY,"
+                " source TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " first_seen REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_results ("
+                " source TEXT NOT NULL,"
+                " query TEXT NOT NULL,"
+                " keys TEXT NOT NULL,"
+                " found INTEGER NOT NULL,"
+                " fetched_at REAL NOT NULL,"
+                " PRIMARY KEY (source, query)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vacancies_updated ON vacancies (updated_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vacancies_source_seen ON vacancies (source, first_seen, key)")
+        return self._conn
+
+    def save_vacancies(self, source: str, vacancies: list) -> list:
+        """Добавляет или обновляет вакансии одной транзакцией; возвращает те, которых раньше не было."""
+        if not vacancies:
+            return []
+        conn = self._db()
+        now = time.time()
+        rows = {f"{source}:{vac['id']}": vac for vac in vacancies}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            known = set()
+            keys = list(rows)
+            # Ограничение SQLite на число параметров — проверяем кусками
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                known.update(row[0] for row in conn.execute(
+                    f"SELECT key FROM vacancies WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ))
+            conn.executemany(
+                "INSERT INTO vacancies (key, source, data, first_seen, updated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(key, source, json.dumps(vac, ensure_ascii=False), now, now) for key, vac in rows.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [vac for key, vac in rows.items() if key not in known]
+
+    def save_results(self, source: str, query: str, vacancies: list, found: int) -> list:
+        """Сохраняет выдачу по запросу; возвращает новые вакансии (как save_vacancies).
+
+        Первая выдача запроса (после деплоя, очистки или для новой подписки) — точка отсчёта:
+        всё в ней уже было опубликовано раньше, поэтому новыми не считается и возвращается [].
+        """
+        seen_before = self._db().execute(
+            "SELECT 1 FROM query_results WHERE source = ? AND query = ?", (source, query)
+        ).fetchone() is not None
+        new = self.save_vacancies(source, vacancies)
+        keys = [f"{source}:{vac['id']}" for vac in vacancies]
+        self._db().execute(
+            "INSERT OR REPLACE INTO query_results (source, query, keys, found, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (source, query, json.dumps(keys), found, time.time())
+        )
+        return new if seen_before else []
+
+    def get_results(self, source: str, query: str, max_age: float):
+        """(вакансии по порядку выдачи, всего найдено источником) или None, если выдачи нет или она старше max_age."""
+        conn = self._db()
+        row = conn.execute(
+            "SELECT keys, found FROM query_results WHERE source = ? AND query = ? AND fetched_at > ?",
+            (source, query, time.time() - max_age)
+        ).fetchone()
+        if row is None:
+            return None
+        keys = json.loads(row[0])
+        data = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            data.update(conn.execute(
+                f"SELECT key, data FROM vacancies WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return [json.loads(data[key]) for key in keys if key in data], row[1]
+
+    def page(self, source: str, before: tuple = None, limit: int = 100) -> list:
+        """[(first_seen, key, вакансия)] источника от новых к старым, после курсора before=(first_seen, key)."""
+        if before is None:
+            rows = self._db().execute(
+                "SELECT first_seen, key, data FROM vacancies WHERE source = ?"
+                " ORDER BY first_seen DESC, key DESC LIMIT ?", (source, limit)
+            )
+        else:
+            rows = self._db().execute(
+                "SELECT first_seen, key, data FROM vacancies WHERE source = ? AND (first_seen, key) < (?, ?)"
+                " ORDER BY first_seen DESC, key DESC LIMIT ?", (source, *before, limit)
+            )
+        return [(first_seen, key, json.loads(data)) for first_seen, key, data in rows]
+
+    def count(self, source: str = None) -> int:
+        if source is None:
+            return self._db().execute("SELECT COUNT(*) FROM vacancies").fetchone()[0]
+        return self._db().execute("SELECT COUNT(*) FROM vacancies WHERE source = ?", (source,)).fetchone()[0]
+
+    def purge(self) -> int:
+        conn = self._db()
+        now = time.time()
+        conn.execute("DELETE FROM query_results WHERE fetched_at < ?", (now - RESULTS_TTL,))
+        purged = conn.execute(
+            f"DELETE FROM vacancies WHERE updated_at < ? AND source NOT IN ({','.join('?' * len(SOURCE_TTL))})",
+            (now - VACANCY_TTL, *SOURCE_TTL)
+        ).rowcount
+        for source, ttl in SOURCE_TTL.items():
+            purged += conn.execute(
+                "DELETE FROM vacancies WHERE updated_at < ? AND source = ?", (now - ttl, source)
+            ).rowcount
+        return purged
@@ -0,0 +1,131 @@
+import os
+import hmac
+import signal
+import asyncio
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Публичный адрес, который регистрируется в Telegram (https://bot.example.com); путь добавляется автоматически
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token (1–256 символов A-Z, a-z, 0-9, _ и -).
+# Обязателен: у всех воркеров за балансировщиком и после перезапуска секрет должен быть одним и тем же
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Выбросить апдейты, накопившиеся у Telegram, при регистрации вебхука (по умолчанию — нет:
+# это апдейты, пришедшие во время деплоя или перезапуска воркера)
+WEBHOOK_DROP_PENDING = os.getenv("WEBHOOK_DROP_PENDING", "").lower() in ('1', 'true', 'yes')
+# Сколько ждать обработки уже принятых апдейтов при остановке
+WEBHOOK_DRAIN_TIMEOUT = 30
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """HTTP-приёмник апдейтов: проверяет секрет и кладёт апдейт в очередь Application."""
+
+    def __init__(self, application, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret or WEBHOOK_SECRET
+        if not self.secret:
+            raise RuntimeError("WEBHOOK_SECRET is not set")
+        self.draining = False
+        self._runner = None
+
+    async def handle_update(self, request):
+        token = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            return web.Response(status=403)
+        if self.draining:
+            # Telegram повторит доставку — апдейт заберёт следующий экземпляр или этот после перезапуска
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.warning(f"Bad webhook payload: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(self, request):
+        return web.Response(status=503 if self.draining else 200, text='draining' if self.draining else 'ok')
+
+    async def start(self):
+        app = web.Application(client_max_size=1024 * 1024)
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        self._runner = web.AppRunner(app, access_log=None, shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        if not self.port:
+            self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Перестаёт принимать апдейты; уже принятые дообрабатывает application.stop()."""
+        self.draining = True
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def register_webhook(bot, url: str, secret: str, drop_pending_updates: bool):
+    """Регистрирует вебхук, если он ещё не указывает на url: каждый воркер при старте не перерегистрирует
+    его заново. 403 в последней ошибке доставки — сменился WEBHOOK_SECRET, регистрируем с новым."""
+    info = await bot.get_webhook_info()
+    if info.url == url and not drop_pending_updates and '403' not in (info.last_error_message or ''):
+        logger.info(f"Webhook already set to {url}, {info.pending_update_count} pending updates")
+        return
+    await bot.set_webhook(
+        url=url,
+        secret_token=secret,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=drop_pending_updates,
+    )
+    logger.info(f"Webhook set to {url}")
+
+
+async def run_webhook(application, drop_pending_updates=WEBHOOK_DROP_PENDING):
+    """Аналог run_polling для вебхуков на встроенном aiohttp-сервере; завершается по SIGINT/SIGTERM."""
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is not set")
+    server = WebhookServer(application)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await register_webhook(application.bot, f"{WEBHOOK_URL.rstrip('/')}{server.path}", server.secret,
+                               drop_pending_updates)
+        await application.start()
+        logger.info("Webhook mode started")
+        await stop_event.wait()
+
+        logger.info("Stopping: draining in-flight updates...")
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        # Порядок как у run_polling: post_shutdown — после закрытия бота и очереди исходящих
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)